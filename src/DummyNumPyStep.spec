@@ -0,0 +1,10 @@
+#
+# Spec file of stpipe.TestSteps.DummyNumPyStep (see DummyStep.spec).
+# 
+# Definitions of parameter keys and values.
+[parameters]
+    # Number of sigma-clipping iterations used to estimate the background.
+    iterations = integer(min=1, default=3)
+    # Pixels further than clip standard deviations from the background are 
+    # masked.
+    clip = float(min=0, default=3.0)
@@ -26,8 +26,18 @@
 # TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
 # USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
 # DAMAGE.
+import atexit
+import collections
+import cStringIO
+import glob
+import os
+import threading
+import traceback
+from multiprocessing.pool import ThreadPool
+
 from Step import Step
 import models
+import tiling
 
 import pyfits
 from pyfits.core import PrimaryHDU, TableHDU
@@ -39,33 +49,139 @@ from pyfits.core import PrimaryHDU, TableHDU
 class FitsImageIOStep(Step):
     """
     Read/write images in FITS format using PyFITS.
+    
+    Pixel data is only read when (and if) it is accessed, not when the file is
+    opened. If the memmap parameter is True, the file is memory-mapped and 
+    pixel data is paged in as needed. Either way, the file stays open as long 
+    as the resulting models.Image instance needs it: use its close() method to
+    release it. If the preload parameter is True (and memmap is False), the 
+    pixel data of all extensions is read right away instead, up to io_threads
+    extensions at the same time, and the file is closed.
+    
+    file_name can be a list of file names and/or glob patterns. The files are
+    then read concurrently (up to io_threads at the same time) and the Step
+    outputs one Image per file, either in as many outputs or as a list in its
+    only output. In batch runs, the files of upcoming inputs can be read in 
+    the background (see prefetch()).
+    
+    Subclasses doing pixel work define process_tile() (see Step), 
+    process_plane() and/or process_extension(): functions of a pixel array 
+    returning an array of the same shape (or, for process_extension(), a new 
+    array), applied as images are read. Single images are then split into 
+    tiles of tile_shape pixels (plus tile_halo pixels on every side), data 
+    cubes into planes and MEFs into extensions, which are all processed in 
+    parallel by `processes` worker processes (see the tiling module). Data 
+    cubes and MEFs fall back to process_tile() if they have no more specific
+    function.
     """
+    # Defaults for the optional parameters.
+    memmap = False
+    io_threads = 4
+    preload = False
+    processes = tiling.DEFAULT_PROCESSES
+    
+    # Pixel work, if any (see above and Step.process_tile).
+    process_plane = None
+    process_extension = None
+    
     def process(self):
-        hdus = [h for h in pyfits.open(self.file_name) \
-                if not isinstance(h, TableHDU)]
+        file_names = _expand_file_names(self.file_name)
+        images = _take_prefetched(self, self.file_name)
+        if(images is None):
+            images = self._read_files(file_names, self.preload)
         
-        self.log.info('Opened image %s and found %d extension(s).' \
-                      % (self.file_name, len(hdus)))
+        # Finally, create instance variables to hold the result: one Image per
+        # output if there are as many outputs as files, the Image or the list
+        # of Images in the first output otherwise.
+        keys = [info[0] for info in self.output_info]
+        if(len(images) > 1 and len(keys) == len(images)):
+            for (key, image) in zip(keys, images):
+                setattr(self, key, image)
+        elif(len(images) == 1):
+            setattr(self, keys[0], images[0])
+        else:
+            setattr(self, keys[0], images)
+        return(0)
+    
+    
+    def prefetch(self, parameter, value):
+        """
+        Start reading (with preload) the file(s) `value` of a future run in a 
+        background thread. The run with file_name = `value` then uses the 
+        result instead of reading the files again.
+        """
+        if(parameter != 'file_name'):
+            return
+        _start_prefetch(self, value)
+        return
+    
+    
+    def cancel_prefetch(self, parameter, value=None):
+        """
+        Forget the reading of the file(s) `value` (of all the files prefetched
+        for the Step if None) started by self.prefetch() if still unused.
+        """
+        if(parameter != 'file_name'):
+            return
+        _drop_prefetched(self, value)
+        return
+    
+    
+    def _read_files(self, file_names, preload):
+        """
+        Read each FITS file in `file_names`, up to io_threads at the same time,
+        and return the list of corresponding models.Image instances.
+        """
+        if(len(file_names) == 1):
+            return([self._read_file(file_names[0], preload)])
+        return(_thread_map(lambda f: self._read_file(f, preload), file_names, 
+                           self.io_threads))
+    
+    
+    def _read_file(self, file_name, preload):
+        """
+        Read the FITS file `file_name` and return a models.Image instance. If
+        `preload` is True, read the pixel data of all the extensions (up to 
+        io_threads at the same time) right away and close the file.
+        """
+        fits_file = pyfits.open(file_name, memmap=self.memmap)
+        indices = [i for (i, h) in enumerate(fits_file) \
+                   if not isinstance(h, TableHDU)]
+        hdus = [fits_file[i] for i in indices]
+        if(preload and not self.memmap):
+            if(len(hdus) > 1):
+                # Each thread reads from its own file handle.
+                hdus = _thread_map(lambda i: _load_hdu(file_name, i), indices, 
+                                   self.io_threads)
+            else:
+                [h.data for h in hdus]
+            fits_file.close()
+            fits_file = None
+        
+        self.log.info('Opened image %s and found %d extension(s).', 
+                      file_name, len(hdus))
         
         # Do we have several extensions, a data cube or a simple single 
-        # extension?
+        # extension? Look at the header: hdu.data would read the pixels.
         processed = None
         if(len(hdus) == 1):
             # case 1 or 3: data cube or SIF.
             hdu = hdus[0]
-            if(len(hdu.data.shape) > 2):
+            naxis = hdu.header.get('NAXIS', 0)
+            if(naxis > 2):
                 processed = self.process_cube(image=hdu)
-            elif(len(hdu.data.shape) == 2):
+            elif(naxis == 2):
                 processed = self.process_sif(image=hdu)
             else:
+                if(fits_file is not None):
+                    fits_file.close()
                 raise(NotImplementedError('1-D images are not supported.'))
         # Case 2: MEF.
         else:
-            processed = self.process_mef(image=hdus)
+            processed = self.process_mef(images=hdus)
         
-        # Finally, create an instance variable to hold the result.
-        setattr(self, self.output_info[0][0], models.Image(processed))
-        return(0)
+        # The image owns the file (if still open) from now on.
+        return(models.Image(processed, fits_file=fits_file))
     
     
     def process_cube(self, image):
@@ -73,6 +189,11 @@ class FitsImageIOStep(Step):
         Process a data cube.
         """
         self.log.info('Processing a data cube.')
+        if(self.process_plane is not None):
+            image.data = tiling.map_planes(self.process_plane, image.data, 
+                                           self.processes)
+        elif(self.process_tile is not None):
+            image.data = self.map_tiles(image.data, self.processes)
         return([image, ])
     
     
@@ -81,6 +202,8 @@ class FitsImageIOStep(Step):
         Process a single-extension FITS file.
         """
         self.log.info('Processing a single-extension FITS file.')
+        if(self.process_tile is not None):
+            image.data = self.map_tiles(image.data, self.processes)
         return([image, ])
     
     
@@ -89,24 +212,448 @@ class FitsImageIOStep(Step):
         Process a multi-extension FITS file.
         """
         self.log.info('Processing a multi-extension FITS file.')
+        hdus = [h for h in images if h.header.get('NAXIS', 0) > 0]
+        if(self.process_extension is not None and hdus):
+            results = tiling.map_arrays(self.process_extension, 
+                                        [h.data for h in hdus], 
+                                        self.processes)
+            for (hdu, data) in zip(hdus, results):
+                hdu.data = data
+        elif(self.process_tile is not None):
+            for hdu in hdus:
+                hdu.data = self.map_tiles(hdu.data, self.processes)
         return(images)
 
 
 
 
 
+def _expand_file_names(file_name):
+    """
+    Return the list of files `file_name` (a file name, a glob pattern or a 
+    list thereof) refers to, in order.
+    """
+    if(isinstance(file_name, basestring)):
+        file_name = [file_name]
+    file_names = []
+    for pattern in file_name:
+        if(glob.has_magic(pattern)):
+            matches = sorted(glob.glob(pattern))
+            if(not matches):
+                raise(IOError('No file matches %s.' % (pattern)))
+            file_names += matches
+        else:
+            file_names.append(pattern)
+    return(file_names)
+
+
+
+def _thread_map(func, items, max_threads):
+    """
+    Return [func(item) for item in items], computed by up to `max_threads` 
+    threads.
+    """
+    num_threads = max(1, min(max_threads, len(items)))
+    if(num_threads == 1):
+        return([func(item) for item in items])
+    pool = ThreadPool(num_threads)
+    try:
+        return(pool.map(func, items, chunksize=1))
+    finally:
+        pool.close()
+        pool.join()
+
+
+
+def _load_hdu(file_name, index):
+    """
+    Return HDU number `index` of the FITS file `file_name`, with its data read
+    in memory (the file is closed).
+    """
+    fits_file = pyfits.open(file_name, memmap=False)
+    try:
+        hdu = fits_file[index]
+        hdu.data
+    finally:
+        fits_file.close()
+    return(hdu)
+
+
+
+class _Prefetch(object):
+    """
+    The reading of the files of a future FitsImageIOStep run, in a thread.
+    """
+    def __init__(self, step, file_name):
+        self.images = None
+        self.error = None
+        self._thread = threading.Thread(target=self._run, 
+                                        args=(step, file_name))
+        self._thread.setDaemon(True)
+        self._thread.start()
+        return
+    
+    
+    def _run(self, step, file_name):
+        try:
+            self.images = step._read_files(_expand_file_names(file_name), True)
+        except Exception as e:
+            self.error = e
+        return
+    
+    
+    def result(self):
+        self._thread.join()
+        if(self.error is not None):
+            raise(self.error)
+        return(self.images)
+
+
+
+# Prefetched reads, keyed by (Step qualified name, file_name). Entries are 
+# removed when used or, by whoever asked for them (see batch.BatchRunner), 
+# once their run is over.
+_PREFETCHED = {}
+_PREFETCH_LOCK = threading.Lock()
+
+
+
+def _prefetch_key(step, file_name):
+    if(not isinstance(file_name, basestring)):
+        file_name = tuple(file_name)
+    return((step.qualified_name, file_name))
+
+
+
+def _start_prefetch(step, file_name):
+    key = _prefetch_key(step, file_name)
+    with _PREFETCH_LOCK:
+        if(key not in _PREFETCHED):
+            _PREFETCHED[key] = _Prefetch(step, file_name)
+    return
+
+
+
+def _take_prefetched(step, file_name):
+    """
+    Return the Images prefetched for `step` and `file_name` (waiting for them
+    if needed) or None if there are none.
+    """
+    with _PREFETCH_LOCK:
+        prefetch = _PREFETCHED.pop(_prefetch_key(step, file_name), None)
+    if(prefetch is None):
+        return(None)
+    return(prefetch.result())
+
+
+
+def _drop_prefetched(step, file_name=None):
+    """
+    Forget the Images prefetched for `step` and `file_name`, or for all files
+    if None.
+    """
+    with _PREFETCH_LOCK:
+        if(file_name is not None):
+            _PREFETCHED.pop(_prefetch_key(step, file_name), None)
+            return
+        for key in [k for k in _PREFETCHED if k[0] == step.qualified_name]:
+            del(_PREFETCHED[key])
+    return
+
 
 
 
 
+class FitsImageWriterStep(Step):
+    """
+    Write the models.Image instance on the clipboard (under the key of the 
+    first input) to the FITS file file_name, in the background.
+    
+    The image is encoded in FITS format in memory right away (so that other 
+    Steps are free to modify it afterwards) and handed over to a writer 
+    thread, which writes it to disk in blocks of buffer_size KB while the 
+    Pipeline moves on. At most max_pending MB of images wait to be written at
+    any time: beyond that, the Step blocks until the writer catches up. 
+    
+    Files are written under a temporary name and renamed once complete. With
+    fsync set to 'each', each file is synced to disk before being renamed; 
+    with 'end', all files are synced by flush(), which the Pipeline calls at 
+    the end of each run and which also waits for pending writes and reports
+    write errors. close() also stops the writer thread.
+    
+    Each copy of the Step (see Step.clone()), and each process, has its own
+    writer thread, created when it first writes.
+    """
+    # Defaults for the optional parameters.
+    clobber = True
+    max_pending = 256
+    buffer_size = 4096
+    fsync = 'never'
+    
+    def process(self):
+        image = getattr(self, self.input_info[0][0])
+        file_name = self._next_file_name()
+        if(not self.clobber and os.path.exists(file_name)):
+            raise(IOError('%s already exists.' % (file_name)))
+        
+        buffer = cStringIO.StringIO()
+        pyfits.HDUList(image.to_hdu_list()).writeto(buffer, 
+                                                     output_verify='silentfix')
+        data = buffer.getvalue()
+        
+        self._get_writer().write(file_name, data)
+        self.log.info('Queued %d bytes for %s.', len(data), file_name)
+        return(0)
+    
+    
+    def flush(self):
+        """
+        Wait for all queued images to be written (and synced, if fsync is 
+        'end'). Raise an exception if any write failed.
+        """
+        writer = self._own_writer()
+        if(writer is not None):
+            writer.flush()
+        return
+    
+    
+    def close(self):
+        """
+        Wait for all queued images to be written (see self.flush()) and stop 
+        the writer thread.
+        """
+        writer = self._own_writer()
+        self.__dict__.pop('_writer', None)
+        if(writer is not None):
+            writer.close()
+        return
+    
+    
+    def clone(self, pipeline):
+        """
+        Same as Step.clone(), but the copy gets its own writer thread.
+        """
+        step = Step.clone(self, pipeline)
+        step.__dict__.pop('_writer', None)
+        return(step)
+    
+    
+    def __getstate__(self):
+        # Threads cannot be pickled: the unpickled Step creates its own.
+        state = Step.__getstate__(self)
+        state.pop('_writer', None)
+        return(state)
+    
+    
+    def _next_file_name(self):
+        """
+        Return file_name with {count}, {index} and {input} replaced. In 
+        batches and streams, {count} and {index} are the index of the input 
+        (unique across worker processes) and {input} its file name without 
+        directory and extension. Otherwise, {count} is the number of images 
+        written so far by all the copies of the Step in this process (see 
+        Step.clone()).
+        """
+        if(self.input_index is not None):
+            count = self.input_index
+        else:
+            with _WRITERS_LOCK:
+                key = (self.qualified_name, self.file_name)
+                count = _COUNTS.get(key, 0)
+                _COUNTS[key] = count + 1
+        item = self.input_item
+        if(isinstance(item, (list, tuple)) and item):
+            item = item[0]
+        if(isinstance(item, basestring)):
+            item = os.path.splitext(os.path.basename(item))[0]
+        return(self.file_name.format(count=count, index=self.input_index, 
+                                     input=item))
+    
+    
+    def _get_writer(self):
+        """
+        Return the _BackgroundWriter of the Step, creating it if needed. 
+        """
+        with _WRITERS_LOCK:
+            writer = self._own_writer()
+            if(writer is None):
+                writer = _BackgroundWriter(self.max_pending * 1024 * 1024, 
+                                           self.buffer_size * 1024, 
+                                           self.fsync)
+                _WRITERS.add(writer)
+                self._writer = writer
+        return(writer)
+    
+    
+    def _own_writer(self):
+        """
+        Return the _BackgroundWriter of the Step, if any, unless it was 
+        inherited from the parent process (after a fork, its thread is gone).
+        """
+        writer = self.__dict__.get('_writer')
+        if(writer is None or writer.pid != os.getpid()):
+            return(None)
+        return(writer)
 
 
 
+# Protects the lazy creation of FitsImageWriterStep writers and file counts.
+_WRITERS_LOCK = threading.Lock()
+_COUNTS = {}
+# The running _BackgroundWriter instances.
+_WRITERS = set()
+# Tells a _BackgroundWriter thread to exit.
+_STOP = None
 
 
 
+def _close_writers():
+    """
+    Do not lose queued images if the interpreter exits: close the writers 
+    started by this process.
+    """
+    for writer in list(_WRITERS):
+        if(writer.pid != os.getpid()):
+            continue
+        try:
+            writer.close()
+        except Exception:
+            traceback.print_exc()
+    return
+atexit.register(_close_writers)
 
 
 
 
 
+class _BackgroundWriter(object):
+    """
+    A thread writing (file name, data string) jobs to disk in order. At most
+    `max_pending` bytes can be queued: write() blocks beyond that. The thread
+    runs until close() is called.
+    """
+    def __init__(self, max_pending, buffer_size, fsync):
+        self.max_pending = max_pending
+        self.buffer_size = buffer_size
+        self.fsync = fsync
+        
+        self._cond = threading.Condition()
+        self._jobs = collections.deque()
+        # Bytes queued or being written.
+        self._pending = 0
+        # Files waiting for flush() to sync them (fsync == 'end').
+        self._unsynced = []
+        self._error = None
+        self._closed = False
+        
+        self.pid = os.getpid()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+        return
+    
+    
+    def write(self, file_name, data):
+        """
+        Queue `data` to be written to `file_name`.
+        """
+        with self._cond:
+            if(self._closed):
+                raise(IOError('Cannot write %s: writer closed.' % (file_name)))
+            self._raise_error()
+            while(self._pending and 
+                  self._pending + len(data) > self.max_pending):
+                self._cond.wait()
+            self._jobs.append((file_name, data))
+            self._pending += len(data)
+            self._cond.notify_all()
+        return
+    
+    
+    def flush(self):
+        """
+        Wait for the queue to be empty, sync the files which need it and raise
+        an exception if any write failed.
+        """
+        with self._cond:
+            while(self._pending):
+                self._cond.wait()
+            unsynced = self._unsynced
+            self._unsynced = []
+            self._raise_error()
+        for file_name in unsynced:
+            f = open(file_name, 'rb')
+            try:
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+        return
+    
+    
+    def close(self):
+        """
+        Wait for the queue to be empty (see self.flush()), then stop the 
+        writer thread.
+        """
+        if(self._closed):
+            return
+        try:
+            self.flush()
+        finally:
+            with self._cond:
+                self._closed = True
+                self._jobs.append(_STOP)
+                self._cond.notify_all()
+            self._thread.join()
+            with _WRITERS_LOCK:
+                _WRITERS.discard(self)
+        return
+    
+    
+    def _raise_error(self):
+        # Call with self._cond acquired.
+        if(self._error is not None):
+            error = self._error
+            self._error = None
+            raise(IOError('Background write failed: %s' % (error)))
+        return
+    
+    
+    def _run(self):
+        while(True):
+            with self._cond:
+                while(not self._jobs):
+                    self._cond.wait()
+                if(self._jobs[0] is _STOP):
+                    self._jobs.popleft()
+                    break
+                (file_name, data) = self._jobs[0]
+            try:
+                self._write(file_name, data)
+            except Exception as e:
+                with self._cond:
+                    if(self._error is None):
+                        self._error = '%s: %s' % (file_name, e)
+            with self._cond:
+                self._jobs.popleft()
+                self._pending -= len(data)
+                self._cond.notify_all()
+        return
+    
+    
+    def _write(self, file_name, data):
+        tmp_name = '%s.%d.part' % (file_name, os.getpid())
+        f = open(tmp_name, 'wb', self.buffer_size)
+        try:
+            for start in range(0, len(data), self.buffer_size):
+                f.write(data[start:start + self.buffer_size])
+            f.flush()
+            if(self.fsync == 'each'):
+                os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.rename(tmp_name, file_name)
+        if(self.fsync == 'end'):
+            with self._cond:
+                self._unsynced.append(file_name)
+        return
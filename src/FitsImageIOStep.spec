@@ -13,11 +13,26 @@
 # 
 # Definitions of parameter keys and values.
 [parameters]
-    # Name/pattern of the FITS file to read.
-    file_name = string()
+    # Name/pattern of the FITS file to read, or list thereof.
+    file_name = force_list()
     
     # Name of the Python class to use to represent the FITS file internally.
     class_name = string()
-
-
-
+    
+    # Memory-map the file (pixel data is then paged in only when accessed).
+    memmap = boolean(default=False)
+    
+    # Maximum number of files/extensions to read at the same time.
+    io_threads = integer(min=1, default=4)
+    
+    # Read the pixel data of all extensions right away (unless memmap is True).
+    preload = boolean(default=False)
+    
+    # Number of worker processes for parallel pixel work (0: one per CPU).
+    processes = integer(min=0, default=0)
+    
+    # Size (rows, columns) of the tiles single images are split into.
+    tile_shape = int_list(min=2, max=2, default=list(1024, 1024))
+    
+    # Number of extra pixels around each tile (for filters needing neighbours).
+    tile_halo = integer(min=0, default=0)
@@ -0,0 +1,35 @@
+#
+# This is a spec file, meaning that it is a configuration file for a Step
+# confguration file. A meta-configuration file, if you will. As such, it tells
+# the system which parameters should be present in the Step parameters config
+# file section, which ones are optional and their default values. The same for
+# the input and output sections as well.
+# 
+# Spec files are Step specific and are an optional but integral part of each
+# Step subclass definition.
+# 
+# Spec files are optional but if present they are used for configuration file
+# validation and default value support (not implemented yet).
+# 
+# Definitions of parameter keys and values.
+[parameters]
+    # Name of the FITS file to write. "{count}" is replaced by the number of
+    # images written by the Step before this one (e.g. "out_{count:04d}.fits")
+    # or, in batches and streams, by the index of the input, as is "{index}".
+    # "{input}" is replaced by the input file name without directory and 
+    # extension (e.g. "{input}_proc.fits").
+    file_name = string()
+    
+    # Overwrite existing files?
+    clobber = boolean(default=True)
+    
+    # Maximum size (in MB) of the images waiting to be written: beyond that,
+    # the Step blocks until the background writer catches up.
+    max_pending = integer(min=1, default=256)
+    
+    # Size (in KB) of the blocks written to disk at once.
+    buffer_size = integer(min=1, default=4096)
+    
+    # When to fsync written files to disk: never, after each file or at the 
+    # end of the Pipeline run.
+    fsync = option('never', 'each', 'end', default='never')
@@ -0,0 +1,56 @@
+#
+# This is a spec file, meaning that it is a configuration file for a Step
+# confguration file. A meta-configuration file, if you will. As such, it tells
+# the system which parameters should be present in the Step parameters config
+# file section, which ones are optional and their default values. The same for
+# the input and output sections as well.
+# 
+# Spec files are Step specific and are an optional but integral part of each
+# Step subclass definition.
+# 
+# Spec files are optional but if present they are used for configuration file
+# validation and default value support (not implemented yet).
+# 
+# Definitions of parameter keys and values.
+[parameters]
+    # The command to execute. Required and no default value assigned.
+    command = string()
+    
+    # Its arguments. It is a list and it might be empty.
+    arguments = string_list(min=0, default=[])
+    
+    # Do we want to log STDOUT?
+    log_stdout = boolean(default=True)
+    
+    
+    # Do we want to log STDERR?
+    log_stderr = boolean(default=True)
+    
+    # Pass the command exit code through?
+    exitcode_passthrough = boolean(default=True)
+    
+    # Optionally, write the command STDOUT/STDERR to these files ({index} is 
+    # replaced with the index of the argument set).
+    stdout_file = string(default=None)
+    stderr_file = string(default=None)
+    
+    # How many lines of STDOUT/STDERR to keep in memory (and to log in case of 
+    # errors if they are not logged already).
+    tail_lines = integer(min=0, default=100)
+    
+    # Kill the command if it runs longer than this many seconds (0: no limit).
+    timeout = float(min=0, default=0)
+    
+    # The argument sets, one per invocation of the command. Each one is a 
+    # string of whitespace separated values replacing the {0}, {1} etc. 
+    # placeholders in arguments (or appended to arguments if it has none).
+    argument_sets = string_list(min=0, default=[])
+    
+    # Optionally, the name of the clipboard input holding the argument sets.
+    argument_sets_key = string(default=None)
+    
+    # How many invocations of the command can run at the same time.
+    max_concurrency = integer(min=1, default=4)
+    
+    # The name of the clipboard output holding the list of results.
+    results_key = string(default='results')
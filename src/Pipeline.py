@@ -31,11 +31,20 @@ Pipeline
 
 
 """
+import copy
 import logging
+import threading
 
 
 import config_parser
+import logs
 import utilities
+from cache import StepCache
+from checkpoint import Checkpoint
+from clipboard import SpillingClipboard
+from profiling import Profiler
+from scheduler import ThreadPoolScheduler, AsyncScheduler, ProcessBackend
+from scheduler import key_users, step_keys
 
 
 
@@ -47,6 +56,23 @@ DEFAULT_PIPELINE_NAME = 'DefaultPipeline'
 DEFAULT_SYSTEM_NAME = 'DefaultSystem'
 DEFAULT_LOG_LEVEL = 'DEBUG'
 DEFAULT_LOCAL_LOGS = False
+DEFAULT_MAX_WORKERS = 1
+DEFAULT_MAX_PROCESSES = 0
+DEFAULT_CACHE_DIR = None
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CHECKPOINT_DIR = None
+DEFAULT_FREE_CLIPBOARD = False
+DEFAULT_FINAL_PRODUCTS = ()
+DEFAULT_CLIPBOARD_BUDGET = 0
+DEFAULT_SPILL_DIR = None
+DEFAULT_SPILL_COMPRESS = False
+DEFAULT_LAZY_STEPS = False
+DEFAULT_PROFILE = False
+DEFAULT_PROFILE_DIR = None
+DEFAULT_CPROFILE = False
+DEFAULT_TRACK_MEMORY = False
+DEFAULT_MEMORY_WARNING = 0
+DEFAULT_ASYNC_LOGS = False
 
 
 
@@ -58,15 +84,101 @@ class Pipeline(object):
                  name=DEFAULT_PIPELINE_NAME, 
                  system=DEFAULT_SYSTEM_NAME, 
                  log_level=DEFAULT_LOG_LEVEL, 
-                 local_logs=DEFAULT_LOCAL_LOGS):
+                 local_logs=DEFAULT_LOCAL_LOGS,
+                 max_workers=DEFAULT_MAX_WORKERS,
+                 max_processes=DEFAULT_MAX_PROCESSES,
+                 cache_dir=DEFAULT_CACHE_DIR,
+                 cache_size=DEFAULT_CACHE_SIZE,
+                 checkpoint_dir=DEFAULT_CHECKPOINT_DIR,
+                 free_clipboard=DEFAULT_FREE_CLIPBOARD,
+                 final_products=DEFAULT_FINAL_PRODUCTS,
+                 clipboard_budget=DEFAULT_CLIPBOARD_BUDGET,
+                 spill_dir=DEFAULT_SPILL_DIR,
+                 spill_compress=DEFAULT_SPILL_COMPRESS,
+                 lazy_steps=DEFAULT_LAZY_STEPS,
+                 profile=DEFAULT_PROFILE,
+                 profile_dir=DEFAULT_PROFILE_DIR,
+                 cprofile=DEFAULT_CPROFILE,
+                 track_memory=DEFAULT_TRACK_MEMORY,
+                 memory_warning=DEFAULT_MEMORY_WARNING,
+                 async_logs=DEFAULT_ASYNC_LOGS):
         """
         Configure the Pipeline instance.
+        
+        If `max_workers` is larger than 1, Steps with no data dependency on 
+        each other are run concurrently on a pool of `max_workers` threads.
+        
+        Steps whose backend is 'process' are executed in a pool of 
+        `max_processes` worker processes (one per CPU if 0).
+        
+        If `cache_dir` is given, the outputs of Steps with memoize set to True
+        are cached there (see cache), up to `cache_size` MB.
+        
+        If `checkpoint_dir` is given, the clipboard is saved there after each 
+        Step (see checkpoint), so that failed runs can be resumed.
+        
+        If `free_clipboard` is True, clipboard entries are deleted as soon as 
+        the last Step consuming or producing them is done, except for the keys
+        in `final_products`.
+        
+        If `clipboard_budget` is larger than 0, the clipboard holds at most 
+        that many MB of values in memory, spilling the least recently used 
+        ones to `spill_dir` (optionally compressed, see `spill_compress` and 
+        clipboard.SpillingClipboard).
+        
+        If `lazy_steps` is True, Pipeline configuration files are turned into
+        Steps which are only created when first needed (see 
+        Step.DeferredStep and convenience.pipeline_from_config_file()).
+        
+        If `profile` is True, the timings of each Step are recorded during each
+        run and logged at its end, and saved as JSON to `profile_dir` if given
+        (see profiling). If `cprofile` is True, Step.process() also runs under
+        cProfile, its statistics saved to `profile_dir` (or the current 
+        directory). If `track_memory` is True, the memory use of each Step and
+        the size of its outputs are recorded as well, with a warning when the
+        process memory goes over `memory_warning` MB (if larger than 0, which
+        implies `track_memory`).
+        
+        Log messages go to <qualified name>.log if `local_logs` is True, to 
+        stderr otherwise, written by a background thread if `async_logs` is 
+        True (see logs). Pipelines sharing a qualified name share the same log
+        handler, created with the first of them.
         """
         self.name = name
         self.system = system
         self.qualified_name = '%s.%s' % (self.system, self.name)
         self.log_level = getattr(logging, log_level)
         self.local_logs = local_logs
+        self.async_logs = async_logs
+        self.max_workers = max_workers
+        self.max_processes = max_processes
+        self.process_backend = ProcessBackend(max_processes)
+        self.step_cache = None
+        if(cache_dir):
+            self.step_cache = StepCache(cache_dir, cache_size * 1024 * 1024)
+        self.checkpoint = None
+        if(checkpoint_dir):
+            self.checkpoint = Checkpoint(checkpoint_dir)
+        self.clipboard_budget = clipboard_budget
+        self.spill_dir = spill_dir
+        self.spill_compress = spill_compress
+        self.lazy_steps = lazy_steps
+        self.track_memory = track_memory or memory_warning > 0
+        self.memory_warning = memory_warning
+        self.profile = profile or cprofile or self.track_memory
+        self.profile_dir = profile_dir
+        self.cprofile = cprofile
+        self.free_clipboard = free_clipboard
+        self.final_products = set(final_products)
+        # Number of Steps using each clipboard key (see configure()) and, 
+        # during a run, of those not done yet.
+        self._key_users = {}
+        self._pending_users = {}
+        self._users_lock = threading.Lock()
+        # Names of the Steps already completed when resuming a run.
+        self._completed = set()
+        # If True, Steps are not flushed at the end of each run (see flush()).
+        self.defer_flush = False
         self.steps = []
         # The clipboard is a dictionary for input and output data (consumed and
         # produced by Steps). Steps get items from the clipboard, work on 
@@ -74,24 +186,17 @@ class Pipeline(object):
         # get from the clipboard is defined in the Step configuration file in 
         # the input_keys dictionary. What to put back is defined in the Step 
         # configuration file, in the output_keys dictionary.
-        self.clipboard = {}
-        
-        # Now create a logger.
-        logger = logging.getLogger(self.qualified_name)
-        logger.setLevel(self.log_level)
-        extra = {'classname': self.qualified_name}
-        
-        fmt = '%(asctime)s - %(classname)s - %(levelname)s - %(message)s'
-        formatter = logging.Formatter(fmt)
+        self.clipboard = self.new_clipboard()
+        # Per-Step timings of the current run, if self.profile (see profiling).
+        self.profiler = self.new_profiler()
         
+        # Now get a logger (only set up the first time, see logs).
+        log_file = None
         if(local_logs):
-            handler = logging.FileHandler('%s.log' % (self.qualified_name))
-        else:
-            handler = logging.StreamHandler()
-        handler.setLevel(self.log_level)
-        handler.setFormatter(formatter)
-        
-        logger.addHandler(handler)
+            log_file = '%s.log' % (self.qualified_name)
+        logger = logs.get_logger(self.qualified_name, self.log_level, log_file, 
+                                 async_logs)
+        extra = {'classname': self.qualified_name}
         self.log = logging.LoggerAdapter(logger, extra)
         
         # Log the fact that we have been init-ed.
@@ -106,21 +211,254 @@ class Pipeline(object):
         initialized.
         """
         self.steps = steps
+        self._key_users = key_users(steps)
+        
+        # Start the worker processes now, if any Step needs them: better fork
+        # before running Steps in threads.
+        if([s for s in steps if s.backend == 'process']):
+            self.process_backend.start()
         
         self.log.info('Pipeline configured and steps added.')
         return
     
     
+    def clone(self):
+        """
+        Return a copy of the Pipeline with its own, empty, clipboard and its 
+        own copies of the Steps (see Step.clone()). The copy shares everything
+        else (configuration, logger, worker processes) with the original.
+        """
+        pipe = copy.copy(self)
+        pipe.clipboard = pipe.new_clipboard()
+        pipe.profiler = pipe.new_profiler()
+        pipe.checkpoint = None
+        pipe.steps = [step.clone(pipe) for step in self.steps]
+        return(pipe)
+    
+    
+    def close(self):
+        """
+        Release the resources (e.g. worker processes, spill directory, Step 
+        writer threads) held by the Pipeline.
+        """
+        self.close_steps()
+        self.process_backend.close()
+        if(isinstance(self.clipboard, SpillingClipboard)):
+            self.clipboard.cleanup()
+        return
+    
+    
+    def close_steps(self):
+        """
+        Close the Steps (see Step.close()) but nothing shared with the copies
+        of the Pipeline (see self.clone()).
+        """
+        for step in self.steps:
+            step.close()
+        return
+    
+    
+    def flush(self):
+        """
+        Wait for the background work of all Steps (e.g. pending writes) to be
+        done (see Step.flush()).
+        """
+        for step in self.steps:
+            step.flush()
+        return
+    
+    
     def run(self):
         """
         Execute each Step in self.steps in turn and ten exit.
+        
+        If self.max_workers is larger than 1, Steps are run as soon as all the
+        Steps they depend on (according to their clipboard input and output 
+        keys) are done, up to self.max_workers at the same time.
         """
-        for step in self.steps:
-            self.log.info('Starting Step %s' % (step.name))
-            error = step.run()
-            if(error):
-                raise(Exception('Step %s exited with error code %d' \
-                      % (step.name, error)))
+        self._start_run()
+        if(self.max_workers > 1):
+            scheduler = ThreadPoolScheduler(self.max_workers, self.log)
+            scheduler.run(self.steps, self._run_step)
+        else:
+            for step in self.steps:
+                self._run_step(step)
+        self._end_run()
+        return
+    
+    
+    def run_async(self):
+        """
+        Execute the Steps in self.steps as coroutines on an event loop (see 
+        eventloop and Step.run_async()). Steps are run as soon as all the 
+        Steps they depend on (according to their clipboard input and output 
+        keys) are done, with no limit on how many run at the same time. This 
+        lets a single thread drive many I/O or subprocess bound Steps, e.g. 
+        SystemCallStep instances.
+        """
+        self._start_run()
+        scheduler = AsyncScheduler(self.log)
+        scheduler.run(self.steps, self._run_step_async)
+        self._end_run()
+        return
+    
+    
+    def resume(self, asynchronous=False):
+        """
+        Resume a failed run from its checkpoint (see checkpoint_dir in 
+        self.__init__()): restore the clipboard as it was saved after the last
+        successful Step and run the Steps which did not complete, with 
+        self.run() or, if `asynchronous` is True, self.run_async(). Without 
+        a checkpoint, simply run all Steps.
+        """
+        run = asynchronous and self.run_async or self.run
+        if(self.checkpoint is None or not self.checkpoint.exists()):
+            self.log.info('No checkpoint to resume from: running all Steps.')
+            return(run())
+        
+        self._completed = set(self.checkpoint.load(self.clipboard))
+        self.log.info('Resuming from checkpoint in %s (%d Step(s) done).', 
+                      self.checkpoint.directory, len(self._completed))
+        try:
+            run()
+        finally:
+            self._completed = set()
+        return
+    
+    
+    def _start_run(self):
+        """
+        Start checkpointing, unless we are resuming from a checkpoint, and 
+        reset the clipboard key usage counts and the profiler.
+        """
+        if(self.checkpoint is not None and not self._completed):
+            self.checkpoint.start(self.clipboard)
+        self._pending_users = dict(self._key_users)
+        if(self.profiler is not None):
+            self.profiler.start_run()
+        return
+    
+    
+    def _end_run(self):
+        """
+        Clean up after a successful run: once all Steps are flushed (unless 
+        self.defer_flush), the checkpoint is not needed anymore.
+        """
+        if(not self.defer_flush):
+            self.flush()
+        if(self.checkpoint is not None):
+            self.checkpoint.remove()
+        if(self.step_cache is not None):
+            self.log.info('Step cache: %s', self.step_cache.summary())
+        if(isinstance(self.clipboard, SpillingClipboard)):
+            self.log.info('Clipboard: %s', self.clipboard.summary())
+        if(self.profiler is not None):
+            self.log_profile(self.profiler)
+        return
+    
+    
+    def log_profile(self, profiler):
+        """
+        Log the Step timings of the run recorded by `profiler` (see 
+        self.new_profiler()) and save its report if self.profile_dir is set.
+        """
+        self.log.info('Step timings (s):\n%s', profiler.summary())
+        if(self.profile_dir):
+            self.log.info('Profile report written to %s.', profiler.save())
+        return
+    
+    
+    def new_clipboard(self):
+        """
+        Return a new, empty, clipboard: a SpillingClipboard if the Pipeline has
+        a clipboard budget, a dictionary otherwise.
+        """
+        if(self.clipboard_budget > 0):
+            return(SpillingClipboard(self.clipboard_budget * 1024 * 1024, 
+                                     self.spill_dir, 
+                                     self.spill_compress))
+        return({})
+    
+    
+    def new_profiler(self):
+        """
+        Return a new profiling.Profiler if self.profile, None otherwise.
+        """
+        if(not self.profile):
+            return(None)
+        return(Profiler(self.qualified_name, self.profile_dir, self.cprofile, 
+                        self.track_memory, self.memory_warning * 1024 * 1024))
+    
+    
+    def _run_step(self, step):
+        """
+        Run a single Step and raise an exception if it exits with an error.
+        """
+        if(step.name in self._completed):
+            self.log.info('Step %s already done: skipping.', step.name)
+            self._free_keys(step)
+            return
+        self.log.info('Starting Step %s', step.name)
+        error = step.run()
+        if(error):
+            raise(Exception('Step %s exited with error code %d' \
+                  % (step.name, error)))
+        if(self.checkpoint is not None):
+            self.checkpoint.step_done(step, self.clipboard)
+        self.release_values(step)
+        self._free_keys(step)
+        return
+    
+    
+    def _run_step_async(self, step):
+        """
+        Coroutine version of self._run_step().
+        """
+        if(step.name in self._completed):
+            self.log.info('Step %s already done: skipping.', step.name)
+            self._free_keys(step)
+            return
+        self.log.info('Starting Step %s', step.name)
+        error = yield(step.run_async())
+        if(error):
+            raise(Exception('Step %s exited with error code %d' \
+                  % (step.name, error)))
+        if(self.checkpoint is not None):
+            self.checkpoint.step_done(step, self.clipboard)
+        self.release_values(step)
+        self._free_keys(step)
+        return
+    
+    
+    def release_values(self, step):
+        """
+        If clipboard values may be dropped (self.free_clipboard) or spilled to
+        disk (clipboard budget), make `step` forget its inputs and outputs 
+        once done, so that doing so actually frees their memory.
+        """
+        if(self.free_clipboard or self.clipboard_budget > 0):
+            step.release(step_keys(step))
+        return
+    
+    
+    def _free_keys(self, step):
+        """
+        `step` is done: if self.free_clipboard, delete the clipboard entries 
+        no other Step needs anymore (unless they are final products).
+        """
+        if(not self.free_clipboard):
+            return
+        freed = []
+        with self._users_lock:
+            for key in step_keys(step):
+                self._pending_users[key] -= 1
+                if(not self._pending_users[key] and 
+                   key not in self.final_products and key in self.clipboard):
+                    del(self.clipboard[key])
+                    freed.append(key)
+        if(freed and self.log.isEnabledFor(logging.DEBUG)):
+            self.log.debug('Freed clipboard key(s) %s after Step %s.', 
+                           ', '.join(sorted(freed)), step.name)
         return
     
 
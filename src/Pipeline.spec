@@ -19,6 +19,61 @@
     # the work directory. Otherwise they are printed to STDOUT only.
     local_log_mode = boolean(default=False)
     
+    # Maximum number of Steps to run at the same time. Steps are run 
+    # concurrently only if they do not depend on each other's clipboard 
+    # input/output keys. The default (1) runs Steps serially, in order.
+    max_workers = integer(min=1, default=1)
+    
+    # Number of worker processes for Steps with backend = "process". The 
+    # default (0) is one worker process per CPU.
+    max_processes = integer(min=0, default=0)
+    
+    # Directory where to cache the outputs of Steps with memoize = True. No
+    # caching is done if not set.
+    cache_dir = string(default=None)
+    
+    # Maximum size of the Step output cache, in MB.
+    cache_size = integer(min=0, default=1024)
+    
+    # Directory where to save the clipboard after each Step, in order to be 
+    # able to resume failed runs. No checkpointing is done if not set.
+    checkpoint_dir = string(default=None)
+    
+    # Delete clipboard entries as soon as the last Step consuming or producing
+    # them is done, except for those listed in final_products.
+    free_clipboard = boolean(default=False)
+    final_products = string_list(default=list())
+    
+    # Maximum size, in MB, of the clipboard values kept in memory: beyond 
+    # that, the least recently used ones are spilled to disk (in spill_dir,
+    # zlib-compressed if spill_compress is true). The default (0) means no 
+    # limit.
+    clipboard_budget = integer(min=0, default=0)
+    spill_dir = string(default=None)
+    spill_compress = boolean(default=False)
+    
+    # Only import the class of each Step, and create it, right before it is 
+    # first needed (e.g. run).
+    lazy_steps = boolean(default=False)
+    
+    # Record the timings of each Step and log them at the end of each run, 
+    # also saving them as JSON to profile_dir if given. With cprofile, the 
+    # process() method of each Step is run under cProfile as well, its 
+    # statistics dumped to profile_dir.
+    profile = boolean(default=False)
+    profile_dir = string(default=None)
+    cprofile = boolean(default=False)
+    
+    # Also record the memory used by the process after each Step and the size
+    # of the Step outputs, warning when the memory used goes over 
+    # memory_warning MB (0 means never; a threshold implies track_memory).
+    track_memory = boolean(default=False)
+    memory_warning = integer(min=0, default=0)
+    
+    # Write log messages from a background thread instead of in the thread
+    # logging them.
+    async_logs = boolean(default=False)
+    
     # Now the step definitions, in order of execution.
     [[steps]]
         [[[__many__]]]
@@ -26,5 +81,18 @@
         python_class = string()
         input = force_list(default=list())
         output = force_list(default=list())
+        # Where the Step process() method is executed: "local" (in the 
+        # pipeline process) or "process" (in a pool of worker processes).
+        backend = option('local', 'process', default='local')
+        # Number of concurrent copies of the Step when streaming.
+        concurrency = integer(min=1, default=1)
+        # Whether to cache the Step outputs (see cache_dir).
+        memoize = boolean(default=False)
+        # Tiling of the pixel work of Steps defining process_tile(): tile 
+        # size (rows, columns), extra pixels around each tile and number of 
+        # worker processes (0: one per CPU). Unset, the Step defaults apply.
+        tile_shape = int_list(min=2, max=2, default=None)
+        tile_halo = integer(min=0, default=None)
+        tile_processes = integer(min=0, default=None)
 
 
@@ -31,15 +31,30 @@ Step
 
 
 """
+import copy
 import logging
+import threading
 
 import config_parser
+import eventloop
+import profiling
 import utilities
-from stpipe import DEFAULT_PIPELINE
 
 
 
 
+# Constants/Default Values.
+# Where Step.process() is executed: 'local' (in the calling process) or 
+# 'process' (in a worker process, see scheduler.ProcessBackend).
+DEFAULT_BACKEND = 'local'
+# Number of concurrent copies of the Step when streaming (see streaming).
+DEFAULT_CONCURRENCY = 1
+# Whether to look Step outputs up in the Pipeline step cache (see cache).
+DEFAULT_MEMOIZE = False
+# Per-Step tiling options (see Step.process_tile), only passed to Steps when 
+# set in the Pipeline configuration.
+TILE_OPTIONS = ('tile_shape', 'tile_halo', 'tile_processes')
+
 class StepType(type):
     """
     Simple metaclass to monkeypatch Step and its subclasses: replace __call__
@@ -62,6 +77,25 @@ class Step(object):
     """
     __metaclass__ = StepType
     
+    # Index and value of the input being processed when the Pipeline runs 
+    # over a batch or stream of inputs (see batch and streaming).
+    input_index = None
+    input_item = None
+    # The profiling.Profiler recording the runs of the Step when not that of 
+    # the Pipeline (e.g. one per streamed input, see streaming).
+    _profiler = None
+    
+    # Pixel work, if any: a process_tile(data) method returning an array with
+    # the same shape as `data`. If defined, it is applied to the models.Image
+    # inputs of the Step (and lists thereof) before self.process(), split in 
+    # tiles of (at most) tile_shape pixels plus tile_halo pixels on every 
+    # side, processed in parallel by tile_processes worker processes (0 
+    # meaning one per CPU, see tiling and self.map_tiles()).
+    process_tile = None
+    tile_shape = [1024, 1024]
+    tile_halo = 0
+    tile_processes = 0
+    
     @classmethod
     def from_parsed_config(cls, pipeline_config, pipeline):
         """
@@ -92,29 +126,41 @@ class Step(object):
         # validation as well. If not keep going.
         step_spec_file = utilities.find_spec_file(step_class)
         if(not step_spec_file):
-            pipeline.log.debug("No spec file for Step %s." \
-                               % (pipeline_config['name']))
+            pipeline.log.debug("No spec file for Step %s.", 
+                               pipeline_config['name'])
         else:
-            pipeline.log.debug("Step %s specfile: %s" \
-                               % (pipeline_config['name'], step_spec_file))
+            pipeline.log.debug("Step %s specfile: %s", 
+                               pipeline_config['name'], step_spec_file)
         # Now do the actual parsing and, if we do have a spec file, validate as 
         # well.
         if(step_config_file):
             step_config = config_parser.loads(step_config_file, 
                                                specfile=step_spec_file)
-            parameters = step_config.get('parameters', {})
+        parameters = dict(step_config.get('parameters', {}))
+        
+        # Tiling options set in the Pipeline configuration apply unless the 
+        # Step configuration has its own.
+        for key in TILE_OPTIONS:
+            if(pipeline_config.get(key) is not None):
+                parameters.setdefault(key, pipeline_config[key])
         
         # Now we have everything we need to create a Step instance.
         return(step_class(name=pipeline_config['name'], 
                            pipeline=pipeline,
                            input_info=pipeline_config.get('input', []),
                            output_info=pipeline_config.get('output', []),
+                           backend=pipeline_config.get('backend', 
+                                                       DEFAULT_BACKEND),
+                           concurrency=pipeline_config.get('concurrency', 
+                                                           DEFAULT_CONCURRENCY),
+                           memoize=pipeline_config.get('memoize', 
+                                                       DEFAULT_MEMOIZE),
                            **parameters))
     
     
     
     @classmethod
-    def from_config_file(cls, config_file, pipeline=DEFAULT_PIPELINE, name=''):
+    def from_config_file(cls, config_file, pipeline=None, name=''):
         """
         Create a Step instance from a ConfigObj/INI configuration file 
         `config_file` which specifies the Pipeline steps, data directories
@@ -122,8 +168,12 @@ class Step(object):
         
         This is used in scripts where users create Steps manually without using
         a Pipeline class. In these cases, we just use teh default Pipeline 
-        instance created for us by 
+        instance created for us by stpipe (stpipe.DEFAULT_PIPELINE), unless 
+        `pipeline` is given.
         """
+        if(pipeline is None):
+            from stpipe import DEFAULT_PIPELINE as pipeline
+        
         # Since we do not have a proper Pipeline instance with its configuration
         # file to give us our name, we will generate one, based on the number of
         # Steps already added to `pipeline`.
@@ -134,9 +184,9 @@ class Step(object):
         # validation as well. If not keep going.
         spec_file = utilities.find_spec_file(cls)
         if(not spec_file):
-            pipeline.log.debug("No spec file for Step %s." % ('name'))
+            pipeline.log.debug("No spec file for Step %s.", name)
         else:
-            pipeline.log.debug("Step %s specfile: %s" % (name, spec_file))
+            pipeline.log.debug("Step %s specfile: %s", name, spec_file)
         # Now do the actual parsing and, if we do have a spec file, validate as 
         # well.
         config = config_parser.loads(config_file, specfile=spec_file)
@@ -157,7 +207,9 @@ class Step(object):
         
     
     
-    def __init__(self, name, pipeline, input_info, output_info, **kws):
+    def __init__(self, name, pipeline, input_info, output_info, 
+                 backend=DEFAULT_BACKEND, concurrency=DEFAULT_CONCURRENCY, 
+                 memoize=DEFAULT_MEMOIZE, **kws):
         """
         Configure the Step instance.
         """
@@ -167,6 +219,10 @@ class Step(object):
                               % (self.pipeline.qualified_name, self.name)
         self.input_info = input_info
         self.output_info = output_info
+        self.backend = backend
+        self.concurrency = concurrency
+        self.memoize = memoize
+        self.parameters = kws
         
         # Define the parameters inline.
         for (key, val) in kws.items():
@@ -182,7 +238,7 @@ class Step(object):
         self.log = logging.LoggerAdapter(logger, extra)
         
         # Log the fact that we have been init-ed.
-        self.log.info('%s instance created.' % (self.__class__.__name__))
+        self.log.info('%s instance created.', self.__class__.__name__)
         return
     
     
@@ -195,23 +251,159 @@ class Step(object):
         processing, put the data back in the clipboard, creating new entries or
         updating old entries as specified in self.output_info.
         """
-        self.log.info('Step %s starting.' % (self.name))
+        self.log.info('Step %s starting.', self.name)
+        profile = self._start_profile()
         
         # Populate self.inbox from the content of the clipboard. What to put 
         # there is stored in self.input_info.
         self._get_data_from_clipbaord(clipboard_check)
+        profile.lap('clipboard_get')
         
-        # Run the Step-specific code.
-        err = self.process()
-        self.log.info('Step %s done (return value: %s).' \
-                      % (self.name, str(err)))
+        # Run the Step-specific code, either here or in a worker process, 
+        # unless our outputs are in the cache already.
+        (cache, cache_key, cache_hit) = self._cache_lookup()
+        profile.lap('cache')
+        if(not cache_hit):
+            self._process_tiles()
+        if(cache_hit):
+            err = 0
+        elif(self.backend == 'process'):
+            err = self.pipeline.process_backend.run(self)
+        else:
+            err = profile.call(self.process)
+        profile.lap('process')
+        self.log.info('Step %s done (return value: %s).', self.name, err)
+        if(cache is not None and not cache_hit and not err):
+            cache.store(cache_key, self)
+        profile.lap('cache')
         
         # Now update the clipboard.
         self._put_data_to_clipboard(clipboard_check)
+        profile.lap('clipboard_put')
+        profile.stop(err)
         return(err)
     
     
     
+    def _start_profile(self):
+        """
+        Return the profiling.StepProfile of this run of the Step if the Step
+        or the Pipeline has a profiler, profiling.NO_PROFILE otherwise.
+        """
+        profiler = self._profiler
+        if(profiler is None):
+            profiler = getattr(self.pipeline, 'profiler', None)
+        if(profiler is None):
+            return(profiling.NO_PROFILE)
+        return(profiler.start_step(self))
+    
+    
+    
+    def _cache_lookup(self):
+        """
+        If self.memoize is True and the Pipeline has a step cache, look our 
+        outputs up in the cache, restoring them if found. Return (cache, key,
+        hit) where cache is None if we do not use one. The key has to be 
+        computed before running the Step, which could modify its inputs.
+        """
+        cache = getattr(self.pipeline, 'step_cache', None)
+        if(not self.memoize or cache is None):
+            return((None, None, False))
+        
+        key = cache.key(self)
+        if(not cache.restore(key, self)):
+            self.log.info('Step %s not in cache (key %s).', self.name, key)
+            return((cache, key, False))
+        self.log.info('Step %s outputs restored from cache (key %s).', 
+                      self.name, key)
+        return((cache, key, True))
+    
+    
+    
+    def __getstate__(self):
+        """
+        Pickle support (used to run Steps in worker processes): leave the 
+        Pipeline, its clipboard, profiler and the logger out.
+        """
+        state = self.__dict__.copy()
+        for key in ('pipeline', '_clipboard', '_profiler', 'log'):
+            state.pop(key, None)
+        state['_logger_name'] = self.log.logger.name
+        return(state)
+    
+    
+    
+    def __setstate__(self, state):
+        """
+        Unpickle support: recreate the logger. The Step is not attached to any
+        Pipeline.
+        """
+        logger = logging.getLogger(state.pop('_logger_name'))
+        self.__dict__.update(state)
+        self.pipeline = None
+        self._clipboard = {}
+        self.log = logging.LoggerAdapter(logger, 
+                                         {'classname': self.qualified_name})
+        return
+    
+    
+    
+    def clone(self, pipeline):
+        """
+        Return a copy of the Step attached to `pipeline` and its clipboard. 
+        Parameters are shared with the original Step instance but instance 
+        variables set later on (e.g. from the clipboard) are not.
+        """
+        step = copy.copy(self)
+        step.pipeline = pipeline
+        step._clipboard = pipeline.clipboard
+        return(step)
+    
+    
+    
+    def run_async(self, clipboard_check=True):
+        """
+        Coroutine version of self.run() (see eventloop). If the Step defines a
+        process_async() coroutine, that is used instead of self.process(). 
+        Otherwise, self.process() is called in a separate thread, so that it 
+        does not block the event loop.
+        """
+        self.log.info('Step %s starting.', self.name)
+        profile = self._start_profile()
+        
+        # Populate self.inbox from the content of the clipboard. What to put 
+        # there is stored in self.input_info.
+        self._get_data_from_clipbaord(clipboard_check)
+        profile.lap('clipboard_get')
+        
+        # Run the Step-specific code, unless our outputs are in the cache.
+        (cache, cache_key, cache_hit) = self._cache_lookup()
+        profile.lap('cache')
+        if(not cache_hit and self.process_tile is not None):
+            yield(eventloop.CallInThread(self._process_tiles))
+        if(cache_hit):
+            err = 0
+        elif(self.backend == 'process'):
+            backend = self.pipeline.process_backend
+            err = yield(eventloop.CallInThread(backend.run, self))
+        elif(hasattr(self, 'process_async')):
+            err = yield(self.process_async())
+        else:
+            err = yield(eventloop.CallInThread(profile.call, self.process))
+        profile.lap('process')
+        self.log.info('Step %s done (return value: %s).', self.name, err)
+        if(cache is not None and not cache_hit and not err):
+            cache.store(cache_key, self)
+        profile.lap('cache')
+        
+        # Now update the clipboard.
+        self._put_data_to_clipboard(clipboard_check)
+        profile.lap('clipboard_put')
+        profile.stop(err)
+        raise(eventloop.Return(err))
+    
+    
+    
     def run_standalone(self, input=None, output=None):
         """
         This is a wrapper around self.run() mainly for the case in which users 
@@ -246,39 +438,20 @@ class Step(object):
         instance variables of Step (and defined in the output parameter of the 
         same configuration block) are put in the clipboard.
         """
-        for clipboard_info in self.input_info:
-            # clipboard_info is a tuple. It either has a single element, which 
-            # is the name of the clipboard key to fetch, or two elements: the
-            # clipboard key (same as before) and the corresponding object type
-            # for optional type checking (clipboard_check == True).
-            # Either way, put data in self.inbox in the order it is defined in
-            # self.input_info.
-            if(not utilities.islist_tuple(clipboard_info) or
-               not len(clipboard_info) in (0, 1, 2)):
-                raise(Exception('Step %s: malformed inbox info %s.' \
-                                % (self.name, clipboard_info)))
-            if(not clipboard_info):
-                # Nothing to do.
-                continue
-            elif(len(clipboard_info) == 2):
-                    [key_name, class_name] = clipboard_info
-            elif(len(clipboard_info) == 1):
-                key_name = clipboard_info[0]
-                class_name = None
+        # self.input_info was compiled into self._input_plan (see 
+        # _compile_io_plan()) when it was set.
+        clipboard = self._clipboard
+        for (key_name, cls) in self._input_plan:
+            value = clipboard[key_name]
             
-            # Populate self.inbox but check types first if we need to.
-            value = self._clipboard[key_name]
-            if(clipboard_check):
-                self.log.debug('Checking clipboard input types.')
-                if(not class_name):
-                    self.log.debug('No class information to do the check.')
-                else:
-                    cls = utilities.import_class(class_name)
-                    assert(isinstance(value, cls))
-                    self.log.debug('Clipboard input types are OK.')
+            # Check types if we need to.
+            if(clipboard_check and cls is not None):
+                assert(isinstance(value, cls))
             
             # Now create/update the instance variable.
             setattr(self, key_name, value)
+        if(clipboard_check and self._input_plan):
+            self.log.debug('Clipboard input types are OK.')
         return
     
     
@@ -297,52 +470,292 @@ class Step(object):
         instance variables of Step (and defined in the output parameter of the 
         same configuration block) are put in the clipboard.
         """
-        for clipboard_info in self.output_info:
-            # clipboard_info is a tuple. It either has a single element, which 
-            # is the name of the clipboard key to fetch, or two elements: the
-            # clipboard key (same as before) and the corresponding object type
-            # for optional type checking (clipboard_check == True).
-            # Either way, put data in self.inbox in the order it is defined in
-            # self.input_info.
-            if(not (isinstance(clipboard_info, tuple) or 
-                    isinstance(clipboard_info, list)) or
-               not len(clipboard_info) in (0, 1, 2)):
-                raise(Exception('Step %s: malformed output info %s.' \
-                                % (self.name, clipboard_info)))
-            if(not clipboard_info):
-                # Nothing to do.
-                continue
-            elif(len(clipboard_info) == 2):
-                    [key_name, class_name] = clipboard_info
-            elif(len(clipboard_info) == 1):
-                key_name = clipboard_info[0]
-                class_name = None
-            
-            # Fetch value from self.<key_name> but check types first if we need 
+        # self.output_info was compiled into self._output_plan (see 
+        # _compile_io_plan()) when it was set.
+        clipboard = self._clipboard
+        for (key_name, cls) in self._output_plan:
+            # Fetch value from self.<key_name> but check types first if we need
             # to.
             value = getattr(self, key_name)
-            if(clipboard_check):
-                self.log.debug('Checking clipboard output types.')
-                if(not class_name):
-                    self.log.debug('No class information to do the check.')
-                else:
-                    cls = utilities.import_class(class_name)
-                    assert(isinstance(value, cls))
-                    self.log.debug('Clipboard output types are OK.')
+            if(clipboard_check and cls is not None):
+                assert(isinstance(value, cls))
             
             # Now update the clipboard.
-            self._clipboard[key_name] = value
+            clipboard[key_name] = value
+        if(clipboard_check and self._output_plan):
+            self.log.debug('Clipboard output types are OK.')
+        return
+    
+    
+    
+    def _compile_io_plan(self, io_info, kind):
+        """
+        Turn the input or output (`kind`) information `io_info` of the Step 
+        into a list of (clipboard key, class or None) tuples, resolving class
+        names once and for all.
+        
+        io_info is a list of tuples. Each tuple either has a single element,
+        which is the name of the clipboard key, or two elements: the clipboard 
+        key (same as before) and the corresponding object type for optional 
+        type checking (clipboard_check == True). Empty tuples are ignored.
+        """
+        plan = []
+        for clipboard_info in io_info:
+            if(not utilities.islist_tuple(clipboard_info) or
+               not len(clipboard_info) in (0, 1, 2)):
+                raise(Exception('Step %s: malformed %s info %s.' \
+                                % (self.name, kind, clipboard_info)))
+            if(not clipboard_info):
+                # Nothing to do.
+                continue
+            cls = None
+            if(len(clipboard_info) == 2 and clipboard_info[1]):
+                cls = utilities.import_class(clipboard_info[1])
+            plan.append((clipboard_info[0], cls))
+        return(plan)
+    
+    
+    def _get_input_info(self):
+        return(self._input_info)
+    
+    
+    def _set_input_info(self, input_info):
+        self._input_plan = self._compile_io_plan(input_info, 'input')
+        self._input_info = input_info
+        return
+    
+    
+    def _get_output_info(self):
+        return(self._output_info)
+    
+    
+    def _set_output_info(self, output_info):
+        self._output_plan = self._compile_io_plan(output_info, 'output')
+        self._output_info = output_info
         return
     
+    input_info = property(_get_input_info, _set_input_info)
+    output_info = property(_get_output_info, _set_output_info)
+    
     
     
     def process(self):
         """
         This is where real work happens. Every Step subclass has to override
-        this method. The default behaviour is to raise a NotImplementedError
-        exception.
+        this method, unless all it does is pixel work (see process_tile). The
+        default behaviour is to raise a NotImplementedError exception in the 
+        former case, to do nothing in the latter.
         """
+        if(self.process_tile is not None):
+            return(0)
         raise(NotImplementedError('Steps have to override process().'))
+    
+    
+    def map_tiles(self, data, processes=None):
+        """
+        Apply self.process_tile() to the tiles of the pixel array `data` (see
+        tile_shape and tile_halo) using `processes` worker processes 
+        (self.tile_processes by default) and return the stitched result.
+        """
+        import tiling
+        
+        if(processes is None):
+            processes = self.tile_processes
+        self.log.info('Processing %s pixels in tiles of %s (halo %d) with %s '
+                      'process(es).', 'x'.join(map(str, data.shape)), 
+                      'x'.join(map(str, self.tile_shape)), 
+                      self.tile_halo, processes or 'one per CPU')
+        return(tiling.map_tiles(self.process_tile, data, self.tile_shape, 
+                                self.tile_halo, processes))
+    
+    
+    def _process_tiles(self):
+        """
+        Apply self.process_tile(), if defined, to the pixels of the 
+        models.Image inputs of the Step (see self.map_tiles()).
+        """
+        if(self.process_tile is None):
+            return
+        from models import Image
+        
+        for (key_name, cls) in self._input_plan:
+            value = getattr(self, key_name)
+            if(not isinstance(value, (list, tuple))):
+                value = [value]
+            for image in value:
+                if(isinstance(image, Image)):
+                    image.map_pixels(self.map_tiles)
+        return
+    
+    
+    
+    def prefetch(self, parameter, value):
+        """
+        Hint that a future run will have parameter `parameter` set to `value`
+        (e.g. the next input of a batch run): Steps which can start loading 
+        the corresponding data in the background do so. The default behaviour
+        is to do nothing.
+        """
+        return
+    
+    
+    
+    def cancel_prefetch(self, parameter, value=None):
+        """
+        Counterpart of self.prefetch(): the run with parameter `parameter` set
+        to `value` (every run if `value` is None) is over, e.g. failed before 
+        getting to this Step. Steps drop whatever they loaded for it and did 
+        not use. The default behaviour is to do nothing.
+        """
+        return
+    
+    
+    
+    def flush(self):
+        """
+        Wait for any work the Step still has in progress in the background 
+        (e.g. pending writes) to be done. Called by the Pipeline at the end of
+        each run. The default behaviour is to do nothing.
+        """
+        return
+    
+    
+    def close(self):
+        """
+        Release whatever the Step holds in the background (e.g. writer 
+        threads), waiting for any work still in progress first (see 
+        self.flush()). Called by Pipeline.close() and by BatchRunner and 
+        StreamingRunner for their copies of the Step (see self.clone()). The 
+        default behaviour is to do nothing.
+        """
+        return
+    
+    
+    def release(self, keys):
+        """
+        Forget the values of the clipboard keys `keys` held as instance 
+        variables (see self._get_data_from_clipbaord() and 
+        self._put_data_to_clipboard()), leaving the clipboard as their only
+        owner.
+        """
+        for key in keys:
+            self.__dict__.pop(key, None)
+        return
+
+
+
+
+
+
+class DeferredStep(object):
+    """
+    Stand-in for a Step whose class is only imported, and which is only 
+    created (see Step.from_parsed_config()), when first needed, e.g. right 
+    before it runs. Until then, the name, input/output information, backend,
+    concurrency and memoize flag of the Step come from its parsed Pipeline 
+    configuration `pipeline_config` and attributes set on the DeferredStep 
+    are remembered and set on the Step once created. Everything else is 
+    forwarded to the Step, which is created as needed.
+    """
+    def __init__(self, pipeline_config, pipeline):
+        d = self.__dict__
+        d['pipeline_config'] = pipeline_config
+        d['pipeline'] = pipeline
+        d['_step'] = None
+        d['_attributes'] = {}
+        d['_lock'] = threading.Lock()
+        return
+    
+    
+    @property
+    def step(self):
+        """
+        The Step, created the first time it is asked for.
+        """
+        d = self.__dict__
+        with d['_lock']:
+            if(d['_step'] is None):
+                step = Step.from_parsed_config(d['pipeline_config'], 
+                                               d['pipeline'])
+                for (name, value) in d['_attributes'].items():
+                    setattr(step, name, value)
+                d['_step'] = step
+        return(d['_step'])
+    
+    
+    def __getattr__(self, name):
+        # Only called for attributes the DeferredStep does not have.
+        d = self.__dict__
+        with d['_lock']:
+            if(d['_step'] is None):
+                if(name in d['_attributes']):
+                    return(d['_attributes'][name])
+                if(name in _DEFERRED_ATTRIBUTES):
+                    (key, default) = _DEFERRED_ATTRIBUTES[name]
+                    return(d['pipeline_config'].get(key, default))
+        return(getattr(self.step, name))
+    
+    
+    def __setattr__(self, name, value):
+        d = self.__dict__
+        with d['_lock']:
+            if(d['_step'] is None):
+                d['_attributes'][name] = value
+                return
+        setattr(d['_step'], name, value)
+        return
+    
+    
+    def clone(self, pipeline):
+        """
+        Same as Step.clone(), without creating the Step if not done yet.
+        """
+        d = self.__dict__
+        with d['_lock']:
+            if(d['_step'] is None):
+                step = DeferredStep(d['pipeline_config'], pipeline)
+                step.__dict__['_attributes'].update(d['_attributes'])
+                return(step)
+        return(d['_step'].clone(pipeline))
+    
+    
+    def flush(self):
+        # A Step not created yet has nothing to flush.
+        if(self.__dict__['_step'] is not None):
+            self.__dict__['_step'].flush()
+        return
+    
+    
+    def close(self):
+        # Nor anything to close.
+        if(self.__dict__['_step'] is not None):
+            self.__dict__['_step'].close()
+        return
+    
+    
+    def cancel_prefetch(self, parameter, value=None):
+        # Nor anything prefetched (see Step.prefetch()).
+        if(self.__dict__['_step'] is not None):
+            self.__dict__['_step'].cancel_prefetch(parameter, value)
+        return
+    
+    
+    def release(self, keys):
+        # Neither does it hold any clipboard value.
+        if(self.__dict__['_step'] is not None):
+            self.__dict__['_step'].release(keys)
+        return
+
+
+
+# Attributes of a DeferredStep known before creating the Step: key and default
+# value in its Pipeline configuration.
+_DEFERRED_ATTRIBUTES = {'name': ('name', None), 
+                        'input_info': ('input', []), 
+                        'output_info': ('output', []), 
+                        'backend': ('backend', DEFAULT_BACKEND), 
+                        'concurrency': ('concurrency', DEFAULT_CONCURRENCY), 
+                        'memoize': ('memoize', DEFAULT_MEMOIZE)}
 
 
 
@@ -26,10 +26,25 @@
 # TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
 # USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
 # DAMAGE.
+import collections
+import os
 import subprocess
+import time
 import traceback
 
 from Step import Step
+import eventloop
+
+
+
+
+# Constants/Default Values.
+# How much to read from the command STDOUT/ERR at a time.
+READ_SIZE = 65536
+# Lines longer than this are split when logged.
+MAX_LINE_LENGTH = 65536
+# How often to check whether the command is done once it closed STDOUT/ERR.
+POLL_INTERVAL = 0.05
 
 
 
@@ -41,7 +56,18 @@ class SystemCallStep(Step):
     potentially log the command STDOUT and/or STDERR. If requested, the exit 
     code of the Step process method is that of the command being executed. 
     Otherwise it is whether or not the system call itself suceeded.
+    
+    The command STDOUT and STDERR are read as they are produced, so that a 
+    chatty command never blocks on a full pipe. They are logged line by line, 
+    optionally copied to files and the last few lines of each are kept in 
+    self.stdout_tail and self.stderr_tail.
     """
+    # Defaults for the optional parameters.
+    stdout_file = None
+    stderr_file = None
+    tail_lines = 100
+    timeout = 0.
+    
     def process(self):
         """
         Execute the command given in the parameters section of teh configuration
@@ -58,19 +84,39 @@ class SystemCallStep(Step):
                 the return code of the system call itself (usually 0). Setting 
                 this parameter to False is useful in cases where self.command 
                 could fail but we do not want the Pipeline to stop.
+            self.stdout_file: optional. If set, the command STDOUT is written to
+                this file.
+            self.stderr_file: optional. If set, the command STDERR is written to
+                this file.
+            self.tail_lines: the number of STDOUT/ERR lines to keep in memory 
+                (and to log in case of errors, if not logged already).
+            self.timeout: if larger than 0, the command is killed if it runs 
+                for longer than this many seconds.
+        """
+        loop = eventloop.EventLoop()
+        try:
+            return(loop.run_until_complete(self.process_async()))
+        finally:
+            loop.close()
+    
+    
+    def process_async(self):
+        """
+        Coroutine version of self.process() (see eventloop and 
+        Pipeline.run_async()): same parameters, same behaviour, but instead of
+        blocking while the command runs, wait for its output on the event 
+        loop.
         """
         cmd_str = '%s %s' % (self.command, ' '.join(self.arguments))
         
         # Start the process and wait for it to finish.
-        self.log.info('Starting "%s"' % (cmd_str))
+        self.log.info('Starting "%s"', cmd_str)
         try:
-            p = subprocess.Popen(args=[self.command, ] + self.arguments,
-                                 stdin=None,
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE,
-                                 shell=False)
-            err = p.wait()
-        except:
+            (err, self.stdout_tail, self.stderr_tail) = \
+                yield(self._run_command(self.command, self.arguments, 
+                                        self.command, self.stdout_file, 
+                                        self.stderr_file))
+        except Exception:
             # We got an exception. This is a problem unless 
             # self.exitcode_passthrough == False, in whiuch case we do not care.
             msg = 'The execution of "%s" failed with an exception: \n%s' \
@@ -79,27 +125,296 @@ class SystemCallStep(Step):
             
             if(not self.exitcode_passthrough):
                 self.log.info('exitcode_passthrough=false: errors are ignored.')
-                return(0)
+                raise(eventloop.Return(0))
             else:
                 raise(Exception(msg))
         
-        self.log.info('"%s" command done.' % (self.command))
-        
-        # Log STDOUT/ERR if we are asked to do so.
-        if(self.log_stdout):
-            self.log.info('"%s" STDOUT: "%s"' % (self.command, p.stdout.read()))
-        if(self.log_stderr):
-            self.log.info('"%s" STDERR: "%s"' % (self.command, p.stderr.read()))
-        
         # Return err or 0?
         if(self.exitcode_passthrough):
-            return(err)
-        return(0)
+            raise(eventloop.Return(err))
+        raise(eventloop.Return(0))
+    
+    
+    def _run_command(self, command, arguments, label, stdout_file, 
+                     stderr_file):
+        """
+        Coroutine executing `command` with `arguments`, handling its output as
+        specified by the Step parameters (see self.process()) and logging it 
+        as `label`. Return (exit code, STDOUT tail, STDERR tail).
+        """
+        p = subprocess.Popen(args=[command, ] + arguments,
+                             stdin=None,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE,
+                             shell=False)
+        streams = [_OutputStream(p.stdout, 'STDOUT', label, self.log_stdout, 
+                                 stdout_file, self.tail_lines),
+                   _OutputStream(p.stderr, 'STDERR', label, self.log_stderr, 
+                                 stderr_file, self.tail_lines)]
+        deadline = None
+        if(self.timeout):
+            deadline = time.time() + self.timeout
+        
+        # Read STDOUT/ERR as they become available, until both are closed (or
+        # we run out of time, which a command that keeps writing can do as 
+        # well as a silent one).
+        timed_out = False
+        try:
+            open_streams = dict([(s.fd, s) for s in streams])
+            while(open_streams):
+                timeout = None
+                if(deadline is not None):
+                    timeout = deadline - time.time()
+                    if(timeout <= 0.):
+                        timed_out = True
+                        break
+                ready = yield(eventloop.Readable(*open_streams.keys(), 
+                                                 timeout=timeout))
+                for fd in ready:
+                    if(not open_streams[fd].read(self.log)):
+                        del(open_streams[fd])
+                if(deadline is not None and time.time() >= deadline):
+                    timed_out = True
+                    break
+            
+            # The command closed STDOUT/ERR: it is done or about to be.
+            while(not timed_out and p.poll() is None):
+                if(deadline is not None and time.time() >= deadline):
+                    timed_out = True
+                else:
+                    yield(eventloop.Sleep(POLL_INTERVAL))
+            if(timed_out and p.poll() is None):
+                self.log.error('"%s" timed out after %.1f s: killing it.', 
+                               label, self.timeout)
+                p.kill()
+            err = p.wait()
+        finally:
+            for stream in streams:
+                stream.close()
+        self.log.info('"%s" command done.', label)
+        
+        # Log the last lines of output in case of errors, unless we did 
+        # already.
+        if(err):
+            for stream in streams:
+                if(not stream.log_lines and stream.tail):
+                    self.log.error('"%s" exited with %d, last %s lines: \n%s', 
+                                   label, err, stream.name, stream.get_tail())
+        raise(eventloop.Return((err, 
+                                streams[0].get_tail(), 
+                                streams[1].get_tail())))
+
+
 
 
 
+class ParallelSystemCallStep(SystemCallStep):
+    """
+    Execute the same command several times, with different arguments, at the
+    same time (up to a limit) and collect exit code, duration and output of 
+    each invocation.
+    
+    Arguments are built from the self.arguments template, where {0}, {1} etc.
+    are replaced with the elements of each argument set. If the template has no
+    placeholder, each argument set is simply appended to it.
+    """
+    # Defaults for the optional parameters.
+    argument_sets = []
+    argument_sets_key = None
+    max_concurrency = 4
+    results_key = 'results'
+    
+    def process_async(self):
+        """
+        Execute self.command once per argument set. These are the relevant 
+        parameters, on top of those of SystemCallStep.process():
+            self.argument_sets: the list of argument sets. Each one is either a
+                list or a string of whitespace separated values.
+            self.argument_sets_key: optional. If set, the name of the instance
+                variable (typically an input from the clipboard) holding the
+                argument sets, instead of self.argument_sets.
+            self.max_concurrency: how many invocations of self.command can run 
+                at the same time.
+            self.results_key: the name of the instance variable (typically an 
+                output to the clipboard) where to store the list of results, 
+                one dictionary per argument set with keys arguments, 
+                exit_code, duration, stdout_tail, stderr_tail and error.
+            self.stdout_file/self.stderr_file: optional. If set, {index} is 
+                replaced with the index of the argument set.
+        The exit code is the first non zero exit code of the invocations (if 
+        self.exitcode_passthrough is True), 0 otherwise.
+        """
+        if(self.argument_sets_key):
+            argument_sets = getattr(self, self.argument_sets_key)
+        else:
+            argument_sets = self.argument_sets
+        jobs = collections.deque(enumerate(argument_sets))
+        results = [None] * len(jobs)
+        self.log.info('Starting %d invocation(s) of "%s" (%d at a time).', 
+                      len(jobs), self.command, self.max_concurrency)
+        
+        # A fixed number of worker coroutines take care of the jobs.
+        workers = []
+        for i in range(min(self.max_concurrency, len(jobs))):
+            worker = yield(eventloop.Spawn(self._worker(jobs, results)))
+            workers.append(worker)
+        for worker in workers:
+            yield(worker)
+        setattr(self, self.results_key, results)
+        
+        failed = [r for r in results if r['exit_code'] != 0]
+        self.log.info('"%s" done: %d invocation(s), %d failed.', 
+                      self.command, len(results), len(failed))
+        
+        # Return err or 0?
+        if(self.exitcode_passthrough and failed):
+            raise(eventloop.Return(failed[0]['exit_code'] or 1))
+        raise(eventloop.Return(0))
+    
+    
+    def _worker(self, jobs, results):
+        """
+        Coroutine running invocations of self.command until `jobs` is empty.
+        """
+        while(jobs):
+            (index, argument_set) = jobs.popleft()
+            arguments = self._make_arguments(argument_set)
+            label = '%s[%d]' % (self.command, index)
+            result = {'arguments': arguments, 
+                      'exit_code': None, 
+                      'duration': None, 
+                      'stdout_tail': '', 
+                      'stderr_tail': '', 
+                      'error': None}
+            
+            self.log.info('Starting "%s %s"', label, ' '.join(arguments))
+            start = time.time()
+            try:
+                (result['exit_code'], 
+                 result['stdout_tail'], 
+                 result['stderr_tail']) = \
+                    yield(self._run_command(self.command, arguments, label, 
+                                            self._file_name(self.stdout_file, 
+                                                            index), 
+                                            self._file_name(self.stderr_file, 
+                                                            index)))
+            except Exception:
+                result['error'] = traceback.format_exc()
+                self.log.error('The execution of "%s" failed with an ' 
+                               'exception: \n%s', label, result['error'])
+            result['duration'] = time.time() - start
+            results[index] = result
+        return
+    
+    
+    def _make_arguments(self, argument_set):
+        """
+        Return the argument list for the given `argument_set`, using 
+        self.arguments as template.
+        """
+        if(isinstance(argument_set, basestring)):
+            argument_set = argument_set.split()
+        argument_set = [str(x) for x in argument_set]
+        
+        template = ' '.join(self.arguments)
+        if('{' not in template):
+            return(self.arguments + argument_set)
+        return([arg.format(*argument_set) for arg in self.arguments])
+    
+    
+    def _file_name(self, template, index):
+        """
+        Return the output file name for the invocation number `index`.
+        """
+        if(not template):
+            return(None)
+        return(template.format(index=index))
 
 
 
 
 
+class _OutputStream(object):
+    """
+    One of the STDOUT/ERR pipes of a command run by SystemCallStep.
+    """
+    def __init__(self, pipe, name, label, log_lines, file_name, tail_lines):
+        self.pipe = pipe
+        self.fd = pipe.fileno()
+        self.name = name
+        self.label = label
+        self.log_lines = log_lines
+        self.tail = collections.deque(maxlen=tail_lines)
+        self.partial = ''
+        
+        # Write to the file directly by file descriptor: no buffering.
+        self.out_fd = None
+        if(file_name):
+            self.out_fd = os.open(file_name, 
+                                  os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 
+                                  0o644)
+        return
+    
+    
+    def read(self, log):
+        """
+        Read whatever is available from the pipe and handle complete lines. 
+        Return False once the pipe is closed.
+        """
+        data = os.read(self.fd, READ_SIZE)
+        if(not data):
+            if(self.partial):
+                self._line(log, self.partial)
+                self.partial = ''
+            return(False)
+        
+        if(self.out_fd is not None):
+            self._write(data)
+        lines = (self.partial + data).split('\n')
+        self.partial = lines.pop()
+        for line in lines:
+            self._line(log, line)
+        
+        # Do not let a never ending line eat up all the memory.
+        if(len(self.partial) > MAX_LINE_LENGTH):
+            self._line(log, self.partial)
+            self.partial = ''
+        return(True)
+    
+    
+    def close(self):
+        """
+        Close the pipe and the output file, if any.
+        """
+        self.pipe.close()
+        if(self.out_fd is not None):
+            os.close(self.out_fd)
+            self.out_fd = None
+        return
+    
+    
+    def get_tail(self):
+        """
+        Return the last lines read as a single string.
+        """
+        return('\n'.join(self.tail))
+    
+    
+    def _write(self, data):
+        """
+        Write all of `data` to the output file.
+        """
+        while(data):
+            written = os.write(self.out_fd, data)
+            data = data[written:]
+        return
+    
+    
+    def _line(self, log, line):
+        """
+        Handle a complete line of output.
+        """
+        self.tail.append(line)
+        if(self.log_lines):
+            log.info('"%s" %s: %s', self.label, self.name, line)
+        return
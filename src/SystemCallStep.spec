@@ -28,3 +28,14 @@
     
     # Pass the command exit code through?
     exitcode_passthrough = boolean(default=True)
+    
+    # Optionally, write the command STDOUT/STDERR to these files.
+    stdout_file = string(default=None)
+    stderr_file = string(default=None)
+    
+    # How many lines of STDOUT/STDERR to keep in memory (and to log in case of 
+    # errors if they are not logged already).
+    tail_lines = integer(min=0, default=100)
+    
+    # Kill the command if it runs longer than this many seconds (0: no limit).
+    timeout = float(min=0, default=0)
@@ -27,6 +27,7 @@
 # USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
 # DAMAGE.
 from Step import Step
+from models import Image
 import utilities
 
 
@@ -46,8 +47,8 @@ class DummyInitStep(Step):
             setattr(self, var_name, dummy_object)
             
             # Log what we did.
-            self.log.info('Created a new instance of %s as %s.' \
-                          % (class_name, var_name))
+            self.log.info('Created a new instance of %s as %s.', 
+                          class_name, var_name)
         return(0)
 
 
@@ -67,8 +68,8 @@ class AnotherDummyStep(Step):
             thing = getattr(self, var_name)
             
             # Log what we found.
-            self.log.info('Found an instance of %s as %s' \
-                          % (thing.__class__.__name__, var_name))
+            self.log.info('Found an instance of %s as %s', 
+                          thing.__class__.__name__, var_name)
         
         # Handle self.output_info
         for (var_name, class_name) in self.output_info:
@@ -82,6 +83,33 @@ class AnotherDummyStep(Step):
             setattr(self, var_name, dummy_object)
             
             # Log what we did.
-            self.log.info('Added a new instance of %s as %s.' \
-                          % (class_name, var_name))
+            self.log.info('Added a new instance of %s as %s.', 
+                          class_name, var_name)
+        return(0)
+
+
+
+class DummyNumPyStep(Step):
+    # Default parameter values.
+    iterations = 3
+    clip = 3.
+    
+    def process(self):
+        import numpy
+        
+        # Subtract a sigma-clipped background from the pixels of the only 
+        # input Image, masking outliers, and return the result as the only 
+        # output.
+        (image_key, class_name) = self.input_info[0]
+        data = numpy.array(getattr(self, image_key).data, dtype='float64')
+        good = numpy.ones(data.shape, dtype=bool)
+        for i in range(self.iterations):
+            pixels = data[good]
+            background = numpy.median(pixels)
+            good = numpy.abs(data - background) <= self.clip * pixels.std()
+        data -= background
+        (output_key, class_name) = self.output_info[0]
+        setattr(self, output_key, Image(data=data, mask=~good))
+        self.log.info('Subtracted a background of %g, %d pixel(s) masked.', 
+                      background, data.size - good.sum())
         return(0)
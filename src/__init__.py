@@ -26,12 +26,50 @@
 # TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
 # USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
 # DAMAGE.
-from Pipeline import Pipeline as _Pipeline
+"""
+stpipe
 
+Importing the package is cheap: modules (and their dependencies, e.g. NumPy 
+or PyFITS) are only imported when needed and DEFAULT_PIPELINE is only created
+the first time it is used.
+"""
+import sys as _sys
+import threading as _threading
+import types as _types
 
-# Create a default Pipeline instance for those cases where users create Steps
-# manually and do not go through a custon Pipeline instance.
-DEFAULT_PIPELINE = _Pipeline()
+
+
+
+class _Package(_types.ModuleType):
+    """
+    The stpipe package module, with a lazily created DEFAULT_PIPELINE.
+    """
+    def __getattr__(self, name):
+        # Only called for attributes which do not exist (yet).
+        if(name != 'DEFAULT_PIPELINE'):
+            raise(AttributeError("'module' object has no attribute '%s'" \
+                                 % (name)))
+        with _LOCK:
+            if('DEFAULT_PIPELINE' not in self.__dict__):
+                from Pipeline import Pipeline
+                
+                # Create a default Pipeline instance for those cases where 
+                # users create Steps manually and do not go through a custom
+                # Pipeline instance.
+                self.DEFAULT_PIPELINE = Pipeline()
+        return(self.DEFAULT_PIPELINE)
+
+
+
+_LOCK = _threading.Lock()
+
+# Replace this module with a _Package instance with the same content. Keep a 
+# reference to the original module: Python 2 clears the globals of modules 
+# when they are garbage collected.
+_package = _Package(__name__, __doc__)
+_package.__dict__.update(_sys.modules[__name__].__dict__)
+_package._module = _sys.modules[__name__]
+_sys.modules[__name__] = _package
 
 
 
@@ -0,0 +1,300 @@
+# Copyright (C) 2010 Association of Universities for Research in Astronomy(AURA)
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+# 
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+"""
+Batch
+
+Run one configured Pipeline over many inputs (e.g. a night worth of FITS 
+files). The Pipeline configuration is parsed and Steps are created only once. 
+Each input is then processed with its own, initially empty, clipboard by one of
+a pool of workers.
+"""
+import Queue
+import threading
+import time
+import traceback
+
+
+
+
+# Constants/Default Values.
+DEFAULT_INPUT_PARAMETER = 'file_name'
+DEFAULT_WORKERS = 1
+
+# The BatchRunner instance worker processes work for and, in each worker 
+# process, its own copy of the Pipeline (see _init_worker()).
+_RUNNER = None
+_PIPELINE = None
+
+
+
+
+
+class BatchResult(object):
+    """
+    Outcome of the processing of a single batch input, which took `elapsed`
+    seconds and ended when the instance was created (see self.finished).
+    """
+    def __init__(self, index, item, ok, elapsed, error=None):
+        self.index = index
+        self.item = item
+        self.ok = ok
+        self.elapsed = elapsed
+        self.error = error
+        self.finished = time.time()
+        return
+
+
+
+
+
+class BatchReport(object):
+    """
+    Outcome of a batch run: the list of BatchResult instances, in input order,
+    and the total wall-clock time.
+    """
+    def __init__(self, results, elapsed):
+        self.results = results
+        self.elapsed = elapsed
+        return
+    
+    
+    @property
+    def succeeded(self):
+        return([r for r in self.results if r.ok])
+    
+    
+    @property
+    def failed(self):
+        return([r for r in self.results if not r.ok])
+    
+    
+    @property
+    def throughput(self):
+        """
+        Number of inputs processed per second.
+        """
+        if(not self.elapsed):
+            return(0.)
+        return(len(self.results) / self.elapsed)
+    
+    
+    def summary(self):
+        """
+        Return a one line, human readable summary of the batch run.
+        """
+        return('%d input(s) processed in %.3f s (%.2f/s): %d succeeded, ' \
+               '%d failed.' % (len(self.results), self.elapsed, 
+                              self.throughput, len(self.succeeded), 
+                              len(self.failed)))
+
+
+
+
+
+class BatchRunner(object):
+    """
+    Run a configured Pipeline instance over an iterable of inputs. Each input
+    is assigned to the parameter `input_parameter` of the Step called 
+    `input_step` (e.g. the file_name of a FitsImageIOStep) before running the
+    Pipeline with an empty clipboard.
+    
+    Inputs are processed by `workers` threads, each one with its own copy of 
+    the Pipeline (see Pipeline.clone()) or, if `processes` is True, by 
+    `workers` processes forked once the Pipeline is ready. In the latter case,
+    all Steps are executed in the worker processes, regardless of their 
+    backend.
+    
+    If `prefetch` is True (threads only), the input Step is told about each 
+    input (see Step.prefetch()) as soon as it is queued, i.e. at most 
+    2 * `workers` inputs ahead, so that it can start loading it. Once the 
+    input is processed, or failed, anything prefetched and left unused is 
+    dropped (see Step.cancel_prefetch()).
+    """
+    def __init__(self, pipeline, input_step, 
+                 input_parameter=DEFAULT_INPUT_PARAMETER, 
+                 workers=DEFAULT_WORKERS, 
+                 processes=False, 
+                 prefetch=False):
+        """
+        Configure the BatchRunner instance.
+        """
+        if(not [s for s in pipeline.steps if s.name == input_step]):
+            raise(Exception('Pipeline %s has no Step called %s.' \
+                            % (pipeline.qualified_name, input_step)))
+        self.pipeline = pipeline
+        self.input_step = input_step
+        self.input_parameter = input_parameter
+        self.workers = workers
+        self.processes = processes
+        self.prefetch = prefetch
+        self.log = pipeline.log
+        return
+    
+    
+    def run(self, inputs):
+        """
+        Process each element of the iterable `inputs` and return a BatchReport
+        instance. Failures are logged and reported but do not interrupt the 
+        batch.
+        """
+        self.log.info('Batch starting (%d %s worker(s)).', self.workers, 
+                      self.processes and 'process' or 'thread')
+        start = time.time()
+        if(self.processes):
+            results = self._run_processes(inputs)
+        else:
+            results = self._run_threads(inputs)
+        results.sort(key=lambda r: r.index)
+        
+        report = BatchReport(results, time.time() - start)
+        self.log.info('Batch done: %s', report.summary())
+        return(report)
+    
+    
+    def process_item(self, pipeline, index, item):
+        """
+        Run `pipeline` on the single input `item` with a fresh clipboard and 
+        return a BatchResult instance.
+        """
+        start = time.time()
+        pipeline.clipboard.clear()
+        for step in pipeline.steps:
+            step.input_index = index
+            step.input_item = item
+            if(step.name == self.input_step):
+                setattr(step, self.input_parameter, item)
+                input_step = step
+        try:
+            pipeline.run()
+        except Exception:
+            error = traceback.format_exc()
+            self.log.error('Input %d (%s) failed: \n%s', index, item, error)
+            return(BatchResult(index, item, False, time.time() - start, error))
+        finally:
+            pipeline.clipboard.clear()
+            if(self.prefetch):
+                input_step.cancel_prefetch(self.input_parameter, item)
+        
+        elapsed = time.time() - start
+        self.log.info('Input %d (%s) done in %.3f s.', index, item, elapsed)
+        return(BatchResult(index, item, True, elapsed))
+    
+    
+    def _run_threads(self, inputs):
+        """
+        Process `inputs` with a pool of threads, each one with its own copy of 
+        self.pipeline.
+        """
+        todo = Queue.Queue(maxsize=2 * self.workers)
+        results = []
+        
+        def worker(pipeline):
+            # Let background work (e.g. writes) overlap with the next inputs.
+            pipeline.defer_flush = True
+            while(True):
+                job = todo.get()
+                if(job is None):
+                    break
+                results.append(self.process_item(pipeline, *job))
+            try:
+                pipeline.flush()
+            except Exception:
+                self.log.error('Flushing the Pipeline failed: \n%s', 
+                               traceback.format_exc())
+            finally:
+                pipeline.close_steps()
+            return
+        
+        threads = [threading.Thread(target=worker, 
+                                    args=(self.pipeline.clone(), )) \
+                   for i in range(self.workers)]
+        for thread in threads:
+            thread.setDaemon(True)
+            thread.start()
+        
+        # The queue is bounded, so that `inputs` can be a (long) generator.
+        [step] = [s for s in self.pipeline.steps if s.name == self.input_step]
+        try:
+            for job in enumerate(inputs):
+                if(self.prefetch):
+                    step.prefetch(self.input_parameter, job[1])
+                todo.put(job)
+        finally:
+            for thread in threads:
+                todo.put(None)
+            for thread in threads:
+                thread.join()
+            if(self.prefetch):
+                step.cancel_prefetch(self.input_parameter)
+        return(results)
+    
+    
+    def _run_processes(self, inputs):
+        """
+        Process `inputs` with a pool of worker processes, forked from this one
+        and therefore inheriting self.pipeline, each one working on its own 
+        copy of it (see Pipeline.clone()), as threads do.
+        """
+        global _RUNNER
+        import multiprocessing
+        
+        _RUNNER = self
+        pool = multiprocessing.Pool(self.workers, _init_worker)
+        try:
+            results = list(pool.imap_unordered(_process_item, 
+                                               enumerate(inputs)))
+        finally:
+            pool.close()
+            pool.join()
+            _RUNNER = None
+        return(results)
+
+
+
+def _init_worker():
+    """
+    Worker process initializer: copy the Pipeline, so that workers do not 
+    share its checkpoint, and, since we are already in a worker process, run
+    all Steps locally.
+    """
+    global _PIPELINE
+    
+    _PIPELINE = _RUNNER.pipeline.clone()
+    for step in _PIPELINE.steps:
+        step.backend = 'local'
+    return
+
+
+
+def _process_item(job):
+    """
+    Worker process side of BatchRunner._run_processes().
+    """
+    (index, item) = job
+    return(_RUNNER.process_item(_PIPELINE, index, item))
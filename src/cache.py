@@ -0,0 +1,268 @@
+# Copyright (C) 2010 Association of Universities for Research in Astronomy(AURA)
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+# 
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+"""
+Cache
+
+A content-addressed, on-disk cache of Step outputs. The cache key of a Step 
+run is computed from the Step class, its parameters (and the modification time
+and size of the files they name) and its inputs (from the clipboard). If the 
+key is found in the cache, the Step outputs are restored from there and the 
+Step process() method is not called at all.
+
+Each cache entry is a directory holding the pickled outputs, with NumPy arrays 
+stored as raw binary files (see serialization). When the total size of the 
+cache exceeds its limit, the least recently used entries are deleted.
+"""
+import cPickle
+import cStringIO
+import glob
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+
+import serialization
+
+
+
+
+
+# Constants/Default Values.
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+OUTPUTS_FILE_NAME = 'outputs.pkl'
+
+
+
+def fingerprint(obj):
+    """
+    Return a hex digest of the content of `obj`. NumPy arrays are hashed from 
+    their raw data rather than pickled.
+    """
+    numpy = serialization.loaded_numpy()
+    
+    def persistent_id(x):
+        if(numpy is not None and isinstance(x, numpy.ndarray) and 
+           x.dtype != object):
+            digest = hashlib.sha1(numpy.ascontiguousarray(x).data)
+            return('%s%s%s' % (x.dtype.str, x.shape, digest.hexdigest()))
+        return(None)
+    
+    buffer = cStringIO.StringIO()
+    pickler = cPickle.Pickler(buffer, cPickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = persistent_id
+    pickler.dump(obj)
+    return(hashlib.sha1(buffer.getvalue()).hexdigest())
+
+
+
+
+
+def file_stamps(value):
+    """
+    Return the list of (path, modification time, size) tuples of the existing
+    files named by `value`: a file name or glob pattern, or a list thereof. 
+    Anything else names no file.
+    """
+    if(isinstance(value, basestring)):
+        value = [value]
+    elif(not isinstance(value, (list, tuple))):
+        return([])
+    stamps = []
+    for pattern in value:
+        if(not isinstance(pattern, basestring)):
+            continue
+        if(glob.has_magic(pattern)):
+            paths = sorted(glob.glob(pattern))
+        else:
+            paths = [pattern]
+        for path in paths:
+            try:
+                info = os.stat(path)
+            except (OSError, TypeError, ValueError):
+                continue
+            if(stat.S_ISREG(info.st_mode)):
+                stamps.append((path, info.st_mtime, info.st_size))
+    return(stamps)
+
+
+
+
+
+class StepCache(object):
+    """
+    Cache of Step outputs in the directory `directory`, holding at most 
+    `max_size` bytes.
+    """
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        """
+        Configure the StepCache instance, creating `directory` if needed.
+        """
+        if(not os.path.isdir(directory)):
+            os.makedirs(directory)
+        self.directory = directory
+        self.max_size = max_size
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        
+        # Entry name -> [size, last access time].
+        self._entries = {}
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if(os.path.isdir(path) and not name.startswith('.')):
+                self._entries[name] = [_du(path), os.path.getmtime(path)]
+        return
+    
+    
+    @property
+    def size(self):
+        """
+        Total size of the cache entries, in bytes.
+        """
+        return(sum([e[0] for e in self._entries.values()]))
+    
+    
+    def key(self, step):
+        """
+        Return the cache key of `step` as it is about to be run, i.e. with its 
+        inputs already fetched from the clipboard.
+        """
+        cls = step.__class__
+        input_keys = [x[0] for x in step.input_info if x]
+        output_keys = [x[0] for x in step.output_info if x]
+        
+        inputs = [(k, getattr(step, k)) for k in input_keys]
+        # Current values: parameters may have changed since the Step was 
+        # created (e.g. file_name, set for each input of a batch). Files they
+        # name count for their modification time and size, so that files 
+        # rewritten in place do not hit stale entries.
+        parameters = [(k, getattr(step, k), file_stamps(getattr(step, k))) \
+                      for k in sorted(step.parameters)]
+        return(fingerprint(('%s.%s' % (cls.__module__, cls.__name__), 
+                            parameters, 
+                            inputs, 
+                            output_keys)))
+    
+    
+    def restore(self, key, step):
+        """
+        If `key` is in the cache, set the `step` outputs to the cached values 
+        and return True. Return False otherwise.
+        """
+        path = os.path.join(self.directory, key)
+        with self._lock:
+            found = key in self._entries
+            if(found):
+                self._entries[key][1] = time.time()
+                self.hits += 1
+            else:
+                self.misses += 1
+        if(not found):
+            return(False)
+        
+        # Arrays are mapped copy-on-write: Steps can modify them in memory 
+        # without touching the cache.
+        store = serialization.ArrayStore(path)
+        try:
+            outputs = serialization.load(os.path.join(path, OUTPUTS_FILE_NAME), 
+                                         store, 
+                                         mode='c')
+            os.utime(path, None)
+        except (IOError, OSError):
+            # Evicted behind our back (e.g. by another process).
+            with self._lock:
+                self._entries.pop(key, None)
+                self.hits -= 1
+                self.misses += 1
+            return(False)
+        for (name, value) in outputs.items():
+            setattr(step, name, value)
+        return(True)
+    
+    
+    def store(self, key, step):
+        """
+        Add the outputs of `step` to the cache, under `key`, and evict the 
+        least recently used entries if the cache is now too large.
+        """
+        outputs = dict([(x[0], getattr(step, x[0])) \
+                        for x in step.output_info if x])
+        
+        # Write everything in a temporary directory first and then move it in
+        # place, so that nobody ever sees incomplete entries.
+        tmp_path = tempfile.mkdtemp(prefix='.', dir=self.directory)
+        store = serialization.ArrayStore(tmp_path, min_array_size=0)
+        serialization.dump(outputs, os.path.join(tmp_path, OUTPUTS_FILE_NAME),
+                           store)
+        size = _du(tmp_path)
+        try:
+            os.rename(tmp_path, os.path.join(self.directory, key))
+        except OSError:
+            # Somebody else stored the same entry in the meantime.
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+        
+        with self._lock:
+            self._entries[key] = [size, time.time()]
+            victims = []
+            total = sum([e[0] for e in self._entries.values()])
+            for (atime, name) in sorted([(e[1], n) \
+                                         for (n, e) in self._entries.items()]):
+                if(total <= self.max_size or name == key):
+                    break
+                total -= self._entries.pop(name)[0]
+                victims.append(name)
+            self.evictions += len(victims)
+        for name in victims:
+            shutil.rmtree(os.path.join(self.directory, name), 
+                          ignore_errors=True)
+        return
+    
+    
+    def summary(self):
+        """
+        Return a one line, human readable summary of the cache statistics.
+        """
+        return('%d hit(s), %d miss(es), %d eviction(s), %d entries, ' \
+               '%.1f MB.' % (self.hits, self.misses, self.evictions, 
+                             len(self._entries), self.size / 1048576.))
+
+
+
+def _du(path):
+    """
+    Return the total size in bytes of the files in the directory `path`.
+    """
+    return(sum([os.path.getsize(os.path.join(path, f)) \
+                for f in os.listdir(path)]))
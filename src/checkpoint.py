@@ -0,0 +1,194 @@
+# Copyright (C) 2010 Association of Universities for Research in Astronomy(AURA)
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+# 
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+"""
+Checkpoint
+
+Persist the Pipeline clipboard after each Step, so that a failed run can be 
+resumed from the Step that failed instead of starting over (see 
+Pipeline.resume()).
+
+A checkpoint is a directory holding the list of the Steps completed so far and
+one sub-directory per clipboard key with its pickled value. NumPy arrays are 
+stored as raw binary files (see serialization). After each Step, only the 
+clipboard keys that the Step produces (its output keys) are written. Steps 
+modifying in place a clipboard value which is not among their outputs are 
+therefore not checkpointed correctly.
+"""
+import cPickle
+import os
+import shutil
+import threading
+
+import serialization
+
+
+
+
+# Constants/Default Values.
+STATE_FILE_NAME = 'state.pkl'
+VALUE_FILE_NAME = 'value.pkl'
+VALUES_DIR_NAME = 'values'
+
+
+
+
+
+class Checkpoint(object):
+    """
+    Checkpoint of a Pipeline run in the directory `directory`.
+    """
+    def __init__(self, directory):
+        """
+        Configure the Checkpoint instance.
+        """
+        self.directory = directory
+        self._values_dir = os.path.join(directory, VALUES_DIR_NAME)
+        self._state_file = os.path.join(directory, STATE_FILE_NAME)
+        self._lock = threading.Lock()
+        
+        # Names of the completed Steps and clipboard key -> value directory.
+        self._steps = []
+        self._keys = {}
+        self._counter = 0
+        return
+    
+    
+    def exists(self):
+        """
+        Return True if there is a checkpoint to resume from.
+        """
+        return(os.path.exists(self._state_file))
+    
+    
+    def start(self, clipboard):
+        """
+        Delete any previous checkpoint and create a new one with the initial
+        content of `clipboard`.
+        """
+        with self._lock:
+            self._reset()
+            os.makedirs(self._values_dir)
+            for (key, value) in clipboard.items():
+                self._write_value(key, value)
+            self._write_state()
+        return
+    
+    
+    def step_done(self, step, clipboard):
+        """
+        Record that `step` completed and save its outputs from `clipboard`.
+        """
+        with self._lock:
+            old = []
+            for key in [x[0] for x in step.output_info if x]:
+                if(key in self._keys):
+                    old.append(self._keys[key])
+                self._write_value(key, clipboard[key])
+            self._steps.append(step.name)
+            self._write_state()
+            
+            # Only delete the old values once the new state is safe on disk.
+            for name in old:
+                shutil.rmtree(os.path.join(self._values_dir, name), 
+                              ignore_errors=True)
+        return
+    
+    
+    def load(self, clipboard):
+        """
+        Restore the content of `clipboard` from the checkpoint and return the 
+        list of names of the Steps completed so far.
+        """
+        with self._lock:
+            f = open(self._state_file, 'rb')
+            try:
+                (self._steps, self._keys, self._counter) = cPickle.load(f)
+            finally:
+                f.close()
+            
+            for (key, name) in self._keys.items():
+                path = os.path.join(self._values_dir, name)
+                store = serialization.ArrayStore(path)
+                # Map arrays copy-on-write: the checkpoint stays as it is.
+                clipboard[key] = serialization.load(
+                    os.path.join(path, VALUE_FILE_NAME), store, mode='c')
+        return(list(self._steps))
+    
+    
+    def remove(self):
+        """
+        Delete the checkpoint.
+        """
+        with self._lock:
+            self._reset()
+        return
+    
+    
+    def _reset(self):
+        """
+        Delete the checkpoint directory content and forget the state.
+        """
+        if(os.path.exists(self._state_file)):
+            os.remove(self._state_file)
+        shutil.rmtree(self._values_dir, ignore_errors=True)
+        self._steps = []
+        self._keys = {}
+        self._counter = 0
+        return
+    
+    
+    def _write_value(self, key, value):
+        """
+        Save the clipboard `value` of `key` in a new value directory.
+        """
+        self._counter += 1
+        name = str(self._counter)
+        path = os.path.join(self._values_dir, name)
+        store = serialization.ArrayStore(path)
+        serialization.dump(value, os.path.join(path, VALUE_FILE_NAME), store)
+        self._keys[key] = name
+        return
+    
+    
+    def _write_state(self):
+        """
+        Atomically write the list of completed Steps and the key -> value 
+        directory mapping.
+        """
+        tmp_file = self._state_file + '.tmp'
+        f = open(tmp_file, 'wb')
+        try:
+            cPickle.dump((self._steps, self._keys, self._counter), f, 
+                         cPickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.rename(tmp_file, self._state_file)
+        return
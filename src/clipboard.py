@@ -0,0 +1,321 @@
+# Copyright (C) 2010 Association of Universities for Research in Astronomy(AURA)
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+# 
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+"""
+Clipboard
+
+Alternative implementations of the Pipeline clipboard (by default, a plain 
+dictionary), together with helpers to estimate the memory used by clipboard 
+values.
+
+SpillingClipboard keeps the clipboard under a memory budget by moving the 
+least recently used values to disk and transparently loading them back when
+they are accessed (e.g. by Step._get_data_from_clipbaord()).
+"""
+import atexit
+import collections
+import cPickle
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import zlib
+
+import serialization
+
+
+
+
+
+def sizeof(obj):
+    """
+    Return an estimate of the memory, in bytes, used by `obj`. NumPy arrays 
+    count for their data, models.Image instances for their planes and the 
+    pixels of their HDUs (if read from file already) and containers for their
+    content.
+    """
+    return(_sizeof(obj, set()))
+
+
+
+def _sizeof(obj, seen):
+    if(id(obj) in seen):
+        return(0)
+    seen.add(id(obj))
+    
+    numpy = serialization.loaded_numpy()
+    if(numpy is not None and isinstance(obj, numpy.ndarray)):
+        # Views do not own their data.
+        if(obj.base is not None and isinstance(obj.base, numpy.ndarray)):
+            return(_sizeof(obj.base, seen))
+        return(obj.nbytes)
+    if(isinstance(obj, (list, tuple, set, frozenset))):
+        return(sys.getsizeof(obj) + sum([_sizeof(x, seen) for x in obj]))
+    if(isinstance(obj, dict)):
+        return(sys.getsizeof(obj) + 
+               sum([_sizeof(k, seen) + _sizeof(v, seen) \
+                    for (k, v) in obj.items()]))
+    if(hasattr(obj, 'hdu_list') and hasattr(obj, 'owns_data')):
+        # A models.Image. Look at HDU data only if loaded already.
+        size = sys.getsizeof(obj)
+        for plane in (obj._data, obj.mask, obj.variance):
+            size += _sizeof(plane, seen)
+        for hdu in obj.hdu_list:
+            if('data' in getattr(hdu, '__dict__', {})):
+                size += _sizeof(hdu.__dict__['data'], seen)
+        return(size)
+    return(sys.getsizeof(obj))
+
+
+
+
+
+class SpillingClipboard(collections.MutableMapping):
+    """
+    A clipboard (dictionary-like) holding at most `budget` bytes of values 
+    (see sizeof()) in memory. When adding or loading a value takes it over 
+    budget, the least recently used values are written (spilled) to a 
+    temporary directory in `directory` (the system temporary directory by 
+    default) until it fits again, or only the new value is left. Spilled 
+    values are loaded back when accessed. The temporary directory is only 
+    created when a value is first spilled and deleted by clear() and 
+    cleanup().
+    
+    Values are written with serialization.dump(), i.e. with NumPy arrays as
+    raw binary files read back memory-mapped, or, if `compress` is True, 
+    pickled and compressed with zlib (slower, but smaller on disk).
+    
+    Iterating over the keys, len() and `in` do not load anything, values() 
+    and items() load everything.
+    """
+    def __init__(self, budget, directory=None, compress=False):
+        self.budget = budget
+        self.compress = compress
+        self.spill_dir = directory
+        # Created by self._spill() when needed.
+        self.directory = None
+        self._store = None
+        self._lock = threading.RLock()
+        self._counter = 0
+        # In memory values, least recently used first, and their sizes.
+        self._values = collections.OrderedDict()
+        self._sizes = {}
+        self._resident = 0
+        # Spilled values: key -> (file path, array names, size).
+        self._spilled = {}
+        
+        # Statistics.
+        self.spills = 0
+        self.spilled_bytes = 0
+        self.reloads = 0
+        self.reloaded_bytes = 0
+        return
+    
+    
+    def __getitem__(self, key):
+        with self._lock:
+            if(key in self._values):
+                value = self._values.pop(key)
+                self._values[key] = value
+                return(value)
+            if(key not in self._spilled):
+                raise(KeyError(key))
+            value = self._reload(key)
+            self._add(key, value, self._spilled.pop(key)[2])
+            return(value)
+    
+    
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._discard(key)
+            self._add(key, value, sizeof(value))
+        return
+    
+    
+    def __delitem__(self, key):
+        with self._lock:
+            if(key not in self._values and key not in self._spilled):
+                raise(KeyError(key))
+            self._discard(key)
+        return
+    
+    
+    def __contains__(self, key):
+        with self._lock:
+            return(key in self._values or key in self._spilled)
+    
+    
+    def __iter__(self):
+        with self._lock:
+            keys = list(self._values.keys()) + list(self._spilled.keys())
+        return(iter(keys))
+    
+    
+    def __len__(self):
+        with self._lock:
+            return(len(self._values) + len(self._spilled))
+    
+    
+    def clear(self):
+        # Same as self.cleanup(): the directory is created again if needed.
+        self.cleanup()
+        return
+    
+    
+    @property
+    def resident_bytes(self):
+        """
+        Size of the values currently in memory.
+        """
+        return(self._resident)
+    
+    
+    def summary(self):
+        """
+        Return a one line, human readable summary of the spill activity.
+        """
+        return('%d value(s) (%d bytes) spilled, %d value(s) (%d bytes) ' \
+               'reloaded, %d bytes in memory (budget: %d).' \
+               % (self.spills, self.spilled_bytes, self.reloads, 
+                  self.reloaded_bytes, self._resident, self.budget))
+    
+    
+    def cleanup(self):
+        """
+        Forget all values and delete the spill directory, if any.
+        """
+        with self._lock:
+            self._values.clear()
+            self._sizes.clear()
+            self._spilled.clear()
+            self._resident = 0
+            directory = self.directory
+            self.directory = None
+            self._store = None
+        if(directory is not None):
+            shutil.rmtree(directory, ignore_errors=True)
+            _DIRECTORIES.pop(directory, None)
+        return
+    
+    
+    def _add(self, key, value, size):
+        """
+        Put `value` in memory as the most recently used value and spill the 
+        least recently used ones if over budget.
+        """
+        self._values[key] = value
+        self._sizes[key] = size
+        self._resident += size
+        while(self._resident > self.budget and len(self._values) > 1):
+            self._spill(next(iter(self._values)))
+        return
+    
+    
+    def _discard(self, key):
+        """
+        Forget `key` (if present), deleting its files if spilled.
+        """
+        if(key in self._values):
+            del(self._values[key])
+            self._resident -= self._sizes.pop(key)
+        elif(key in self._spilled):
+            (path, names, size) = self._spilled.pop(key)
+            self._remove_files(path, names)
+        return
+    
+    
+    def _spill(self, key):
+        value = self._values.pop(key)
+        size = self._sizes.pop(key)
+        self._resident -= size
+        
+        if(self.directory is None):
+            self.directory = tempfile.mkdtemp(prefix='stpipe-clipboard-', 
+                                              dir=self.spill_dir)
+            _DIRECTORIES[self.directory] = os.getpid()
+            self._store = serialization.ArrayStore(
+                                        os.path.join(self.directory, 'arrays'))
+        self._counter += 1
+        path = os.path.join(self.directory, '%d.pkl' % (self._counter))
+        if(self.compress):
+            names = []
+            f = open(path, 'wb')
+            try:
+                f.write(zlib.compress(cPickle.dumps(value, 
+                                                    cPickle.HIGHEST_PROTOCOL)))
+            finally:
+                f.close()
+        else:
+            names = serialization.dump(value, path, self._store)
+        self._spilled[key] = (path, names, size)
+        
+        self.spills += 1
+        self.spilled_bytes += size
+        return
+    
+    
+    def _reload(self, key):
+        (path, names, size) = self._spilled[key]
+        if(self.compress):
+            f = open(path, 'rb')
+            try:
+                value = cPickle.loads(zlib.decompress(f.read()))
+            finally:
+                f.close()
+        else:
+            # Copy-on-write mapping: the value is writable, the files are not 
+            # modified and can be deleted right away.
+            value = serialization.load(path, self._store, mode='c')
+        self._remove_files(path, names)
+        
+        self.reloads += 1
+        self.reloaded_bytes += size
+        return(value)
+    
+    
+    def _remove_files(self, path, names):
+        os.remove(path)
+        for name in names:
+            self._store.remove(name)
+        return
+
+
+
+# The spill directories not deleted yet, removed at exit at the latest by the
+# process which created them: directory -> process ID.
+_DIRECTORIES = {}
+
+
+
+def _remove_directories():
+    for (directory, pid) in list(_DIRECTORIES.items()):
+        if(pid == os.getpid()):
+            shutil.rmtree(directory, True)
+    return
+atexit.register(_remove_directories)
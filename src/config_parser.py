@@ -27,10 +27,33 @@
 # USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
 # DAMAGE.
 """
-Our configuration files are ConfigObj/INI files.
+Our configuration files are ConfigObj/INI files. ConfigObj is only imported
+when a file actually needs to be parsed.
+
+Parsing and validating them is comparatively slow, so the result of loads() is
+cached, in memory and, if a cache directory is set (see set_cache_dir() and 
+the STPIPE_CONFIG_CACHE environment variable), on disk, as marshal data. 
+Cache entries are keyed on the paths of the configuration and spec files and 
+on their modification times and sizes: editing either file invalidates them.
 """
-from configobj import ConfigObj
-from validate import Validator, VdtTypeError
+import cPickle
+import hashlib
+import marshal
+import os
+import threading
+
+
+
+
+# Constants/Default Values.
+CACHE_DIR_VARIABLE = 'STPIPE_CONFIG_CACHE'
+# Bump this when the structure of parsed configurations changes.
+CACHE_VERSION = 1
+
+# Parsed configurations: cache key -> (format, serialized configuration).
+_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+_CACHE_DIR = os.environ.get(CACHE_DIR_VARIABLE) or None
 
 
 
@@ -42,10 +65,55 @@ class ValidationError(Exception): pass
 
 
 
+def set_cache_dir(directory):
+    """
+    Also cache parsed configurations on disk, in `directory` (no disk caching
+    if None).
+    """
+    global _CACHE_DIR
+    
+    _CACHE_DIR = directory
+    return
+
+
+
+def clear_cache():
+    """
+    Empty the in-memory cache of parsed configurations.
+    """
+    with _CACHE_LOCK:
+        _CACHE.clear()
+    return
+
+
+
 def loads(config_file, specfile=None):
     """
-    Read the input `raw_text` and return a dictionary with the parsed 
-    configuration.
+    Read the configuration file `config_file` (validating it against 
+    `specfile`, if given) and return a dictionary with the parsed 
+    configuration. Each call returns a new copy of the configuration (see 
+    the module documentation for caching).
+    """
+    key = _cache_key(config_file, specfile)
+    if(key is None):
+        return(_to_dict(_loads(config_file, specfile)))
+    
+    with _CACHE_LOCK:
+        entry = _CACHE.get(key)
+    if(entry is None):
+        entry = _disk_cache_get(key)
+        if(entry is None):
+            entry = _serialize(_to_dict(_loads(config_file, specfile)))
+            _disk_cache_put(key, entry)
+        with _CACHE_LOCK:
+            _CACHE[key] = entry
+    return(_deserialize(entry))
+
+
+
+def _loads(config_file, specfile=None):
+    """
+    Uncached version of loads().
     """
     if(not specfile):
         config = simple_parse(config_file)
@@ -61,11 +129,119 @@ def loads(config_file, specfile=None):
 
 
 
+def _cache_key(config_file, specfile):
+    """
+    Return the cache key of `config_file` validated against `specfile` or 
+    None if it cannot be cached (e.g. it is not a file).
+    """
+    key = [CACHE_VERSION]
+    for path in (config_file, specfile):
+        if(path is None):
+            key.append(None)
+            continue
+        if(not isinstance(path, basestring)):
+            return(None)
+        try:
+            info = os.stat(path)
+        except OSError:
+            return(None)
+        key.append((os.path.abspath(path), info.st_mtime, info.st_size))
+    return(tuple(key))
+
+
+
+def _to_dict(config):
+    """
+    Return a copy of `config` made of plain dictionaries and lists.
+    """
+    if(isinstance(config, dict)):
+        return(dict([(k, _to_dict(v)) for (k, v) in config.items()]))
+    if(isinstance(config, (list, tuple))):
+        return([_to_dict(x) for x in config])
+    return(config)
+
+
+
+def _serialize(config):
+    """
+    Return (format, data) for the parsed configuration `config`: marshal is
+    the fastest to load, pickle is the fall-back for unusual values.
+    """
+    try:
+        return(('marshal', marshal.dumps(config)))
+    except ValueError:
+        return(('pickle', cPickle.dumps(config, cPickle.HIGHEST_PROTOCOL)))
+
+
+
+def _deserialize(entry):
+    (format, data) = entry
+    if(format == 'marshal'):
+        return(marshal.loads(data))
+    return(cPickle.loads(data))
+
+
+
+def _disk_cache_path(key):
+    return(os.path.join(_CACHE_DIR, 
+                        hashlib.sha1(repr(key)).hexdigest() + '.cfgcache'))
+
+
+
+def _disk_cache_get(key):
+    """
+    Return the cache entry for `key` from the disk cache, if any, else None.
+    """
+    if(not _CACHE_DIR):
+        return(None)
+    try:
+        f = open(_disk_cache_path(key), 'rb')
+    except IOError:
+        return(None)
+    try:
+        try:
+            return(marshal.load(f))
+        except (EOFError, ValueError, TypeError):
+            # Corrupt entry: parse again.
+            return(None)
+    finally:
+        f.close()
+
+
+
+def _disk_cache_put(key, entry):
+    """
+    Write the cache entry `entry` for `key` to the disk cache, if any. Errors
+    are ignored: the cache is only an optimization.
+    """
+    if(not _CACHE_DIR):
+        return
+    import tempfile
+    
+    try:
+        if(not os.path.isdir(_CACHE_DIR)):
+            os.makedirs(_CACHE_DIR)
+        (fd, tmp_path) = tempfile.mkstemp(dir=_CACHE_DIR)
+        f = os.fdopen(fd, 'wb')
+        try:
+            marshal.dump(entry, f)
+        finally:
+            f.close()
+        os.rename(tmp_path, _disk_cache_path(key))
+    except (IOError, OSError):
+        pass
+    return
+
+
+
 def validated_parse(config_file, specfile):
     """
     Parse config_file, in INI format, and do validation with the provided 
     specfile.
     """
+    from configobj import ConfigObj
+    from validate import Validator
+    
     config = ConfigObj(config_file, configspec=specfile, raise_errors=True)
     spec = ConfigObj(specfile)
     validator = Validator()
@@ -106,6 +282,8 @@ def simple_parse(config_file):
     """
     Do simple parsing and home-brewed type interference.
     """
+    from configobj import ConfigObj
+    
     config = ConfigObj(config_file, raise_errors=True)
     config.walk(string_to_python_type)
     
@@ -26,10 +26,20 @@
 # TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
 # USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
 # DAMAGE.
-from Pipeline import Pipeline, DEFAULT_LOG_LEVEL, DEFAULT_LOCAL_LOGS
-from Step import Step
+from Pipeline import Pipeline, DEFAULT_LOG_LEVEL, DEFAULT_LOCAL_LOGS, \
+                     DEFAULT_MAX_WORKERS, DEFAULT_MAX_PROCESSES, \
+                     DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE, \
+                     DEFAULT_CHECKPOINT_DIR, DEFAULT_FREE_CLIPBOARD, \
+                     DEFAULT_FINAL_PRODUCTS, DEFAULT_CLIPBOARD_BUDGET, \
+                     DEFAULT_SPILL_DIR, DEFAULT_SPILL_COMPRESS, \
+                     DEFAULT_LAZY_STEPS, DEFAULT_PROFILE, DEFAULT_PROFILE_DIR, \
+                     DEFAULT_CPROFILE, DEFAULT_TRACK_MEMORY, \
+                     DEFAULT_MEMORY_WARNING, DEFAULT_ASYNC_LOGS
+from Step import Step, DeferredStep
 import utilities
 import config_parser
+from batch import BatchRunner, DEFAULT_INPUT_PARAMETER, DEFAULT_WORKERS
+from streaming import StreamingRunner, DEFAULT_QUEUE_SIZE
 
 
 
@@ -53,7 +63,32 @@ def pipeline_from_config_file(config_file):
     pipe = Pipeline(name=parsed['name'],
                     system=parsed['system'],
                     log_level=parsed.get('log_level', DEFAULT_LOG_LEVEL),
-                    local_logs=parsed.get('local_log_mode', DEFAULT_LOCAL_LOGS))
+                    local_logs=parsed.get('local_log_mode', DEFAULT_LOCAL_LOGS),
+                    max_workers=parsed.get('max_workers', DEFAULT_MAX_WORKERS),
+                    max_processes=parsed.get('max_processes', 
+                                             DEFAULT_MAX_PROCESSES),
+                    cache_dir=parsed.get('cache_dir', DEFAULT_CACHE_DIR),
+                    cache_size=parsed.get('cache_size', DEFAULT_CACHE_SIZE),
+                    checkpoint_dir=parsed.get('checkpoint_dir', 
+                                              DEFAULT_CHECKPOINT_DIR),
+                    free_clipboard=parsed.get('free_clipboard', 
+                                              DEFAULT_FREE_CLIPBOARD),
+                    final_products=parsed.get('final_products', 
+                                              DEFAULT_FINAL_PRODUCTS),
+                    clipboard_budget=parsed.get('clipboard_budget', 
+                                                DEFAULT_CLIPBOARD_BUDGET),
+                    spill_dir=parsed.get('spill_dir', DEFAULT_SPILL_DIR),
+                    spill_compress=parsed.get('spill_compress', 
+                                              DEFAULT_SPILL_COMPRESS),
+                    lazy_steps=parsed.get('lazy_steps', DEFAULT_LAZY_STEPS),
+                    profile=parsed.get('profile', DEFAULT_PROFILE),
+                    profile_dir=parsed.get('profile_dir', DEFAULT_PROFILE_DIR),
+                    cprofile=parsed.get('cprofile', DEFAULT_CPROFILE),
+                    track_memory=parsed.get('track_memory', 
+                                            DEFAULT_TRACK_MEMORY),
+                    memory_warning=parsed.get('memory_warning', 
+                                              DEFAULT_MEMORY_WARNING),
+                    async_logs=parsed.get('async_logs', DEFAULT_ASYNC_LOGS))
     
     # The only thing that requires special handling is the steps array. 
     # Here we have to create Step instances of the appropriate class and
@@ -70,7 +105,12 @@ def pipeline_from_config_file(config_file):
     # fetched and put in the clipboard. Data in Step.outbox is assumed to 
     # be in the order defined in that Step section of the Pipeline 
     # configuration file (outbox parameter).
-    steps = [Step.from_parsed_config(x, pipe) for x in parsed['steps']]
+    # With lazy_steps, Step classes are only imported and Steps only created
+    # right before they are needed (see Step.DeferredStep).
+    if(pipe.lazy_steps):
+        steps = [DeferredStep(x, pipe) for x in parsed['steps']]
+    else:
+        steps = [Step.from_parsed_config(x, pipe) for x in parsed['steps']]
     
     # Finally update the pipe.steps list. We did this so that the Step 
     # instances could make use in their initialization, of whatever they
@@ -80,4 +120,75 @@ def pipeline_from_config_file(config_file):
 
 
 
+def resume_from_config_file(config_file):
+    """
+    Create a Pipeline instance from the configuration file `config_file` (see
+    pipeline_from_config_file()) and resume its last failed run from the 
+    checkpoint in its checkpoint_dir (see Pipeline.resume()). Return the 
+    Pipeline instance.
+    """
+    pipe = pipeline_from_config_file(config_file)
+    pipe.resume()
+    return(pipe)
+
+
+
+def run_batch(config_file, inputs, input_step, 
+              input_parameter=DEFAULT_INPUT_PARAMETER, 
+              workers=DEFAULT_WORKERS, 
+              processes=False, 
+              prefetch=False):
+    """
+    Create a Pipeline instance from the configuration file `config_file` (see
+    pipeline_from_config_file()) and run it once per element of the iterable
+    `inputs`, each time with an empty clipboard. Before each run, the input is
+    assigned to the parameter `input_parameter` of the Step called 
+    `input_step`, e.g.
+        run_batch('pipeline.cfg', glob.glob('*.fits'), 'ReadFitsImageStep')
+    
+    Inputs are processed by `workers` threads or, if `processes` is True, 
+    worker processes. With `prefetch`, the input Step starts loading upcoming
+    inputs in the background (threads only). Return a batch.BatchReport 
+    instance with the per input outcome and the aggregate throughput.
+    """
+    pipe = pipeline_from_config_file(config_file)
+    runner = BatchRunner(pipe, 
+                         input_step=input_step, 
+                         input_parameter=input_parameter, 
+                         workers=workers, 
+                         processes=processes, 
+                         prefetch=prefetch)
+    try:
+        return(runner.run(inputs))
+    finally:
+        pipe.close()
+
+
+
+def run_stream(config_file, inputs, input_step, 
+               input_parameter=DEFAULT_INPUT_PARAMETER, 
+               queue_size=DEFAULT_QUEUE_SIZE):
+    """
+    Create a Pipeline instance from the configuration file `config_file` (see
+    pipeline_from_config_file()) and stream the elements of the iterable 
+    `inputs` through it, each Step being a stage running concurrently with the
+    others (see streaming.StreamingRunner). Each input is assigned to the 
+    parameter `input_parameter` of the Step called `input_step`.
+    
+    This is a generator yielding a streaming.StreamItem instance, with its 
+    clipboard, per input as soon as it has gone through the last Step.
+    """
+    pipe = pipeline_from_config_file(config_file)
+    runner = StreamingRunner(pipe, 
+                             input_step=input_step, 
+                             input_parameter=input_parameter, 
+                             queue_size=queue_size)
+    try:
+        for stream_item in runner.run(inputs):
+            yield(stream_item)
+    finally:
+        pipe.close()
+
+
+
 
@@ -0,0 +1,364 @@
+# Copyright (C) 2010 Association of Universities for Research in Astronomy(AURA)
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+# 
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+"""
+Event loop
+
+A minimal, select() based, event loop running generator based coroutines. This
+is what Pipeline.run_async() uses to drive many I/O and subprocess bound Steps 
+from a single thread.
+
+A coroutine is a generator which yields what it wants to wait for and is 
+resumed with the corresponding result:
+    1. Readable(fd1, fd2, ..., timeout=None): wait until at least one of the
+       given file descriptors is readable or `timeout` seconds have passed.
+       The result is the list of readable ones (empty on timeout).
+    2. Sleep(seconds): wait for `seconds` seconds. The result is None.
+    3. CallInThread(func, *args): call func(*args) in a separate thread (for
+       blocking code). The result is the function return value.
+    4. Another generator: run it as a coroutine. The result is its return 
+       value.
+    5. A Task instance (see EventLoop.spawn()): wait for it to complete. The
+       result is its return value.
+    6. Spawn(coroutine): schedule `coroutine` to run concurrently. The result,
+       immediately available, is the corresponding Task instance.
+Exceptions are raised in the waiting coroutine, as usual. Coroutines return a 
+value by raising Return(value).
+"""
+import collections
+import heapq
+import os
+import select
+import sys
+import threading
+import time
+import types
+
+
+
+
+class Return(Exception):
+    """
+    Raised by a coroutine to return `value` to whoever is waiting for it.
+    """
+    def __init__(self, value=None):
+        super(Return, self).__init__(value)
+        self.value = value
+        return
+
+
+
+
+
+class Readable(object):
+    """
+    Wait for any of the given file descriptors to be readable, for at most 
+    `timeout` seconds (forever if None).
+    """
+    def __init__(self, *fds, **kws):
+        self.fds = fds
+        self.timeout = kws.get('timeout', None)
+        return
+
+
+
+
+
+class Sleep(object):
+    """
+    Wait for `seconds` seconds.
+    """
+    def __init__(self, seconds):
+        self.seconds = seconds
+        return
+
+
+
+
+
+class CallInThread(object):
+    """
+    Call func(*args, **kws) in a new thread and wait for it to return.
+    """
+    def __init__(self, func, *args, **kws):
+        self.func = func
+        self.args = args
+        self.kws = kws
+        return
+
+
+
+
+
+class Spawn(object):
+    """
+    Schedule the generator `coroutine` as a new Task.
+    """
+    def __init__(self, coroutine):
+        self.coroutine = coroutine
+        return
+
+
+
+
+
+class Task(object):
+    """
+    A coroutine scheduled on an EventLoop instance.
+    """
+    def __init__(self, coroutine):
+        self.stack = [coroutine]
+        self.done = False
+        self.result = None
+        self.exc_info = None
+        self.waiters = []
+        # Incremented every time the Task waits for something or is woken up,
+        # so that we can tell stale wake up calls (e.g. a timer firing after
+        # the file descriptor became readable) apart.
+        self.wait_id = 0
+        return
+
+
+
+
+
+class EventLoop(object):
+    """
+    Run coroutines until they complete.
+    """
+    def __init__(self):
+        """
+        Configure the EventLoop instance.
+        """
+        # Tasks ready to be resumed, as (task, value, exc_info) tuples.
+        self._ready = collections.deque()
+        # File descriptor -> (Task waiting for it, wait id).
+        self._readers = {}
+        # Heap of (deadline, counter, task, wait id, value to wake up with).
+        self._timers = []
+        self._counter = 0
+        # Threads wake us up by writing to this pipe.
+        (self._wakeup_r, self._wakeup_w) = os.pipe()
+        self._lock = threading.Lock()
+        self._from_threads = []
+        return
+    
+    
+    def spawn(self, coroutine):
+        """
+        Schedule the generator `coroutine` and return the corresponding Task.
+        """
+        task = Task(coroutine)
+        self._ready.append((task, None, None))
+        return(task)
+    
+    
+    def run_until_complete(self, coroutine):
+        """
+        Run the generator `coroutine` (and everything it spawns) until it is 
+        done. Return its return value or raise its exception.
+        """
+        task = self.spawn(coroutine)
+        while(not task.done):
+            self._run_once()
+        if(task.exc_info is not None):
+            raise(task.exc_info[1])
+        return(task.result)
+    
+    
+    def close(self):
+        """
+        Release the resources held by the loop.
+        """
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
+        return
+    
+    
+    def _run_once(self):
+        """
+        Wait for something to happen (unless some Task is ready already) and 
+        then resume all ready Tasks.
+        """
+        timeout = None
+        if(self._ready):
+            timeout = 0.
+        elif(self._timers):
+            timeout = max(0., self._timers[0][0] - time.time())
+        fds = list(self._readers.keys()) + [self._wakeup_r, ]
+        (readable, writable, errors) = select.select(fds, [], [], timeout)
+        
+        # Readers.
+        woken = {}
+        for fd in readable:
+            if(fd == self._wakeup_r):
+                os.read(self._wakeup_r, 4096)
+                continue
+            if(fd in self._readers):
+                woken.setdefault(self._readers[fd], []).append(fd)
+        for ((task, wait_id), fds) in woken.items():
+            self._wake(task, wait_id, fds)
+        
+        # Threads.
+        with self._lock:
+            (done, self._from_threads) = (self._from_threads, [])
+        self._ready.extend(done)
+        
+        # Timers.
+        now = time.time()
+        while(self._timers and self._timers[0][0] <= now):
+            (deadline, counter, task, wait_id, value) = \
+                heapq.heappop(self._timers)
+            self._wake(task, wait_id, value)
+        
+        # Resume whoever is ready (and whoever they wake up in turn).
+        while(self._ready):
+            (task, value, exc_info) = self._ready.popleft()
+            self._step(task, value, exc_info)
+        return
+    
+    
+    def _step(self, task, value, exc_info):
+        """
+        Resume `task` sending it `value` (or raising `exc_info`) until it 
+        yields something to wait for or completes.
+        """
+        while(True):
+            coroutine = task.stack[-1]
+            try:
+                if(exc_info is not None):
+                    waitable = coroutine.throw(*exc_info)
+                else:
+                    waitable = coroutine.send(value)
+            except Return as e:
+                (value, exc_info) = (e.value, None)
+            except StopIteration:
+                (value, exc_info) = (None, None)
+            except Exception:
+                (value, exc_info) = (None, sys.exc_info())
+            else:
+                (value, exc_info) = (None, None)
+                if(isinstance(waitable, types.GeneratorType)):
+                    task.stack.append(waitable)
+                elif(isinstance(waitable, Spawn)):
+                    value = self.spawn(waitable.coroutine)
+                elif(isinstance(waitable, Task)):
+                    if(not waitable.done):
+                        waitable.waiters.append(task)
+                        return
+                    (value, exc_info) = (waitable.result, waitable.exc_info)
+                elif(not self._wait(task, waitable)):
+                    exc_info = (TypeError, 
+                                TypeError('Cannot wait for %r' % (waitable)),
+                                None)
+                else:
+                    return
+                continue
+            
+            # The current coroutine is done: resume its caller, if any.
+            task.stack.pop()
+            if(not task.stack):
+                self._finish(task, value, exc_info)
+                return
+        return
+    
+    
+    def _wait(self, task, waitable):
+        """
+        Make `task` wait for `waitable`. Return False if we do not know how to.
+        """
+        task.wait_id += 1
+        if(isinstance(waitable, Readable)):
+            for fd in waitable.fds:
+                self._readers[fd] = (task, task.wait_id)
+            if(waitable.timeout is not None):
+                self._add_timer(task, waitable.timeout, [])
+        elif(isinstance(waitable, Sleep)):
+            self._add_timer(task, waitable.seconds, None)
+        elif(isinstance(waitable, CallInThread)):
+            thread = threading.Thread(target=self._call_in_thread, 
+                                      args=(task, waitable))
+            thread.setDaemon(True)
+            thread.start()
+        else:
+            return(False)
+        return(True)
+    
+    
+    def _add_timer(self, task, seconds, value):
+        """
+        Wake `task` up with `value` in `seconds` seconds, unless something else
+        wakes it up first.
+        """
+        self._counter += 1
+        heapq.heappush(self._timers, (time.time() + seconds, self._counter, 
+                                      task, task.wait_id, value))
+        return
+    
+    
+    def _wake(self, task, wait_id, value):
+        """
+        Schedule `task` to be resumed with `value`, unless `wait_id` says that
+        it is not waiting for us anymore.
+        """
+        if(wait_id != task.wait_id):
+            return
+        task.wait_id += 1
+        for (fd, (t, i)) in list(self._readers.items()):
+            if(t is task):
+                del(self._readers[fd])
+        self._ready.append((task, value, None))
+        return
+    
+    
+    def _call_in_thread(self, task, call):
+        """
+        Thread side of CallInThread: call the function and hand the result 
+        back to the loop.
+        """
+        try:
+            result = (task, call.func(*call.args, **call.kws), None)
+        except Exception:
+            result = (task, None, sys.exc_info())
+        with self._lock:
+            self._from_threads.append(result)
+        os.write(self._wakeup_w, '\0')
+        return
+    
+    
+    def _finish(self, task, value, exc_info):
+        """
+        Mark `task` as done and resume whoever is waiting for it.
+        """
+        task.done = True
+        task.result = value
+        task.exc_info = exc_info
+        for waiter in task.waiters:
+            self._ready.append((waiter, value, exc_info))
+        task.waiters = []
+        return
@@ -0,0 +1,170 @@
+# Copyright (C) 2010 Association of Universities for Research in Astronomy(AURA)
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+# 
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+"""
+Logs
+
+Logging set up for Pipelines (see get_logger()). Each logger gets a single 
+handler however many Pipelines with the same qualified name are created, so 
+that log lines are not repeated. Optionally, records are handed over to a 
+background thread writing them out (see AsyncHandler), so that Steps do not 
+wait for the log file or terminal.
+
+Log calls in stpipe pass their arguments to the logger instead of formatting
+the message themselves: messages below the logger level then cost a level 
+check and nothing else.
+"""
+import atexit
+import logging
+import os
+import Queue
+import threading
+
+
+
+
+
+# Constants/Default Values.
+FORMAT = '%(asctime)s - %(classname)s - %(levelname)s - %(message)s'
+
+# The handler set up for each logger name by get_logger().
+_HANDLERS = {}
+_LOCK = threading.Lock()
+
+
+
+def get_logger(name, level, file_name=None, asynchronous=False):
+    """
+    Return the logger `name` set to `level` (e.g. logging.DEBUG) and logging 
+    to `file_name` or, if None, to stderr, through an AsyncHandler if 
+    `asynchronous` is True. The handler is only created the first time a 
+    given logger is asked for: later calls only change its level.
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    with _LOCK:
+        handler = _HANDLERS.get(name)
+        if(handler is None):
+            if(file_name):
+                handler = logging.FileHandler(file_name)
+            else:
+                handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter(FORMAT))
+            if(asynchronous):
+                handler = AsyncHandler(handler)
+            logger.addHandler(handler)
+            _HANDLERS[name] = handler
+        handler.setLevel(level)
+    return(logger)
+
+
+
+
+
+class AsyncHandler(logging.Handler):
+    """
+    Logging handler queueing records for `handler`, which gets them from a 
+    background thread. Records are formatted there as well: objects passed as
+    arguments to log calls should not be modified afterwards. flush() waits 
+    for the records queued so far to be written, which happens at exit at the
+    latest.
+    
+    In processes forked after the handler was created (e.g. worker processes)
+    records are passed to `handler` right away.
+    """
+    def __init__(self, handler):
+        logging.Handler.__init__(self)
+        self.handler = handler
+        self._queue = Queue.Queue()
+        self._pid = os.getpid()
+        self._closed = False
+        self._thread = threading.Thread(target=self._write, 
+                                        name='stpipe-log-writer')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+        return
+    
+    
+    def setLevel(self, level):
+        logging.Handler.setLevel(self, level)
+        self.handler.setLevel(level)
+        return
+    
+    
+    def emit(self, record):
+        if(self._closed or os.getpid() != self._pid):
+            self.handler.handle(record)
+            return
+        
+        # Tracebacks have to be rendered while they are still around.
+        if(record.exc_info):
+            formatter = self.handler.formatter or logging.Formatter()
+            record.exc_text = formatter.formatException(record.exc_info)
+            record.exc_info = None
+        self._queue.put(record)
+        return
+    
+    
+    def flush(self):
+        if(os.getpid() == self._pid and self._thread.is_alive()):
+            self._queue.join()
+        self.handler.flush()
+        return
+    
+    
+    def close(self):
+        """
+        Write the pending records, stop the background thread and close 
+        self.handler.
+        """
+        if(os.getpid() != self._pid):
+            return
+        self.acquire()
+        try:
+            if(self._closed):
+                return
+            self._closed = True
+        finally:
+            self.release()
+        self._queue.put(None)
+        self._thread.join()
+        self.handler.close()
+        logging.Handler.close(self)
+        return
+    
+    
+    def _write(self):
+        while(True):
+            record = self._queue.get()
+            try:
+                if(record is None):
+                    return
+                self.handler.handle(record)
+            finally:
+                self._queue.task_done()
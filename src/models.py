@@ -32,11 +32,492 @@
 
 class Image(object):
     """
-    Dummy wrapper around a PyFITS HDU list.
+    An image: science pixels (data) with optional mask and variance planes of
+    the same shape, an optional header and/or the PyFITS HDU list it was read
+    from.
+    
+    If no data array is given, data is that of the first HDU in `hdu_list` 
+    having any. If the HDUs come from a FITS file which is still open (e.g. 
+    because their data is memory-mapped or not read yet), `fits_file` is the 
+    corresponding PyFITS HDUList and the Image is responsible for closing it 
+    (see self.close()). Images can be used as context managers to that effect.
+    
+    Images own their planes (owns_data is True) unless they are views of 
+    another Image (see self.view()): an Image owning its planes can be 
+    modified in place, anything else should be copied first (see self.own()).
+    Arrays passed to the constructor are not copied (unless `copy` is True):
+    the Image takes them over.
     """
-    def __init__(self, hdu_list=[]):
+    __slots__ = ('hdu_list', 'fits_file', 'header', 'mask', 'variance', 
+                 'owns_data', 'parent', '_data')
+    
+    def __init__(self, hdu_list=None, fits_file=None, data=None, mask=None, 
+                 variance=None, header=None, copy=False):
+        if(hdu_list is None):
+            hdu_list = []
+        if(copy):
+            (data, mask, variance) = [_copy_array(a) \
+                                      for a in (data, mask, variance)]
         self.hdu_list = hdu_list
+        self.fits_file = fits_file
+        self.header = header
+        self.mask = mask
+        self.variance = variance
+        self.owns_data = True
+        # The Image this one is a view of, if any.
+        self.parent = None
+        self._data = data
         return
+    
+    
+    def _get_data(self):
+        if(self._data is None):
+            for hdu in self.hdu_list:
+                # Look at the header: hdu.data would read the pixels.
+                header = getattr(hdu, 'header', None)
+                if(header is None or header.get('NAXIS', 0) > 0):
+                    return(getattr(hdu, 'data', None))
+        return(self._data)
+    
+    
+    def _set_data(self, data):
+        self._data = data
+        return
+    
+    data = property(_get_data, _set_data, 
+                    doc='The science pixels (see the class documentation).')
+    
+    
+    @property
+    def shape(self):
+        data = self.data
+        if(data is None):
+            return(None)
+        return(data.shape)
+    
+    
+    def view(self, key=Ellipsis):
+        """
+        Return a new Image sharing the planes of this one, restricted to 
+        plane[key] (basic slicing only) if `key` is given: no pixel is copied
+        and changes made through either Image are visible in both. The view 
+        does not own its data and keeps this Image alive (as its parent). 
+        image[key] is the same as image.view(key).
+        """
+        view = Image(data=_view_array(self.data, key), 
+                     mask=_view_array(self.mask, key), 
+                     variance=_view_array(self.variance, key), 
+                     header=self.header)
+        view.owns_data = False
+        view.parent = self
+        return(view)
+    
+    
+    def __getitem__(self, key):
+        return(self.view(key))
+    
+    
+    def copy(self):
+        """
+        Return a deep copy of the Image (HDUs and planes), owning its data.
+        """
+        header = self.header
+        if(header is not None and hasattr(header, 'copy')):
+            header = header.copy()
+        return(Image(hdu_list=[_copy_hdu(hdu) for hdu in self.hdu_list], 
+                     data=_copy_array(self._data), 
+                     mask=_copy_array(self.mask), 
+                     variance=_copy_array(self.variance), 
+                     header=header))
+    
+    
+    def own(self):
+        """
+        Return self if it owns its data, a copy of it otherwise: the result 
+        can be modified in place.
+        """
+        if(self.owns_data):
+            return(self)
+        return(self.copy())
+    
+    
+    def map_pixels(self, func):
+        """
+        Replace the science pixels with func(pixels): those of self.data if
+        set, else those of each HDU with at least two axes (e.g. all the 
+        extensions of a MEF). The mask and variance planes are left alone.
+        """
+        if(self._data is not None):
+            self._data = func(self._data)
+            return
+        for hdu in self.hdu_list:
+            header = getattr(hdu, 'header', None)
+            if(header is not None and header.get('NAXIS', 0) >= 2):
+                hdu.data = func(hdu.data)
+        return
+    
+    
+    def to_hdu_list(self):
+        """
+        Return the list of PyFITS HDUs to write the Image as: self.hdu_list if
+        not empty, else a primary HDU with the science pixels (and the 
+        header) followed by MASK and VARIANCE extensions if present.
+        """
+        if(self.hdu_list):
+            return(list(self.hdu_list))
+        import pyfits
+        
+        hdus = [pyfits.PrimaryHDU(data=self.data, header=self.header)]
+        if(self.mask is not None):
+            mask = self.mask
+            if(mask.dtype == bool):
+                # FITS has no boolean images.
+                mask = mask.view('uint8')
+            hdus.append(pyfits.ImageHDU(data=mask, name='MASK'))
+        if(self.variance is not None):
+            hdus.append(pyfits.ImageHDU(data=self.variance, name='VARIANCE'))
+        return(hdus)
+    
+    
+    def close(self):
+        """
+        Close the underlying FITS file, if any. Pixel data not accessed yet is
+        not available anymore afterwards.
+        """
+        if(self.fits_file is not None):
+            self.fits_file.close()
+            self.fits_file = None
+        return
+    
+    
+    def __enter__(self):
+        return(self)
+    
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return(False)
+    
+    
+    def __getstate__(self):
+        """
+        PyFITS HDUs cannot be pickled: replace each of them with a tuple of 
+        HDU class, header (as a string) and data array. The copy does not 
+        need the FITS file nor the parent of a view anymore: it owns its data.
+        """
+        state = dict([(name, getattr(self, name)) for name in self.__slots__])
+        state['hdu_list'] = [_hdu_to_tuple(hdu) for hdu in self.hdu_list]
+        state['fits_file'] = None
+        state['parent'] = None
+        state['owns_data'] = True
+        return(state)
+    
+    
+    def __setstate__(self, state):
+        """
+        Recreate the PyFITS HDUs from the output of self.__getstate__().
+        """
+        self.__init__()
+        for (name, value) in state.items():
+            setattr(self, name, value)
+        self.hdu_list = [_hdu_from_tuple(hdu) for hdu in self.hdu_list]
+        return
+    
+    
+    def iter_blocks(self, rows, halo=0, extension=0):
+        """
+        Iterate over the pixel data of HDU number `extension` (self.data if 
+        the Image has no HDUs) in blocks of (at most) `rows` rows, extended by
+        `halo` rows on either side where available. Yield a Chunk per block. 
+        Blocks span the last two axes of the data, leading axes (e.g. cube 
+        planes) are always taken whole.
+        
+        If the data has not been read from the FITS file yet, only the 
+        requested rows are read, so that memory usage is bound by the chunk 
+        size rather than by the image size.
+        """
+        return(self.iter_tiles((rows, None), halo=halo, extension=extension))
+    
+    
+    def iter_tiles(self, shape, halo=0, extension=0):
+        """
+        Iterate over the pixel data of HDU number `extension` in tiles of 
+        (at most) `shape` = (rows, columns) pixels, each extended by `halo` 
+        pixels on every side where available. A None size means the whole 
+        axis. Yield a Chunk per tile, in row-major order.
+        """
+        if(self.hdu_list):
+            (getter, full_shape) = _pixel_access(self.hdu_list[extension])
+        else:
+            # Array-backed Image: there is only the science plane.
+            (getter, full_shape) = _pixel_access(self)
+        for (read, region, core) in tile_slices(full_shape, shape, halo):
+            yield(Chunk(getter(read), region, core))
+        return
+
+
+
+class Chunk(object):
+    """
+    A piece of an image, as yielded by Image.iter_blocks() and 
+    Image.iter_tiles().
+    
+    `data` is the pixel array of the chunk, halo included. `region` is the 
+    tuple of slices selecting the chunk (halo excluded) in the full image and
+    `core` the tuple of slices selecting the same pixels in `data`.
+    """
+    def __init__(self, data, region, core):
+        self.data = data
+        self.region = region
+        self.core = core
+        return
+    
+    
+    @property
+    def core_data(self):
+        """
+        The pixels of the chunk, halo excluded.
+        """
+        return(self.data[self.core])
+
+
+
+class ChunkedImageWriter(object):
+    """
+    Assemble an image of the given `shape` and `dtype` in the FITS file 
+    `file_name` chunk by chunk. The file is created up front (with the cards
+    of the optional `header` in its primary HDU) and its data part is 
+    memory-mapped, so that only the chunks being written need to be in RAM.
+    
+    Usage:
+        writer = ChunkedImageWriter('out.fits', shape, numpy.float32)
+        for chunk in image.iter_tiles((512, 512), halo=2):
+            writer.write_chunk(chunk, detrend(chunk.data))
+        result = writer.close()
+    """
+    def __init__(self, file_name, shape, dtype, header=None):
+        import numpy
+        import pyfits
+        
+        self.file_name = file_name
+        self.shape = tuple(shape)
+        self.dtype = numpy.dtype(dtype)
+        if(self.dtype.name not in _BITPIX):
+            raise(TypeError('Unsupported FITS data type %s.' % (dtype, )))
+        
+        # Structural keywords first, in the order the FITS standard wants.
+        fits_header = pyfits.Header()
+        fits_header['SIMPLE'] = True
+        fits_header['BITPIX'] = _BITPIX[self.dtype.name]
+        fits_header['NAXIS'] = len(self.shape)
+        for (i, n) in enumerate(reversed(self.shape)):
+            fits_header['NAXIS%d' % (i + 1)] = n
+        fits_header['EXTEND'] = True
+        if(header is not None):
+            for card in header.cards:
+                if(card.keyword not in _STRUCTURAL_KEYWORDS and 
+                   not card.keyword.startswith('NAXIS')):
+                    fits_header.append(card)
+        header_string = fits_header.tostring()
+        
+        # Write the header and extend the file to its final (padded) size:
+        # the data part stays sparse until chunks are written.
+        data_size = self.dtype.itemsize
+        for n in self.shape:
+            data_size *= n
+        padded_size = -(-data_size // _FITS_BLOCK) * _FITS_BLOCK
+        f = open(file_name, 'wb')
+        try:
+            f.write(header_string.encode('ascii'))
+            f.truncate(len(header_string) + padded_size)
+        finally:
+            f.close()
+        
+        # FITS data is big-endian.
+        self._data = numpy.memmap(file_name, 
+                                  dtype=self.dtype.newbyteorder('>'), 
+                                  mode='r+', 
+                                  offset=len(header_string), 
+                                  shape=self.shape)
+        return
+    
+    
+    def write(self, region, data):
+        """
+        Write the array `data` to the tuple of slices `region` of the image.
+        """
+        if(self._data is None):
+            raise(ValueError('Writer for %s is closed.' % (self.file_name, )))
+        self._data[region] = data
+        return
+    
+    
+    def write_chunk(self, chunk, data):
+        """
+        Write the result `data` of processing `chunk` (i.e. an array with the
+        shape of chunk.data, halo included) to the region of the image the 
+        chunk was read from. The halo is discarded.
+        """
+        return(self.write(chunk.region, data[chunk.core]))
+    
+    
+    def close(self):
+        """
+        Flush the data to disk and return the result as a memory-mapped 
+        Image (which should be closed when done with).
+        """
+        import pyfits
+        
+        if(self._data is not None):
+            self._data.flush()
+            self._data = None
+        fits_file = pyfits.open(self.file_name, memmap=True)
+        return(Image(list(fits_file), fits_file=fits_file))
+    
+    
+    def __enter__(self):
+        return(self)
+    
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if(self._data is not None):
+            self._data.flush()
+            self._data = None
+        return(False)
+
+
+
+# FITS files are made of blocks of this many bytes.
+_FITS_BLOCK = 2880
+# Keywords of a source header describing its own data layout or scaling, 
+# which do not apply to the raw pixels ChunkedImageWriter writes.
+_STRUCTURAL_KEYWORDS = ('SIMPLE', 'BITPIX', 'EXTEND', 'END', 'PCOUNT', 'GCOUNT',
+                        'XTENSION', 'BZERO', 'BSCALE', 'BLANK')
+
+# BITPIX values of the data types FITS supports natively.
+_BITPIX = {'uint8': 8, 
+           'int16': 16, 
+           'int32': 32, 
+           'int64': 64, 
+           'float32': -32, 
+           'float64': -64}
+
+
+
+def _pixel_access(hdu):
+    """
+    Return (getter, shape) for the pixel data of `hdu`, where getter(key) 
+    returns the data[key] sub-array. If `hdu` is a PyFITS HDU whose data has 
+    not been loaded yet, read only the requested section from its file.
+    """
+    if('data' not in getattr(hdu, '__dict__', {'data': None}) and 
+       hasattr(hdu, 'section') and getattr(hdu, '_file', None) is not None):
+        shape = tuple(hdu.shape)
+        section = hdu.section
+        return(lambda key: section[key], shape)
+    
+    data = hdu.data
+    return(lambda key: data[key], data.shape)
+
+
+
+def tile_slices(shape, tile_shape, halo=0):
+    """
+    Return the list of (read, region, core) tuples of slices describing the
+    tiles of (at most) `tile_shape` = (rows, columns) pixels an array of the 
+    given `shape` is made of, in row-major order: data[read] is the tile 
+    extended by `halo` pixels on every side (where available), data[region]
+    the tile itself and data[read][core] the tile within the extended one. A
+    None tile size means the whole axis. Tiles span the last two axes, 
+    leading axes are taken whole.
+    """
+    if(len(shape) < 2):
+        raise(ValueError('Tiling needs at least 2-D data.'))
+    leading = (slice(None), ) * (len(shape) - 2)
+    (num_rows, num_cols) = shape[-2:]
+    (tile_rows, tile_cols) = tile_shape
+    if(tile_rows is None):
+        tile_rows = num_rows
+    if(tile_cols is None):
+        tile_cols = num_cols
+    if(tile_rows <= 0 or tile_cols <= 0 or halo < 0):
+        raise(ValueError('Invalid tile shape %s or halo %s.' 
+                         % (str(tile_shape), str(halo))))
+    
+    pieces = []
+    for row in range(0, num_rows, tile_rows):
+        (row_read, row_core) = _halo_slices(row, tile_rows, num_rows, halo)
+        for col in range(0, num_cols, tile_cols):
+            (col_read, col_core) = _halo_slices(col, tile_cols, num_cols, halo)
+            region = (slice(row, row + row_core.stop - row_core.start), 
+                      slice(col, col + col_core.stop - col_core.start))
+            pieces.append((leading + (row_read, col_read), 
+                           leading + region, 
+                           leading + (row_core, col_core)))
+    return(pieces)
+
+
+
+def _halo_slices(start, size, length, halo):
+    """
+    Return (read, core): the slice of the axis of length `length` covering
+    [start, start + size) plus `halo` on either side (clipped to the axis) and
+    the slice of [start, start + size) within it.
+    """
+    stop = min(start + size, length)
+    lo = max(start - halo, 0)
+    hi = min(stop + halo, length)
+    return(slice(lo, hi), slice(start - lo, stop - lo))
+
+
+
+def _copy_array(array):
+    if(array is None):
+        return(None)
+    return(array.copy())
+
+
+
+def _view_array(array, key):
+    if(array is None):
+        return(None)
+    return(array[key])
+
+
+
+def _copy_hdu(hdu):
+    """
+    Return a copy of the PyFITS HDU `hdu`, data included. Return `hdu` 
+    unchanged if it is not a PyFITS HDU.
+    """
+    if(not hasattr(hdu, 'header') or not hasattr(hdu, 'data')):
+        return(hdu)
+    return(hdu.__class__(data=_copy_array(hdu.data), 
+                         header=hdu.header.copy()))
+
+
+
+def _hdu_to_tuple(hdu):
+    """
+    Return (HDU class, header string, data) for the PyFITS HDU `hdu`. Return 
+    `hdu` unchanged if it is not a PyFITS HDU.
+    """
+    if(not hasattr(hdu, 'header') or not hasattr(hdu, 'data')):
+        return(hdu)
+    return((hdu.__class__, hdu.header.tostring(), hdu.data))
+
+
+
+def _hdu_from_tuple(hdu):
+    """
+    Inverse of _hdu_to_tuple().
+    """
+    if(not isinstance(hdu, tuple)):
+        return(hdu)
+    import pyfits
+    
+    (hdu_class, header, data) = hdu
+    return(hdu_class(data=data, header=pyfits.Header.fromstring(header)))
 
 
 
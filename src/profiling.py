@@ -0,0 +1,403 @@
+# Copyright (C) 2010 Association of Universities for Research in Astronomy(AURA)
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+# 
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+"""
+Profiling
+
+Per-Step instrumentation of Pipeline runs. For each Step run, a Profiler 
+records the wall clock and CPU time, the time spent getting inputs from and 
+putting outputs into the clipboard (type checks included), looking outputs up 
+in and storing them into the step cache and in process(), as well as the Step
+return code. Optionally, process() is run under cProfile and its statistics 
+dumped to one file per Step.
+
+At the end of a run, the Pipeline logs a summary table (see 
+Profiler.summary()) and, if the Profiler has a directory, writes a JSON report
+there (see Profiler.report()).
+
+With memory tracking, the resident set size (RSS) of the process before and
+after each Step run, its peak so far, the size of the clipboard and of each 
+Step output (see clipboard.sizeof()) are recorded as well, and a warning is 
+logged when the RSS goes over a given threshold, naming the Step and the 
+largest clipboard entries.
+
+CPU times and memory are those of the whole process: with Steps running 
+concurrently, they overlap. The CPU time and memory of Steps run by the 
+'process' backend are not accounted for.
+"""
+import itertools
+import os
+import sys
+import threading
+import time
+
+from clipboard import SpillingClipboard, sizeof
+
+
+
+
+
+# Phases of a Step run, in order.
+PHASES = ('clipboard_get', 'cache', 'process', 'clipboard_put')
+# Number of runs profiled so far in this process (see Profiler.start_run()).
+_RUNS = itertools.count(1)
+
+
+
+def cpu_time():
+    """
+    Return the user + system CPU time of the current process, in seconds.
+    """
+    times = os.times()
+    return(times[0] + times[1])
+
+
+
+def rss():
+    """
+    Return the resident set size of the current process, in bytes (or its 
+    peak, see peak_rss(), where /proc is not available).
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (IOError, OSError, IndexError, ValueError):
+        return(peak_rss())
+    return(pages * os.sysconf('SC_PAGE_SIZE'))
+
+
+
+def peak_rss():
+    """
+    Return the peak resident set size of the current process so far, in 
+    bytes.
+    """
+    import resource
+    
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux counts in KB, OS X in bytes.
+    if(sys.platform == 'darwin'):
+        return(peak)
+    return(peak * 1024)
+
+
+
+
+
+class StepProfile(object):
+    """
+    Timings of a single run of `step`. Time is attributed to the phase which 
+    ends with each call to lap(). If `profile_path` is given, call() runs its 
+    function under cProfile, dumping the statistics to that file (then 
+    recorded as self.profile_file). If `profiler` tracks memory, it measures
+    the memory use of the Step when stopped (see Profiler.measure_memory()).
+    """
+    def __init__(self, step, profile_path=None, profiler=None):
+        self.step_name = step.name
+        self.profile_path = profile_path
+        self.profile_file = None
+        self.return_code = None
+        self.start = time.time()
+        self.wall = None
+        self.cpu = None
+        self.phases = dict([(phase, 0.) for phase in PHASES])
+        self.memory = None
+        self._cpu_start = cpu_time()
+        self._last = self.start
+        self._step = None
+        self._profiler = profiler
+        if(profiler is not None and profiler.memory):
+            self._step = step
+            self.rss_start = rss()
+            self.peak_start = peak_rss()
+        return
+    
+    
+    def lap(self, phase):
+        """
+        Attribute the time elapsed since the previous lap to `phase`.
+        """
+        now = time.time()
+        self.phases[phase] += now - self._last
+        self._last = now
+        return
+    
+    
+    def call(self, func, *args):
+        """
+        Return func(*args), run under cProfile if self.profile_path is set.
+        """
+        if(not self.profile_path):
+            return(func(*args))
+        
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            return(profile.runcall(func, *args))
+        finally:
+            profile.dump_stats(self.profile_path)
+            self.profile_file = self.profile_path
+    
+    
+    def stop(self, return_code):
+        """
+        The Step run is over and returned `return_code`.
+        """
+        self.wall = time.time() - self.start
+        self.cpu = cpu_time() - self._cpu_start
+        self.return_code = return_code
+        if(self._step is not None):
+            self._profiler.measure_memory(self, self._step)
+            self._step = None
+        return
+    
+    
+    def to_dict(self):
+        record = {'step': self.step_name,
+                  'start': self.start,
+                  'wall': self.wall,
+                  'cpu': self.cpu,
+                  'return_code': self.return_code,
+                  'profile_file': self.profile_file,
+                  'memory': self.memory}
+        record.update(self.phases)
+        return(record)
+
+
+
+
+
+class _NoProfile(object):
+    """
+    Stand-in for a StepProfile when the Pipeline is not profiled.
+    """
+    def lap(self, phase):
+        return
+    
+    
+    def call(self, func, *args):
+        return(func(*args))
+    
+    
+    def stop(self, return_code):
+        return
+
+
+NO_PROFILE = _NoProfile()
+
+
+
+
+
+class Profiler(object):
+    """
+    Collect a StepProfile for each Step run of a Pipeline run. If `directory`
+    is given, the JSON reports go there, as well as the cProfile statistics of
+    each Step if `cprofile` is True (in the current directory if no directory 
+    is given). If `memory` is True, the memory use of each Step is measured 
+    too, with a warning when the RSS goes over `memory_warning` bytes (if 
+    larger than 0).
+    """
+    def __init__(self, name, directory=None, cprofile=False, memory=False, 
+                 memory_warning=0):
+        self.name = name
+        self.directory = directory
+        self.cprofile = cprofile
+        self.memory = memory
+        self.memory_warning = memory_warning
+        self.run_id = None
+        self.start = None
+        self.profiles = []
+        # Size of each clipboard key when last put there by a Step.
+        self.key_sizes = {}
+        self._over_warning = False
+        self._lock = threading.Lock()
+        return
+    
+    
+    def start_run(self, label=None):
+        """
+        Forget the previous run and start recording a new one, optionally 
+        labelled with the string `label` (e.g. the index of a streamed input)
+        in its ID.
+        """
+        with self._lock:
+            self.run_id = '%s.%d.%d' % (self.name, os.getpid(), next(_RUNS))
+            if(label is not None):
+                self.run_id += '.%s' % (label)
+            self.start = time.time()
+            self.profiles = []
+            self.key_sizes = {}
+            self._over_warning = False
+        return
+    
+    
+    def start_step(self, step):
+        """
+        Return the StepProfile of a new run of `step`. It is recorded right 
+        away, so that Steps which raise an exception show up in the report 
+        (with no return code).
+        """
+        profile_path = None
+        if(self.cprofile):
+            profile_path = self._path('%s.%s.prof' % (self.run_id, step.name))
+        profile = StepProfile(step, profile_path, self)
+        with self._lock:
+            self.profiles.append(profile)
+        return(profile)
+    
+    
+    def measure_memory(self, profile, step):
+        """
+        Record in `profile` the memory use of the process once `step` is done
+        and the size of its outputs and of the clipboard it ran on (e.g. that
+        of a batch or streamed input). Warn (in the log of `step`) if the RSS 
+        just went over self.memory_warning.
+        """
+        outputs = {}
+        for info in step.output_info:
+            outputs[info[0]] = sizeof(getattr(step, info[0], None))
+        clipboard = step._clipboard
+        if(isinstance(clipboard, SpillingClipboard)):
+            clipboard_size = clipboard.resident_bytes
+        else:
+            clipboard_size = sizeof(dict(clipboard))
+        now = rss()
+        peak = peak_rss()
+        profile.memory = {'rss_start': profile.rss_start,
+                          'rss': now,
+                          'rss_delta': now - profile.rss_start,
+                          'peak_rss': peak,
+                          'peak_delta': peak - profile.peak_start,
+                          'clipboard': clipboard_size,
+                          'outputs': outputs}
+        
+        with self._lock:
+            self.key_sizes.update(outputs)
+            over = self.memory_warning > 0 and now > self.memory_warning
+            crossed = over and not self._over_warning
+            self._over_warning = over
+            largest = sorted([(size, key) for (key, size) in 
+                              self.key_sizes.items() if key in clipboard], 
+                             reverse=True)[:3]
+        if(crossed):
+            step.log.warning('Memory use (RSS) %.1f MB over %.1f MB after ' 
+                             'Step %s (%+.1f MB). Largest clipboard entries: ' 
+                             '%s.', now / 1048576., 
+                             self.memory_warning / 1048576., step.name, 
+                             profile.memory['rss_delta'] / 1048576., 
+                             ', '.join(['%s (%.1f MB)' \
+                                        % (key, size / 1048576.) \
+                                        for (size, key) in largest]) or 'none')
+        return
+    
+    
+    def report(self):
+        """
+        Return the profile of the current run as a dictionary. With memory 
+        tracking, it includes the size of each clipboard key when last put 
+        there.
+        """
+        with self._lock:
+            profiles = list(self.profiles)
+            key_sizes = dict(self.key_sizes)
+        report = {'pipeline': self.name,
+                  'run': self.run_id,
+                  'start': self.start,
+                  'wall': time.time() - self.start,
+                  'steps': [profile.to_dict() for profile in profiles]}
+        if(self.memory):
+            report['clipboard'] = key_sizes
+        return(report)
+    
+    
+    def save(self):
+        """
+        Write self.report() as JSON to <run id>.json in self.directory and 
+        return the file path.
+        """
+        import json
+        
+        path = self._path('%s.json' % (self.run_id))
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+        return(path)
+    
+    
+    def summary(self):
+        """
+        Return a human readable table of the Step timings (in seconds) of the 
+        current run, in the order the Steps started. With memory tracking, the
+        table also shows the RSS after each Step, its change during the Step,
+        the peak RSS and the size of the Step outputs (in MB).
+        """
+        report = self.report()
+        width = max([len('Step')] + [len(s['step']) for s in report['steps']])
+        columns = ['Step', 'rc', 'wall', 'cpu', 'get', 'cache', 'process', 
+                   'put']
+        if(self.memory):
+            columns += ['rss', 'delta', 'peak', 'outputs']
+        row = '%%-%ds %%6s' % (width) + ' %9s' * (len(columns) - 2)
+        lines = [row % tuple(columns)]
+        for step in report['steps']:
+            values = [step['step'], step['return_code']] + \
+                     [_seconds(step[key]) for key in ('wall', 'cpu') + PHASES]
+            if(self.memory):
+                values += _megabytes(step['memory'])
+            lines.append(row % tuple(values))
+        lines.append('Total wall clock time: %s s.' \
+                     % (_seconds(report['wall'])))
+        return('\n'.join(lines))
+    
+    
+    def _path(self, file_name):
+        if(self.directory is None):
+            return(file_name)
+        try:
+            os.makedirs(self.directory)
+        except OSError:
+            if(not os.path.isdir(self.directory)):
+                raise
+        return(os.path.join(self.directory, file_name))
+
+
+
+def _seconds(value):
+    if(value is None):
+        return('-')
+    return('%.3f' % (value))
+
+
+
+def _megabytes(memory):
+    if(memory is None):
+        return(['-'] * 4)
+    return(['%.1f' % (memory['rss'] / 1048576.), 
+            '%+.1f' % (memory['rss_delta'] / 1048576.),
+            '%.1f' % (memory['peak_rss'] / 1048576.),
+            '%.1f' % (sum(memory['outputs'].values()) / 1048576.)])
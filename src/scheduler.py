@@ -0,0 +1,415 @@
+# Copyright (C) 2010 Association of Universities for Research in Astronomy(AURA)
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+# 
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+"""
+Scheduler
+
+Steps declare the clipboard keys they consume and produce (the input and output
+keys of the steps section of the Pipeline configuration file). This is enough 
+to build a dependency graph among Steps and to run Steps which do not depend on
+each other at the same time.
+
+Steps can also have their process() method executed in a pool of worker 
+processes (see ProcessBackend), to get around the GIL for CPU bound code.
+
+Alternatively, Steps can be run as coroutines on an event loop (see 
+AsyncScheduler and eventloop).
+"""
+import atexit
+import Queue
+import threading
+import traceback
+
+import eventloop
+import serialization
+
+
+
+
+def dependency_graph(steps):
+    """
+    Given the list of Step instances `steps`, in order of execution, return a 
+    list of sets. The i-th set holds the indices of the Steps that steps[i] 
+    depends on. steps[j] depends on an earlier Step steps[i] if
+        1. steps[j] consumes a clipboard key produced by steps[i],
+        2. steps[j] produces a clipboard key consumed by steps[i] or
+        3. steps[j] produces a clipboard key also produced by steps[i].
+    This guarantees that a concurrent execution yields the same clipboard as 
+    the serial one, in the order given by `steps`. Steps with no declared input
+    are still ordered by their outputs (rule 3).
+    """
+    # For each clipboard key, keep track of the last Step writing it and of the
+    # Steps reading it since then.
+    last_writer = {}
+    readers = {}
+    
+    graph = []
+    for (i, step) in enumerate(steps):
+        deps = set()
+        input_keys = _keys(step.input_info)
+        output_keys = _keys(step.output_info)
+        
+        for key in input_keys:
+            if(key in last_writer):
+                deps.add(last_writer[key])
+        for key in output_keys:
+            if(key in last_writer):
+                deps.add(last_writer[key])
+            deps.update(readers.get(key, ()))
+        deps.discard(i)
+        graph.append(deps)
+        
+        # Now update the bookkeeping.
+        for key in input_keys:
+            readers.setdefault(key, set()).add(i)
+        for key in output_keys:
+            last_writer[key] = i
+            readers[key] = set()
+    return(graph)
+
+
+
+def key_users(steps):
+    """
+    Given the list of Step instances `steps`, return a dictionary mapping each
+    clipboard key to the number of Steps consuming and/or producing it. Once 
+    that many of them are done, no Step needs the key anymore.
+    """
+    users = {}
+    for step in steps:
+        for key in step_keys(step):
+            users[key] = users.get(key, 0) + 1
+    return(users)
+
+
+
+def step_keys(step):
+    """
+    Return the set of clipboard keys `step` consumes or produces.
+    """
+    return(set(_keys(step.input_info) + _keys(step.output_info)))
+
+
+
+def _keys(clipboard_info):
+    """
+    Return the list of clipboard key names from the input/output information
+    `clipboard_info` of a Step.
+    """
+    return([x[0] for x in clipboard_info if x])
+
+
+
+
+
+class ThreadPoolScheduler(object):
+    """
+    Run a list of Steps on a pool of `max_workers` threads, respecting the data
+    dependencies among them (see dependency_graph()).
+    """
+    def __init__(self, max_workers, log):
+        """
+        Configure the scheduler instance.
+        """
+        self.max_workers = max_workers
+        self.log = log
+        return
+    
+    
+    def run(self, steps, run_step):
+        """
+        Execute `run_step(step)` for each Step in `steps`. `run_step` signals
+        failures by raising an exception. When that happens, no new Step is 
+        started (even those already queued), those already running are 
+        allowed to complete and an exception with the traceback of the 
+        failure is raised.
+        """
+        graph = dependency_graph(steps)
+        dependents = [[] for step in steps]
+        for (j, deps) in enumerate(graph):
+            for i in deps:
+                dependents[i].append(j)
+        waiting = [len(deps) for deps in graph]
+        
+        ready = Queue.Queue()
+        done = Queue.Queue()
+        # Set after the first failure: queued Steps are skipped.
+        cancelled = threading.Event()
+        
+        num_workers = min(self.max_workers, len(steps))
+        workers = [threading.Thread(target=self._worker, 
+                                    args=(steps, run_step, ready, done, 
+                                          cancelled)) \
+                   for i in range(num_workers)]
+        for worker in workers:
+            worker.setDaemon(True)
+            worker.start()
+        
+        # Seed the work queue with the Steps without dependencies and then 
+        # schedule their dependents as they complete.
+        in_flight = 0
+        for (i, num) in enumerate(waiting):
+            if(not num):
+                ready.put(i)
+                in_flight += 1
+        
+        failure = None
+        while(in_flight):
+            (i, exc, tb) = done.get()
+            in_flight -= 1
+            if(exc is not None):
+                self.log.error('Step %s failed: \n%s', steps[i].name, tb)
+                if(failure is None):
+                    failure = (steps[i].name, tb)
+                continue
+            if(failure is not None):
+                continue
+            for j in dependents[i]:
+                waiting[j] -= 1
+                if(not waiting[j]):
+                    ready.put(j)
+                    in_flight += 1
+        
+        # Shut the workers down.
+        for worker in workers:
+            ready.put(None)
+        for worker in workers:
+            worker.join()
+        
+        if(failure is not None):
+            raise(Exception('Step %s failed: \n%s' % failure))
+        return
+    
+    
+    def _worker(self, steps, run_step, ready, done, cancelled):
+        """
+        Pull Step indices from the `ready` queue, run the corresponding Steps 
+        (unless `cancelled` is set) and report back through the `done` queue,
+        until we get None. The first failure sets `cancelled`.
+        """
+        while(True):
+            i = ready.get()
+            if(i is None):
+                break
+            if(cancelled.is_set()):
+                self.log.info('Step %s cancelled.', steps[i].name)
+                done.put((i, None, None))
+                continue
+            try:
+                run_step(steps[i])
+            except Exception as e:
+                # Before picking the next Step up.
+                cancelled.set()
+                done.put((i, e, traceback.format_exc()))
+            else:
+                done.put((i, None, None))
+        return
+
+
+
+
+
+
+
+class AsyncScheduler(object):
+    """
+    Run a list of Steps as coroutines on an event loop (see eventloop), 
+    respecting the data dependencies among them (see dependency_graph()). 
+    All the Steps whose dependencies are satisfied run at the same time.
+    """
+    def __init__(self, log):
+        """
+        Configure the scheduler instance.
+        """
+        self.log = log
+        self._failure = None
+        return
+    
+    
+    def run(self, steps, run_step):
+        """
+        Execute the coroutine `run_step(step)` for each Step in `steps`. 
+        `run_step` signals failures by raising an exception. When that 
+        happens, no new Step is started, those already running are allowed to
+        complete and the exception is raised again.
+        """
+        self._failure = None
+        loop = eventloop.EventLoop()
+        try:
+            loop.run_until_complete(self._run(loop, steps, run_step))
+        finally:
+            loop.close()
+        if(self._failure is not None):
+            raise(self._failure)
+        return
+    
+    
+    def _run(self, loop, steps, run_step):
+        """
+        Coroutine spawning one Task per Step and waiting for all of them.
+        """
+        graph = dependency_graph(steps)
+        tasks = []
+        for (i, step) in enumerate(steps):
+            deps = [tasks[j] for j in sorted(graph[i])]
+            tasks.append(loop.spawn(self._run_step(step, deps, run_step)))
+        for task in tasks:
+            try:
+                yield(task)
+            except Exception:
+                # Already taken care of in self._run_step().
+                pass
+        return
+    
+    
+    def _run_step(self, step, deps, run_step):
+        """
+        Coroutine waiting for the Tasks `deps` and then running `step`. 
+        """
+        # Do not run if any of the Steps we depend on failed.
+        for task in deps:
+            try:
+                yield(task)
+            except Exception:
+                return
+        if(self._failure is not None):
+            return
+        
+        try:
+            yield(run_step(step))
+        except Exception as e:
+            self.log.error('Step %s failed: \n%s', step.name, 
+                           traceback.format_exc())
+            if(self._failure is None):
+                self._failure = e
+            raise
+        return
+
+
+
+
+
+class ProcessBackend(object):
+    """
+    Execute the process() method of Steps in a pool of worker processes.
+    
+    The Step instance, with its inputs already fetched from the clipboard, is 
+    sent to a worker process and its outputs are sent back. NumPy arrays travel
+    through an ArrayStore (shared memory if available, see serialization) and 
+    are memory-mapped on the receiving end rather than pickled.
+    """
+    def __init__(self, max_processes=None, scratch_dir=None):
+        """
+        Configure the backend. The pool of `max_processes` worker processes 
+        (one per CPU if None or 0) is only created when needed.
+        """
+        self.max_processes = max_processes or None
+        self.scratch_dir = scratch_dir
+        self._pool = None
+        self._store = None
+        self._lock = threading.Lock()
+        return
+    
+    
+    def start(self):
+        """
+        Create the pool of worker processes, if it does not exist already. 
+        Worker processes are forked: better do this before starting threads.
+        """
+        import multiprocessing
+        
+        with self._lock:
+            if(self._pool is None):
+                self._store = serialization.ArrayStore(self.scratch_dir)
+                atexit.register(self._store.cleanup)
+                self._pool = multiprocessing.Pool(self.max_processes)
+        return
+    
+    
+    def run(self, step):
+        """
+        Execute `step`.process() in a worker process, update the instance 
+        variables listed in `step`.output_info with the values computed there
+        and return the process() exit code.
+        """
+        self.start()
+        output_keys = [x[0] for x in step.output_info if x]
+        
+        (data, names) = serialization.dumps(step, self._store)
+        try:
+            (ok, result) = self._pool.apply(_process_step, 
+                                            (data, 
+                                             self._store.directory, 
+                                             output_keys))
+        finally:
+            for name in names:
+                self._store.remove(name)
+        if(not ok):
+            raise(Exception('Step %s failed in worker process: \n%s' \
+                            % (step.name, result)))
+        
+        # The output arrays are mapped read/write: they are ours now.
+        (data, names) = result
+        (err, outputs) = serialization.loads(data, self._store, mode='r+')
+        for name in names:
+            self._store.remove(name)
+        for (key, val) in outputs.items():
+            setattr(step, key, val)
+        return(err)
+    
+    
+    def close(self):
+        """
+        Shut the pool of worker processes down and delete the array store.
+        """
+        with self._lock:
+            if(self._pool is not None):
+                self._pool.close()
+                self._pool.join()
+                self._store.cleanup()
+                self._pool = None
+                self._store = None
+        return
+
+
+
+def _process_step(data, store_dir, output_keys):
+    """
+    Worker process side of ProcessBackend.run(): unpickle the Step, execute its
+    process() method and return (True, (pickled output, array names)) or 
+    (False, formatted traceback) in case of exceptions.
+    """
+    store = serialization.ArrayStore(store_dir)
+    try:
+        # Inputs are mapped copy-on-write: changes stay in this process.
+        step = serialization.loads(data, store, mode='c')
+        err = step.process()
+        outputs = dict([(key, getattr(step, key)) for key in output_keys])
+        return((True, serialization.dumps((err, outputs), store)))
+    except Exception:
+        return((False, traceback.format_exc()))
@@ -0,0 +1,207 @@
+# Copyright (C) 2010 Association of Universities for Research in Astronomy(AURA)
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+# 
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+"""
+Serialization
+
+Helpers for moving clipboard values out of the current process (to another 
+process or to disk) without pickling large arrays. NumPy arrays are written as
+raw binary .npy files in an ArrayStore directory and only a reference to them
+is pickled. Arrays are read back memory-mapped, so that they are paged in only
+when (and if) they are accessed.
+
+By default, ArrayStore directories are created in /dev/shm (if available), 
+which means that array data never actually hits the disk.
+"""
+import cPickle
+import cStringIO
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+
+
+
+# Constants/Default Values.
+SHM_DIR = '/dev/shm'
+# Arrays smaller than this (in bytes) are simply pickled.
+DEFAULT_MIN_ARRAY_SIZE = 4096
+
+
+
+def loaded_numpy():
+    """
+    Return the numpy module if it has been imported already (by anybody), None
+    otherwise. NumPy is slow to import and, if it has not been, there cannot be
+    any NumPy array to take care of anyway.
+    """
+    return(sys.modules.get('numpy'))
+
+
+
+def default_scratch_dir():
+    """
+    Return the directory where ArrayStore instances are created by default:
+    SHM_DIR if it exists and is writable, the system temporary directory 
+    otherwise.
+    """
+    if(os.path.isdir(SHM_DIR) and os.access(SHM_DIR, os.W_OK)):
+        return(SHM_DIR)
+    return(tempfile.gettempdir())
+
+
+
+
+
+class ArrayStore(object):
+    """
+    A directory of raw binary NumPy array files.
+    """
+    def __init__(self, directory=None, min_array_size=DEFAULT_MIN_ARRAY_SIZE):
+        """
+        Use `directory` to store arrays or create a new temporary directory in
+        default_scratch_dir() if `directory` is None. Arrays smaller than 
+        `min_array_size` bytes are pickled together with the rest of the data.
+        """
+        if(directory is None):
+            directory = tempfile.mkdtemp(prefix='stpipe-', 
+                                         dir=default_scratch_dir())
+        elif(not os.path.isdir(directory)):
+            os.makedirs(directory)
+        self.directory = directory
+        self.min_array_size = min_array_size
+        
+        self._lock = threading.Lock()
+        self._counter = 0
+        return
+    
+    
+    def put(self, array):
+        """
+        Write `array` to a new file in the store and return its name.
+        """
+        with self._lock:
+            self._counter += 1
+            name = '%d-%d.npy' % (os.getpid(), self._counter)
+        import numpy
+        
+        numpy.save(os.path.join(self.directory, name), array)
+        return(name)
+    
+    
+    def get(self, name, mode='r'):
+        """
+        Return the array stored as `name`, memory-mapped according to `mode` 
+        (see numpy.load). A `mode` of None reads the array in memory.
+        """
+        import numpy
+        
+        return(numpy.load(os.path.join(self.directory, name), mmap_mode=mode))
+    
+    
+    def remove(self, name):
+        """
+        Delete the array stored as `name`. Memory-mapped arrays already 
+        returned by self.get() are still valid afterwards (POSIX semantics).
+        """
+        os.remove(os.path.join(self.directory, name))
+        return
+    
+    
+    def cleanup(self):
+        """
+        Delete the store directory and everything in it.
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
+        return
+
+
+
+
+
+def dumps(obj, store):
+    """
+    Pickle `obj` and return the resulting string together with the list of
+    names of the arrays written to `store` in the process.
+    """
+    names = []
+    numpy = loaded_numpy()
+    
+    def persistent_id(x):
+        if(numpy is not None and isinstance(x, numpy.ndarray) and 
+           x.dtype != object and x.nbytes >= store.min_array_size):
+            name = store.put(x)
+            names.append(name)
+            return(name)
+        return(None)
+    
+    buffer = cStringIO.StringIO()
+    pickler = cPickle.Pickler(buffer, cPickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = persistent_id
+    pickler.dump(obj)
+    return(buffer.getvalue(), names)
+
+
+
+def loads(data, store, mode='r'):
+    """
+    Unpickle `data`, as created by dumps(), fetching arrays from `store` and 
+    memory-mapping them according to `mode` (see ArrayStore.get()).
+    """
+    unpickler = cPickle.Unpickler(cStringIO.StringIO(data))
+    unpickler.persistent_load = lambda name: store.get(name, mode)
+    return(unpickler.load())
+
+
+
+def dump(obj, path, store):
+    """
+    Same as dumps() but write the pickled `obj` to the file `path`.
+    """
+    (data, names) = dumps(obj, store)
+    f = open(path, 'wb')
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    return(names)
+
+
+
+def load(path, store, mode='r'):
+    """
+    Same as loads() but read the pickled data from the file `path`.
+    """
+    f = open(path, 'rb')
+    try:
+        data = f.read()
+    finally:
+        f.close()
+    return(loads(data, store, mode))
@@ -0,0 +1,267 @@
+# Copyright (C) 2010 Association of Universities for Research in Astronomy(AURA)
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+# 
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+"""
+Streaming
+
+Run a configured Pipeline over a (possibly endless) stream of inputs with 
+every Step acting as a stage: each stage takes items from a bounded queue, runs
+its Step on them and hands them to the next stage through another bounded 
+queue. All stages run at the same time, so that e.g. a slow SystemCallStep 
+working on one exposure overlaps with the FITS reader working on the next one.
+Bounded queues provide backpressure: the number of items in flight (and hence
+memory usage) is bounded no matter how long the input stream is.
+"""
+import Queue
+import threading
+import time
+import traceback
+
+
+
+
+# Constants/Default Values.
+DEFAULT_INPUT_PARAMETER = 'file_name'
+DEFAULT_QUEUE_SIZE = 2
+
+# Marks the end of the stream.
+_END = None
+
+
+
+
+
+class StreamItem(object):
+    """
+    A single input of the stream, together with its own `clipboard` (a 
+    dictionary by default) and, if the Pipeline is profiled, its own 
+    `profiler` (see profiling). If processing fails, `error` holds the 
+    formatted traceback and the item is passed through the remaining stages
+    untouched.
+    """
+    def __init__(self, index, item, clipboard=None, profiler=None):
+        if(clipboard is None):
+            clipboard = {}
+        self.index = index
+        self.item = item
+        self.clipboard = clipboard
+        self.profiler = profiler
+        self.error = None
+        self.failed_step = None
+        self.start = time.time()
+        self.elapsed = None
+        return
+    
+    
+    @property
+    def ok(self):
+        return(self.error is None)
+
+
+
+
+
+class StreamingRunner(object):
+    """
+    Run a configured Pipeline instance over an iterable of inputs, one stage 
+    per Step. Each input is assigned to the parameter `input_parameter` of the
+    Step called `input_step` (e.g. the file_name of a FitsImageIOStep) and 
+    gets its own clipboard.
+    
+    Stages are connected by queues holding at most `queue_size` items. Each 
+    stage runs as many worker threads as the `concurrency` attribute of its 
+    Step, each with its own copy of the Step (see Step.clone()). With a 
+    concurrency larger than 1, items may leave a stage in a different order 
+    than they entered it.
+    """
+    def __init__(self, pipeline, input_step, 
+                 input_parameter=DEFAULT_INPUT_PARAMETER, 
+                 queue_size=DEFAULT_QUEUE_SIZE):
+        """
+        Configure the StreamingRunner instance.
+        """
+        if(not [s for s in pipeline.steps if s.name == input_step]):
+            raise(Exception('Pipeline %s has no Step called %s.' \
+                            % (pipeline.qualified_name, input_step)))
+        self.pipeline = pipeline
+        self.input_step = input_step
+        self.input_parameter = input_parameter
+        self.queue_size = queue_size
+        self.log = pipeline.log
+        return
+    
+    
+    def run(self, inputs):
+        """
+        Generator: feed the elements of the iterable `inputs` to the stages and
+        yield StreamItem instances as they come out of the last stage. 
+        Spilling clipboards (see Pipeline.clipboard_budget) are emptied and 
+        their spill directory deleted when the next item is requested.
+        """
+        steps = self.pipeline.steps
+        concurrency = [max(1, s.concurrency) for s in steps]
+        
+        # queues[i] feeds stage i; the last one feeds us.
+        queues = [Queue.Queue(maxsize=self.queue_size) \
+                  for i in range(len(steps) + 1)]
+        # Traceback of the exception raised by `inputs`, if any.
+        feed_errors = []
+        threads = [threading.Thread(target=self._feed, 
+                                    args=(inputs, queues[0], concurrency[0], 
+                                          feed_errors))]
+        for (i, step) in enumerate(steps):
+            # The number of stage i workers still running: the last one to 
+            # exit tells the next stage that the stream is over.
+            running = [concurrency[i], threading.Lock()]
+            if(i + 1 < len(steps)):
+                num_next = concurrency[i + 1]
+            else:
+                num_next = 1
+            for j in range(concurrency[i]):
+                threads.append(threading.Thread(target=self._stage,
+                               args=(step.clone(self.pipeline), 
+                                     queues[i], 
+                                     queues[i + 1], 
+                                     running, 
+                                     num_next)))
+        for thread in threads:
+            thread.setDaemon(True)
+            thread.start()
+        self.log.info('Streaming with %d stage(s) (concurrency: %s).', 
+                      len(steps), ', '.join([str(c) for c in concurrency]))
+        
+        while(True):
+            stream_item = queues[-1].get()
+            if(stream_item is _END):
+                break
+            stream_item.elapsed = time.time() - stream_item.start
+            if(stream_item.ok):
+                self.log.info('Input %d (%s) done in %.3f s.', 
+                              stream_item.index, stream_item.item, 
+                              stream_item.elapsed)
+            if(stream_item.profiler is not None):
+                self.pipeline.log_profile(stream_item.profiler)
+            try:
+                yield(stream_item)
+            finally:
+                # Do not let spilling clipboards pile up spilled values and 
+                # spill directories over an endless stream.
+                if(hasattr(stream_item.clipboard, 'cleanup')):
+                    stream_item.clipboard.cleanup()
+        
+        for thread in threads:
+            thread.join()
+        if(feed_errors):
+            raise(Exception('Iterating over the inputs failed: \n%s' \
+                            % (feed_errors[0])))
+        return
+    
+    
+    def _feed(self, inputs, queue, num_workers, errors):
+        """
+        Put each element of `inputs` in `queue`, blocking when it is full. 
+        Signal the end of the stream to the `num_workers` workers of the first
+        stage, even if iterating over `inputs` fails, in which case the 
+        traceback is appended to `errors`.
+        """
+        try:
+            for (index, item) in enumerate(inputs):
+                # Profile each input as a run of its own.
+                profiler = self.pipeline.new_profiler()
+                if(profiler is not None):
+                    profiler.start_run('input%d' % (index))
+                queue.put(StreamItem(index, item, 
+                                     self.pipeline.new_clipboard(), 
+                                     profiler))
+        except Exception:
+            errors.append(traceback.format_exc())
+            self.log.error('Iterating over the inputs failed: \n%s', 
+                           errors[-1])
+        finally:
+            for i in range(num_workers):
+                queue.put(_END)
+        return
+    
+    
+    def _stage(self, step, inbox, outbox, running, num_next):
+        """
+        Worker thread of a stage: run `step` on each item from `inbox` and put
+        it in `outbox`, until the end of the stream.
+        """
+        while(True):
+            stream_item = inbox.get()
+            if(stream_item is _END):
+                break
+            if(stream_item.ok):
+                self._run_step(step, stream_item)
+            outbox.put(stream_item)
+        try:
+            step.flush()
+        except Exception:
+            self.log.error('Flushing Step %s failed: \n%s', step.name, 
+                           traceback.format_exc())
+        finally:
+            step.close()
+        
+        # The last worker of this stage to exit signals the next stage.
+        lock = running[1]
+        lock.acquire()
+        try:
+            running[0] -= 1
+            last = not running[0]
+        finally:
+            lock.release()
+        if(last):
+            for i in range(num_next):
+                outbox.put(_END)
+        return
+    
+    
+    def _run_step(self, step, stream_item):
+        """
+        Run `step` on the clipboard of `stream_item`, recording failures.
+        """
+        step._clipboard = stream_item.clipboard
+        step._profiler = stream_item.profiler
+        step.input_index = stream_item.index
+        step.input_item = stream_item.item
+        if(step.name == self.input_step):
+            setattr(step, self.input_parameter, stream_item.item)
+        try:
+            error = step.run()
+            self.pipeline.release_values(step)
+            if(error):
+                raise(Exception('Step %s exited with error code %d' \
+                                % (step.name, error)))
+        except Exception:
+            stream_item.error = traceback.format_exc()
+            stream_item.failed_step = step.name
+            self.log.error('Input %d (%s) failed in Step %s: \n%s', 
+                           stream_item.index, stream_item.item, step.name, 
+                           stream_item.error)
+        return
@@ -0,0 +1,230 @@
+# Copyright (C) 2010 Association of Universities for Research in Astronomy(AURA)
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+# 
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+"""
+Tiling
+
+Split the pixel data of an image into independent pieces (tiles, planes of a
+data cube or extensions of a multi-extension FITS file) and process them in 
+parallel with a pool of worker processes.
+
+Worker processes are forked once the input data is in place, so that they 
+share it with the parent process (copy-on-write) instead of receiving a copy.
+Results go to an output array memory-mapped from a file in the scratch 
+directory (see serialization.default_scratch_dir(), i.e. shared memory when 
+available), which the workers inherit as well: nothing but slice objects is
+ever pickled.
+
+Functions applied to tiles or planes must return an array with the same shape
+as their input (the output array is created after processing the first 
+piece, with the data type of its result).
+"""
+import multiprocessing
+import os
+import tempfile
+import threading
+
+import numpy
+
+import serialization
+from models import tile_slices
+
+
+
+
+# Constants/Default Values.
+# Number of worker processes: 0 means one per CPU.
+DEFAULT_PROCESSES = 0
+
+# What worker processes work on (see _run_pool()): function, input, output.
+_FUNC = None
+_DATA = None
+_OUT = None
+# Serialise the setting of the globals above and the forking of the workers.
+_FORK_LOCK = threading.Lock()
+
+
+
+
+
+def tiles(shape, tile_shape, halo=0):
+    """
+    Return the list of (read, region, core) tuples of slices describing the
+    tiles of (at most) `tile_shape` = (rows, columns) pixels an array of the 
+    given `shape` is made of (see models.tile_slices(), also used by 
+    models.Image.iter_tiles()): data[read] is the tile extended by `halo` 
+    pixels on every side (where available), out[region] the corresponding 
+    region of the output and result[core] the tile within the extended one.
+    """
+    return(tile_slices(shape, tile_shape, halo))
+
+
+
+def planes(shape):
+    """
+    Same as tiles() but for the planes of a data cube of the given `shape` 
+    (i.e. along its first axis).
+    """
+    return([((i, ), (i, ), ()) for i in range(shape[0])])
+
+
+
+def map_tiles(func, data, tile_shape, halo=0, processes=DEFAULT_PROCESSES):
+    """
+    Apply `func` to the tiles of `data` (see tiles()) using `processes` worker
+    processes and return the stitched result.
+    """
+    return(map_pieces(func, data, tiles(data.shape, tile_shape, halo), 
+                      processes))
+
+
+
+def map_planes(func, data, processes=DEFAULT_PROCESSES):
+    """
+    Apply `func` to each plane of the data cube `data` using `processes` 
+    worker processes and return the resulting cube.
+    """
+    return(map_pieces(func, data, planes(data.shape), processes))
+
+
+
+def map_pieces(func, data, pieces, processes=DEFAULT_PROCESSES):
+    """
+    Apply `func` to each data[read] for (read, region, core) in `pieces` using
+    `processes` worker processes and return the output array made of each 
+    func(data[read])[core] stored at out[region].
+    """
+    processes = _num_processes(processes, len(pieces))
+    
+    (read, region, core) = pieces[0]
+    first = numpy.asarray(func(data[read]))
+    if(processes > 1):
+        (fd, path) = tempfile.mkstemp(suffix='.npy', 
+                                      dir=serialization.default_scratch_dir())
+        os.close(fd)
+        try:
+            out = numpy.lib.format.open_memmap(path, mode='w+', 
+                                               dtype=first.dtype, 
+                                               shape=data.shape)
+        finally:
+            # The mapping survives the file.
+            os.remove(path)
+    else:
+        out = numpy.empty(data.shape, dtype=first.dtype)
+    out[region] = first[core]
+    
+    if(processes > 1):
+        _run_pool(processes, _process_piece, pieces[1:], func, data, out)
+    else:
+        for piece in pieces[1:]:
+            _apply(func, data, out, piece)
+    return(numpy.asarray(out))
+
+
+
+def map_arrays(func, arrays, processes=DEFAULT_PROCESSES):
+    """
+    Apply `func` to each array in the list `arrays` (e.g. the extensions of a
+    MEF) using `processes` worker processes and return the list of results. 
+    Results are passed back through an ArrayStore (see serialization) and are
+    memory-mapped.
+    """
+    processes = _num_processes(processes, len(arrays))
+    if(processes <= 1):
+        return([numpy.asarray(func(array)) for array in arrays])
+    
+    store = serialization.ArrayStore()
+    try:
+        names = _run_pool(processes, _process_array, range(len(arrays)), 
+                          func, arrays, store)
+        return([numpy.asarray(store.get(name, 'r+')) for name in names])
+    finally:
+        store.cleanup()
+
+
+
+def _num_processes(processes, num_pieces):
+    """
+    Return the number of worker processes to actually use for `num_pieces`
+    pieces of work when asked for `processes` of them.
+    """
+    # Daemonic processes (e.g. those of a process backend) cannot fork.
+    if(multiprocessing.current_process().daemon):
+        return(1)
+    if(processes <= 0):
+        processes = multiprocessing.cpu_count()
+    return(max(1, min(processes, num_pieces)))
+
+
+
+def _run_pool(processes, worker, jobs, func, data, out):
+    """
+    Fork `processes` worker processes sharing `func`, `data` and `out` and 
+    return the list of worker(job) for each job in `jobs`.
+    """
+    global _FUNC, _DATA, _OUT
+    
+    with _FORK_LOCK:
+        (_FUNC, _DATA, _OUT) = (func, data, out)
+        try:
+            pool = multiprocessing.Pool(processes)
+        finally:
+            (_FUNC, _DATA, _OUT) = (None, None, None)
+    try:
+        results = pool.map(worker, jobs, chunksize=1)
+    except:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+    return(results)
+
+
+
+def _apply(func, data, out, piece):
+    (read, region, core) = piece
+    out[region] = numpy.asarray(func(data[read]))[core]
+    return
+
+
+
+def _process_piece(piece):
+    """
+    Worker process side of map_pieces().
+    """
+    return(_apply(_FUNC, _DATA, _OUT, piece))
+
+
+
+def _process_array(index):
+    """
+    Worker process side of map_arrays().
+    """
+    return(_OUT.put(numpy.asarray(_FUNC(_DATA[index]))))
@@ -29,13 +29,14 @@
 """
 Utilities
 """
-import inspect
 import os
 import sys
 
 
 
 
+# Classes already imported by import_class(), by full name.
+_CLASSES = {}
 
 
 
@@ -48,6 +49,27 @@ def import_class(full_name, subclassof=None):
     Return the imported class. Optionally, if `subclassof` is not None and is 
     a Python class, make sure that the imported class is a subclass of 
     `subclassof`.
+    
+    Classes are only imported the first time they are asked for.
+    """
+    full_name = full_name.strip()
+    step_class = _CLASSES.get(full_name)
+    if(step_class is None):
+        step_class = _import_class(full_name)
+        _CLASSES[full_name] = step_class
+    
+    if(subclassof and not issubclass(step_class, subclassof)):
+        (package_name, class_name) = str(full_name).rsplit('.', 1)
+        msg = 'Class %s from package %s is not a subclass of %s' \
+              % (class_name, package_name, subclassof.__name__)
+        raise(NotImplementedError(msg))
+    return(step_class)
+
+
+
+def _import_class(full_name):
+    """
+    Uncached version of import_class(), with no subclass check.
     """
     # Understand which class we need to instantiate. The class name is given in
     # full Python package notation, e.g.
@@ -56,9 +78,8 @@ def import_class(full_name, subclassof=None):
     #   1. We HAVE to be able to say 
     #       from package.subPackage.subsubpackage import className
     #   2. If `subclassof` is defined, the newly imported Python class MUST be a
-    #      subclass of `subclassof`, which HAS to be a Python class.
+    #      subclass of `subclassof` (checked by import_class()).
     
-    full_name = full_name.strip()
     package_name, class_name = str(full_name).rsplit('.', 1)
     imported = __import__(package_name, globals(), locals(), [class_name, ])
     
@@ -72,11 +93,6 @@ def import_class(full_name, subclassof=None):
         step_class = getattr(imported, class_name)
     else:
         step_class = imported
-    
-    if(subclassof and not issubclass(step_class, subclassof)):
-        msg = 'Class %s from package %s is not a subclass of %s' \
-              % (class_name, package_name, subclassof.__name__)
-        raise(NotImplementedError(msg))
     return(step_class)
 
 
@@ -88,7 +104,9 @@ def get_spec_file_path(step_class):
     in the same directory as the `step_class` source file. It has the name of 
     the Step (sub)class and extension .spec.
     """
-    step_source_file = os.path.abspath(inspect.getfile(step_class))
+    # Same as inspect.getfile(step_class), without importing inspect (slow).
+    module = sys.modules[step_class.__module__]
+    step_source_file = os.path.abspath(module.__file__)
     
     # Since `step_class` could be defined in a file called whatever, we need 
     # the source file basedir and the class name.
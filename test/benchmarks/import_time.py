@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# Copyright (C) 2010 Association of Universities for Research in Astronomy(AURA)
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+# 
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+import subprocess
+import sys
+
+
+
+# Time how long importing stpipe takes in a fresh Python interpreter (median of
+# REPEAT runs, in ms) and check that a bare `import stpipe` does not pull in
+# heavy modules. Usage: python import_time.py [max_ms]
+REPEAT = 7
+HEAVY = ('numpy', 'pyfits', 'configobj', 'stpipe.Pipeline')
+PROBE = '''
+import sys, time
+t = time.time()
+import %s
+sys.stdout.write('%%f %%s' %% ((time.time() - t) * 1000., 
+                               ','.join(m for m in %r if m in sys.modules)))
+'''
+
+
+def import_time(module):
+    times = []
+    for i in range(REPEAT):
+        out = subprocess.check_output([sys.executable, '-c', 
+                                       PROBE % (module, HEAVY)])
+        fields = out.decode().split(' ')
+        times.append(float(fields[0]))
+    times.sort()
+    return(times[len(times) // 2], fields[1].split(',') if fields[1] else [])
+
+
+max_ms = float(sys.argv[1]) if len(sys.argv) > 1 else None
+for module in ('stpipe', 'stpipe.convenience'):
+    (ms, heavy) = import_time(module)
+    loaded = ', '.join(heavy) or 'nothing heavy'
+    print('import %s: %.1f ms (loads %s)' % (module, ms, loaded))
+    if(module == 'stpipe'):
+        assert(not heavy)
+    if(max_ms is not None):
+        assert(ms <= max_ms)
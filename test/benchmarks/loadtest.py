@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# Copyright (C) 2010 Association of Universities for Research in Astronomy(AURA)
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+# 
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy
+
+from stpipe.batch import BatchRunner
+from stpipe.convenience import pipeline_from_config_file
+from stpipe.streaming import StreamingRunner
+
+
+
+# End-to-end load test: generate synthetic FITS files (see data/mkdata.py), 
+# feed them to a Pipeline (by default loadtest.cfg: FITS read, NumPy 
+# background subtraction, external command) at a target arrival rate (--rate,
+# inputs per second) or all at once (saturation, the default), with a batch of
+# threads or processes or as a stream, and report the throughput and the 
+# percentiles of the per input latency (from arrival to result) and service 
+# time (processing only). E.g.
+#   python loadtest.py --inputs 200 --workers 4 --shape 2048 2048
+#   python loadtest.py --rate 20 --stream --extensions 4
+HERE = os.path.dirname(os.path.abspath(__file__))
+TEST_DIR = os.path.dirname(HERE)
+sys.path.insert(0, os.path.join(TEST_DIR, 'data'))
+import mkdata
+
+PERCENTILES = (50, 95, 99)
+
+
+def arrivals(items, rate, times):
+    """
+    Yield the elements of `items`, one every 1 / `rate` seconds (all at once 
+    if `rate` is 0), appending to `times` when each one was due.
+    """
+    start = time.time()
+    for (i, item) in enumerate(items):
+        due = start
+        if(rate):
+            due += i / float(rate)
+            delay = due - time.time()
+            if(delay > 0):
+                time.sleep(delay)
+        times.append(due)
+        yield(item)
+    return
+
+
+def run(pipeline, inputs, args):
+    """
+    Process `inputs` with `pipeline` as specified by the command line `args`
+    and return the list of (ok, arrival, end, service time) of each input and
+    the total elapsed time.
+    """
+    due = []
+    start = time.time()
+    if(args.stream):
+        runner = StreamingRunner(pipeline, args.input_step)
+        results = [(r.index, r.ok, r.start + r.elapsed, r.elapsed) for r in \
+                   runner.run(arrivals(inputs, args.rate, due))]
+    else:
+        runner = BatchRunner(pipeline, args.input_step, 
+                             workers=args.workers, 
+                             processes=args.processes)
+        report = runner.run(arrivals(inputs, args.rate, due))
+        results = [(r.index, r.ok, r.finished, r.elapsed) \
+                   for r in report.results]
+    elapsed = time.time() - start
+    return([(ok, due[i], end, service) for (i, ok, end, service) in results],
+           elapsed)
+
+
+def percentiles(values):
+    if(not values):
+        return(dict([(p, None) for p in PERCENTILES + (100, )]))
+    return(dict([(p, float(numpy.percentile(values, p))) \
+                 for p in PERCENTILES + (100, )]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='stpipe load test')
+    parser.add_argument('--config', default=os.path.join(HERE, 'loadtest.cfg'),
+                        help='Pipeline configuration file')
+    parser.add_argument('--input-step', default='ReadFitsImageStep')
+    parser.add_argument('--inputs', type=int, default=50, 
+                        help='number of inputs to process')
+    parser.add_argument('--files', type=int, default=8, 
+                        help='number of distinct files (reused in turn)')
+    parser.add_argument('--shape', type=int, nargs=2, default=[1024, 1024])
+    parser.add_argument('--extensions', type=int, default=0)
+    parser.add_argument('--depth', type=int, default=0)
+    parser.add_argument('--dtype', default='float32')
+    parser.add_argument('--rate', type=float, default=0., 
+                        help='inputs per second (0: all at once)')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--processes', action='store_true', 
+                        help='batch with worker processes')
+    parser.add_argument('--stream', action='store_true', 
+                        help='stream the inputs instead of batching them')
+    parser.add_argument('--json', default=None, 
+                        help='also write the results to this file')
+    args = parser.parse_args()
+    
+    # Step configuration files are relative to the test directory.
+    config = os.path.abspath(args.config)
+    os.chdir(TEST_DIR)
+    directory = tempfile.mkdtemp(prefix='stpipe-loadtest-')
+    try:
+        files = mkdata.make_files(args.files, 
+                                  os.path.join(directory, 'input'), 
+                                  shape=args.shape, 
+                                  extensions=args.extensions, 
+                                  depth=args.depth, 
+                                  dtype=args.dtype)
+        inputs = [files[i % len(files)] for i in range(args.inputs)]
+        pipeline = pipeline_from_config_file(config)
+        try:
+            (results, elapsed) = run(pipeline, inputs, args)
+        finally:
+            pipeline.close()
+    finally:
+        shutil.rmtree(directory, True)
+    
+    succeeded = [r for r in results if r[0]]
+    latency = percentiles([end - due for (ok, due, end, s) in succeeded])
+    service = percentiles([s for (ok, due, end, s) in succeeded])
+    summary = {'inputs': len(results), 
+               'failed': len(results) - len(succeeded), 
+               'elapsed': elapsed, 
+               'throughput': len(results) / elapsed, 
+               'rate': args.rate, 
+               'mode': args.stream and 'stream' or \
+                       (args.processes and 'processes' or 'threads'),
+               'workers': args.workers,
+               'file': {'shape': args.shape, 'extensions': args.extensions, 
+                        'depth': args.depth, 'dtype': args.dtype},
+               'latency': latency, 
+               'service': service}
+    
+    print('%d input(s) (%d failed) in %.2f s: %.2f/s (offered: %s).' \
+          % (summary['inputs'], summary['failed'], elapsed, 
+             summary['throughput'], args.rate and '%.2f/s' % (args.rate) \
+             or 'all at once'))
+    for (name, values) in (('latency', latency), ('service', service)):
+        print('%-8s' % (name) + '  '.join(['p%d %s' % (p, _ms(values[p])) \
+                                           for p in PERCENTILES]) + \
+              '  max %s' % (_ms(values[100])))
+    if(args.json):
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+    return
+
+
+def _ms(seconds):
+    if(seconds is None):
+        return('-')
+    return('%.1f ms' % (seconds * 1000.))
+
+
+if(__name__ == '__main__'):
+    main()
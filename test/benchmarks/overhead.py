@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# Copyright (C) 2010 Association of Universities for Research in Astronomy(AURA)
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+# 
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+from stpipe import config_parser, utilities
+from stpipe.Pipeline import Pipeline
+from stpipe.Step import Step
+from stpipe.TestSteps import DummyStep
+from stpipe.models import Image
+
+
+
+# Microbenchmarks of the framework's own overheads: configuration parsing, 
+# class import, Step creation, clipboard transfers and Pipeline runs of no-op
+# Steps. Each benchmark reports the best time per call over REPEAT rounds. 
+# Results can be saved as a baseline (JSON) and later runs compared to it:
+#   python overhead.py --save         # write baseline.json
+#   python overhead.py --check 1.5    # fail if anything is 50% slower
+HERE = os.path.dirname(os.path.abspath(__file__))
+TEST_DIR = os.path.dirname(HERE)
+BASELINE = os.path.join(HERE, 'baseline.json')
+REPEAT = 5
+MIN_TIME = 0.2
+
+STEP_CONFIG = os.path.join(TEST_DIR, 'steps', 'some_step.cfg')
+STEP_SPEC = utilities.find_spec_file(DummyStep)
+PIPELINE_CONFIG = os.path.join(TEST_DIR, 'pipeline.cfg')
+PIPELINE_SPEC = utilities.find_spec_file(Pipeline)
+IO_INFO = [['image', 'stpipe.models.Image'], 
+           ['bpm', 'stpipe.models.Image'], 
+           ['variance', 'stpipe.models.Image']]
+
+
+def timeit(func):
+    """
+    Return the best time per call of func() in seconds: func is called in 
+    loops of `number` calls taking at least MIN_TIME seconds, REPEAT times.
+    """
+    number = 1
+    while(True):
+        start = time.time()
+        for i in range(number):
+            func()
+        elapsed = time.time() - start
+        if(elapsed >= MIN_TIME):
+            break
+        number *= 10
+    best = elapsed
+    for i in range(REPEAT - 1):
+        start = time.time()
+        for i in range(number):
+            func()
+        best = min(best, time.time() - start)
+    return(best / number)
+
+
+def new_pipeline(n_steps=0):
+    pipe = Pipeline(name='Benchmark', system='Benchmarks', log_level='WARNING')
+    steps = [DummyStep('Step%d' % (i), pipe, [], []) for i in range(n_steps)]
+    pipe.configure(steps)
+    return(pipe)
+
+
+def benchmarks():
+    """
+    Return the list of (name, function) to time.
+    """
+    config_parser.loads(STEP_CONFIG, STEP_SPEC)
+    config_parser.loads(PIPELINE_CONFIG, PIPELINE_SPEC)
+    pipe = new_pipeline()
+    step_config = {'name': 'SomeStep', 
+                   'python_class': 'stpipe.TestSteps.DummyStep',
+                   'config_file': STEP_CONFIG}
+    
+    # A Step moving three Images in and out of the clipboard.
+    io_step = DummyStep('IOStep', pipe, IO_INFO, IO_INFO)
+    for (key, cls) in IO_INFO:
+        pipe.clipboard[key] = Image()
+    
+    tests = [
+        ('config_parser.loads step (no spec, uncached)', 
+         lambda: config_parser._loads(STEP_CONFIG)),
+        ('config_parser.loads step (spec, uncached)', 
+         lambda: config_parser._loads(STEP_CONFIG, STEP_SPEC)),
+        ('config_parser.loads step (spec, cached)', 
+         lambda: config_parser.loads(STEP_CONFIG, STEP_SPEC)),
+        ('config_parser.loads pipeline (spec, uncached)', 
+         lambda: config_parser._loads(PIPELINE_CONFIG, PIPELINE_SPEC)),
+        ('config_parser.loads pipeline (spec, cached)', 
+         lambda: config_parser.loads(PIPELINE_CONFIG, PIPELINE_SPEC)),
+        ('utilities.import_class (uncached)', 
+         lambda: utilities._import_class('stpipe.TestSteps.DummyStep')),
+        ('utilities.import_class (cached)', 
+         lambda: utilities.import_class('stpipe.TestSteps.DummyStep', Step)),
+        ('Step.from_parsed_config', 
+         lambda: Step.from_parsed_config(step_config, pipe)),
+        ('clipboard get, 3 keys (checked)', 
+         lambda: io_step._get_data_from_clipbaord(True)),
+        ('clipboard get, 3 keys (unchecked)', 
+         lambda: io_step._get_data_from_clipbaord(False)),
+        ('clipboard put, 3 keys (checked)', 
+         lambda: io_step._put_data_to_clipboard(True)),
+        ('clipboard put, 3 keys (unchecked)', 
+         lambda: io_step._put_data_to_clipboard(False)),
+    ]
+    for n_steps in (10, 100, 1000):
+        tests.append(('Pipeline.run, %d no-op Steps' % (n_steps), 
+                      new_pipeline(n_steps).run))
+    return(tests)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='stpipe overhead benchmarks')
+    parser.add_argument('--baseline', default=BASELINE, 
+                        help='baseline file (default: %(default)s)')
+    parser.add_argument('--save', action='store_true', 
+                        help='save the results as the new baseline')
+    parser.add_argument('--check', type=float, default=None, metavar='RATIO',
+                        help='exit with an error if any benchmark is more '
+                             'than RATIO times slower than the baseline')
+    args = parser.parse_args()
+    
+    baseline = {}
+    if(os.path.exists(args.baseline)):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    
+    results = {}
+    slower = []
+    print('%-48s %12s %12s %7s' % ('Benchmark', 'us/call', 'baseline', 'ratio'))
+    for (name, func) in benchmarks():
+        results[name] = timeit(func)
+        row = ['%.2f' % (results[name] * 1e6), '-', '-']
+        if(baseline.get(name)):
+            ratio = results[name] / baseline[name]
+            row[1:] = ['%.2f' % (baseline[name] * 1e6), '%.2f' % (ratio)]
+            if(args.check is not None and ratio > args.check):
+                slower.append(name)
+        print('%-48s %12s %12s %7s' % tuple([name] + row))
+    
+    if(args.save):
+        with open(args.baseline, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 
+                       'platform': platform.platform(),
+                       'date': time.strftime('%Y-%m-%d'),
+                       'results': results}, f, indent=2, sort_keys=True)
+        print('Baseline saved to %s.' % (args.baseline))
+    if(slower):
+        print('Slower than %.2fx the baseline: %s.' \
+              % (args.check, ', '.join(slower)))
+        sys.exit(1)
+    return
+
+
+if(__name__ == '__main__'):
+    main()
@@ -1,11 +1,57 @@
 #!/usr/bin/env python
+import argparse
 import numpy
 import pyfits
 
 
 
+# Create FITS files of random pixels: by default test.fits, a single 512x512 
+# image. See make_fits() and --help for cubes, extensions and multiple files.
 
-name = 'test.fits'
-data = numpy.random.random((512, 512))
-hdu = pyfits.PrimaryHDU(data)
-hdu.writeto(name)
+
+def make_fits(name, shape=(512, 512), extensions=0, depth=0, 
+              dtype='float64'):
+    """
+    Write to `name` a FITS file holding an image of the given `shape` or, if 
+    `depth` is larger than 0, a cube of `depth` such images. If `extensions` 
+    is larger than 0, the primary HDU is empty and followed by that many image
+    extensions.
+    """
+    if(depth):
+        shape = (depth, ) + tuple(shape)
+    pixels = lambda: numpy.random.random(shape).astype(dtype)
+    if(extensions):
+        hdus = [pyfits.PrimaryHDU()] + \
+               [pyfits.ImageHDU(pixels()) for i in range(extensions)]
+    else:
+        hdus = [pyfits.PrimaryHDU(pixels())]
+    pyfits.HDUList(hdus).writeto(name, clobber=True)
+    return(name)
+
+
+def make_files(count, prefix, **kws):
+    """
+    Write `count` files called <prefix>_<number>.fits (see make_fits() for 
+    `kws`) and return their names.
+    """
+    return([make_fits('%s_%03d.fits' % (prefix, i), **kws) \
+            for i in range(count)])
+
+
+if(__name__ == '__main__'):
+    parser = argparse.ArgumentParser(description='Write random FITS files.')
+    parser.add_argument('name', nargs='?', default='test.fits', 
+                        help='file name, or prefix with --count')
+    parser.add_argument('--shape', type=int, nargs=2, default=[512, 512])
+    parser.add_argument('--extensions', type=int, default=0)
+    parser.add_argument('--depth', type=int, default=0)
+    parser.add_argument('--dtype', default='float64')
+    parser.add_argument('--count', type=int, default=0, 
+                        help='number of files to write')
+    args = parser.parse_args()
+    kws = dict(shape=args.shape, extensions=args.extensions, 
+               depth=args.depth, dtype=args.dtype)
+    if(args.count):
+        make_files(args.count, args.name.replace('.fits', ''), **kws)
+    else:
+        make_fits(args.name, **kws)
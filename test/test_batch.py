@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# Copyright (C) 2010 Association of Universities for Research in Astronomy(AURA)
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+# 
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+from stpipe.convenience import run_batch
+
+
+
+# Run the test pipeline on several copies of the same input file, with a pool
+# of worker threads first and then of worker processes.
+inputs = ['data/test.fits', ] * 8
+for processes in (False, True):
+    report = run_batch('pipeline.cfg', inputs, 
+                       input_step='ReadFitsImageStep', 
+                       workers=4, 
+                       processes=processes)
+    assert(len(report.succeeded) == len(inputs))
+    print(report.summary())
+
+
+
+# Prefetched inputs are dropped when the run fails before reading them.
+from stpipe import FitsIOSteps
+from stpipe.batch import BatchRunner
+from stpipe.Pipeline import Pipeline
+from stpipe.Step import Step
+
+class FailOddStep(Step):
+    def process(self):
+        return(self.input_index % 2)
+
+pipe = Pipeline(name='PrefetchBatch', log_level='CRITICAL')
+pipe.configure([FailOddStep('FailOdd', pipe, [], []), 
+                FitsIOSteps.FitsImageIOStep('Read', pipe, [], [['image']], 
+                                            file_name=['data/test.fits'], 
+                                            class_name='stpipe.models.Image')])
+inputs = [['data/test.fits', ] * (i + 1) for i in range(6)]
+report = BatchRunner(pipe, 'Read', workers=2, prefetch=True).run(inputs)
+assert(len(report.failed) == len(inputs) // 2)
+assert(not FitsIOSteps._PREFETCHED)
+print(report.summary())
+
+
+# Worker processes work on copies of the Pipeline, which do not share its 
+# checkpoint.
+import shutil
+import tempfile
+
+class NoCheckpointStep(Step):
+    def process(self):
+        return(int(self.pipeline.checkpoint is not None))
+
+checkpoint_dir = tempfile.mkdtemp()
+try:
+    pipe = Pipeline(name='CheckpointBatch', log_level='CRITICAL', 
+                    checkpoint_dir=checkpoint_dir)
+    pipe.configure([NoCheckpointStep('NoCheckpoint', pipe, [], [], 
+                                     file_name=None)])
+    report = BatchRunner(pipe, 'NoCheckpoint', workers=2, 
+                         processes=True).run(range(4))
+    assert(not report.failed)
+finally:
+    shutil.rmtree(checkpoint_dir, True)
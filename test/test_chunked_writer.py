@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# Copyright (C) 2010 Association of Universities for Research in Astronomy(AURA)
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+# 
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+import os
+import shutil
+import tempfile
+
+import numpy
+import pyfits
+
+from stpipe.models import ChunkedImageWriter, Image
+
+
+
+# Process a scaled (uint16 with BZERO = 32768) image tile by tile and write 
+# the float results: the source scaling keywords must not be copied over, 
+# while the other header cards are.
+directory = tempfile.mkdtemp()
+try:
+    source = os.path.join(directory, 'in.fits')
+    hdu = pyfits.PrimaryHDU(numpy.arange(40000, 40000 + 64 * 48, 
+                                         dtype='uint16').reshape((64, 48)))
+    hdu.header['OBSERVER'] = 'stpipe'
+    hdu.writeto(source)
+    fits_file = pyfits.open(source)
+    assert(fits_file[0].header['BZERO'] == 32768)
+    image = Image(hdu_list=fits_file, fits_file=fits_file)
+    
+    writer = ChunkedImageWriter(os.path.join(directory, 'out.fits'), 
+                                (64, 48), 'float32', fits_file[0].header)
+    for chunk in image.iter_tiles((16, 16)):
+        writer.write_chunk(chunk, chunk.data.astype('float32') + 0.5)
+    writer.close()
+    fits_file.close()
+    
+    out = pyfits.open(os.path.join(directory, 'out.fits'))
+    assert('BZERO' not in out[0].header and 'BSCALE' not in out[0].header)
+    assert(out[0].header['OBSERVER'] == 'stpipe')
+    assert(len(out[0].header.cards) == len(set(out[0].header.keys())))
+    expected = numpy.arange(40000, 40000 + 64 * 48).reshape((64, 48)) + 0.5
+    assert((out[0].data == expected).all())
+    out.close()
+finally:
+    shutil.rmtree(directory, True)
+print('Chunked writer: scaled header handled.')
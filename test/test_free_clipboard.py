@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# Copyright (C) 2010 Association of Universities for Research in Astronomy(AURA)
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+# 
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+import shutil
+import tempfile
+import weakref
+
+import numpy
+
+from stpipe.Pipeline import Pipeline
+from stpipe.Step import Step
+
+
+
+class MakeArrayStep(Step):
+    def process(self):
+        self.a = numpy.ones((1024, 1024))
+        self.unused = 'nobody needs me'
+        return(0)
+
+
+class DoubleStep(Step):
+    def process(self):
+        self.b = self.a * 2
+        return(0)
+
+
+class SumStep(Step):
+    def process(self):
+        self.total = float(self.b.sum())
+        return(0)
+
+
+
+# Free clipboard keys as soon as no Step needs them, while checkpointing after
+# each Step (including outputs nobody needs, freed right away): only the final
+# product is left and freed arrays are really gone.
+checkpoint_dir = tempfile.mkdtemp()
+try:
+    pipe = Pipeline(name='FreeClipboard', log_level='WARNING', 
+                    free_clipboard=True, final_products=['total'], 
+                    checkpoint_dir=checkpoint_dir)
+    steps = [MakeArrayStep('MakeArray', pipe, [], [['a'], ['unused']]), 
+             DoubleStep('Double', pipe, [['a']], [['b']]), 
+             SumStep('Sum', pipe, [['b']], [['total']])]
+    pipe.configure(steps)
+    
+    refs = []
+    original_run = DoubleStep.run
+    def run(self, *args):
+        err = original_run(self, *args)
+        refs.append(weakref.ref(self.b))
+        return(err)
+    DoubleStep.run = run
+    pipe.run()
+    
+    assert(sorted(pipe.clipboard.keys()) == ['total'])
+    assert(pipe.clipboard['total'] == 2. * 1024 * 1024)
+    assert(refs and refs[0]() is None)
+finally:
+    shutil.rmtree(checkpoint_dir, True)
+print('Clipboard freed: %s' % (pipe.clipboard))
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# Copyright (C) 2010 Association of Universities for Research in Astronomy(AURA)
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+# 
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+import os
+import shutil
+import tempfile
+
+from stpipe.batch import BatchRunner
+from stpipe.Pipeline import Pipeline
+from stpipe.Step import Step
+
+
+
+class ReadStep(Step):
+    def process(self):
+        self.content = open(self.file_name).read()
+        return(0)
+
+
+class CollectStep(Step):
+    collected = []
+    
+    def process(self):
+        self.collected.append(self.content)
+        return(0)
+
+
+
+# Batch a memoized reader over several files, twice: each input has its own 
+# cache entry, so the second pass gets each file content from the cache.
+directory = tempfile.mkdtemp()
+try:
+    inputs = []
+    for name in ('f1', 'f2', 'f3'):
+        inputs.append(os.path.join(directory, name))
+        open(inputs[-1], 'w').write('content-of-%s' % (name))
+    
+    pipe = Pipeline(name='MemoizeBatch', log_level='WARNING', 
+                    cache_dir=os.path.join(directory, 'cache'))
+    steps = [ReadStep('Read', pipe, [], [['content']], memoize=True, 
+                      file_name=inputs[0]), 
+             CollectStep('Collect', pipe, [['content']], [])]
+    pipe.configure(steps)
+    runner = BatchRunner(pipe, 'Read')
+    for i in range(2):
+        assert(not runner.run(inputs).failed)
+    expected = ['content-of-f1', 'content-of-f2', 'content-of-f3']
+    assert(CollectStep.collected == expected * 2)
+    assert(pipe.step_cache.hits == 3)
+    
+    # A file rewritten in place is read again.
+    open(inputs[0], 'w').write('new-content-of-f1')
+    mtime = os.path.getmtime(inputs[0]) + 10
+    os.utime(inputs[0], (mtime, mtime))
+    assert(not runner.run(inputs).failed)
+    assert(CollectStep.collected[-3:] == ['new-content-of-f1'] + expected[1:])
+    assert(pipe.step_cache.hits == 5)
+finally:
+    shutil.rmtree(directory, True)
+print('Memoized batch: %s' % (pipe.step_cache.summary()))
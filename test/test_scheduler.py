@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# Copyright (C) 2010 Association of Universities for Research in Astronomy(AURA)
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+# 
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+import time
+
+from stpipe.Pipeline import Pipeline
+from stpipe.Step import Step
+
+
+
+RAN = []
+
+class FailStep(Step):
+    def process(self):
+        RAN.append(self.name)
+        time.sleep(0.2)
+        return(1 / 0)
+
+
+
+class SleepStep(Step):
+    def process(self):
+        RAN.append(self.name)
+        time.sleep(0.5)
+        return(0)
+
+
+
+# Three independent Steps on two threads: once the first one fails, the third
+# one, queued behind the other two, is not started (the second one is already
+# running), and the exception tells where the failure happened.
+pipe = Pipeline(name='Scheduler', log_level='CRITICAL', max_workers=2)
+pipe.configure([FailStep('Fail', pipe, [], []), 
+                SleepStep('Sleep', pipe, [], []), 
+                SleepStep('Never', pipe, [], [])])
+try:
+    pipe.run()
+except Exception as e:
+    assert('ZeroDivisionError' in str(e) and 'test_scheduler.py' in str(e))
+else:
+    assert(False)
+assert(sorted(RAN) == ['Fail', 'Sleep'])
+print('Steps run: %s.' % (', '.join(RAN)))
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# Copyright (C) 2010 Association of Universities for Research in Astronomy(AURA)
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+# 
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+from stpipe.convenience import run_stream
+
+
+
+# Stream several copies of the same input file through the test pipeline, 
+# each Step being a separate stage.
+inputs = ['data/test.fits', ] * 8
+done = [item for item in run_stream('pipeline.cfg', inputs, 
+                                    input_step='ReadFitsImageStep')]
+assert(len(done) == len(inputs))
+assert(not [item for item in done if not item.ok])
+assert(sorted([item.index for item in done]) == range(len(inputs)))
+assert(not [item for item in done if not 'proc_image' in item.clipboard])
+
+
+
+# A failing input generator ends the stream (instead of blocking it forever) 
+# and its exception reaches the caller, once the items already fed are done.
+def failing_inputs():
+    yield('data/test.fits')
+    raise(IOError('no more inputs'))
+
+done = []
+try:
+    for item in run_stream('pipeline.cfg', failing_inputs(), 
+                           input_step='ReadFitsImageStep'):
+        done.append(item)
+except Exception as e:
+    assert('no more inputs' in str(e))
+else:
+    assert(False)
+assert(len(done) == 1 and done[0].ok)
+
+
+# With a clipboard budget, each streamed input gets its own spilling clipboard.
+from stpipe.clipboard import SpillingClipboard
+from stpipe.convenience import pipeline_from_config_file
+from stpipe.streaming import StreamingRunner
+
+# Its values and spill directory are gone once the next item is requested.
+import os
+import shutil
+import tempfile
+
+pipe = pipeline_from_config_file('pipeline.cfg')
+pipe.clipboard_budget = 1
+pipe.spill_dir = tempfile.mkdtemp()
+try:
+    runner = StreamingRunner(pipe, 'ReadFitsImageStep')
+    done = []
+    for item in runner.run(['data/test.fits', ] * 3):
+        assert(item.ok and isinstance(item.clipboard, SpillingClipboard))
+        assert(item.clipboard.resident_bytes <= 1024 * 1024)
+        assert('proc_image' in item.clipboard)
+        done.append(item)
+    assert(len(done) == 3)
+    assert(not [item for item in done if len(item.clipboard)])
+    assert(not os.listdir(pipe.spill_dir))
+finally:
+    pipe.close()
+    shutil.rmtree(pipe.spill_dir, True)
+
+
+
+# When profiling, each input is a profiled run of its own: the Pipeline 
+# profiler does not accumulate the Step runs of the whole stream.
+pipe = pipeline_from_config_file('pipeline.cfg')
+pipe.profile = True
+pipe.profiler = pipe.new_profiler()
+try:
+    runner = StreamingRunner(pipe, 'ReadFitsImageStep')
+    done = list(runner.run(['data/test.fits', ] * 4))
+    assert(not [item for item in done if not item.ok])
+    for item in done:
+        assert(item.profiler.run_id.endswith('.input%d' % (item.index)))
+        assert(len(item.profiler.profiles) == len(pipe.steps))
+    assert(not pipe.profiler.profiles)
+finally:
+    pipe.close()
+
+
+
+# Memory tracking measures the clipboard of each input, not the (empty) one of
+# the Pipeline.
+from stpipe.clipboard import sizeof
+
+pipe = pipeline_from_config_file('pipeline.cfg')
+pipe.profile = True
+pipe.track_memory = True
+try:
+    runner = StreamingRunner(pipe, 'ReadFitsImageStep')
+    for item in runner.run(['data/test.fits', ] * 2):
+        assert(item.ok)
+        assert(item.profiler.profiles[-1].memory['clipboard'] == 
+               sizeof(dict(item.clipboard)))
+finally:
+    pipe.close()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# Copyright (C) 2010 Association of Universities for Research in Astronomy(AURA)
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+# 
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+import numpy
+
+from stpipe.models import Image
+from stpipe.Pipeline import Pipeline
+from stpipe.Step import Step
+
+
+
+class MakeImagesStep(Step):
+    def process(self):
+        self.image = Image(data=numpy.arange(300. * 200.).reshape((300, 200)))
+        self.cube = [Image(data=numpy.ones((3, 50, 60)))]
+        return(0)
+
+
+
+class ScaleStep(Step):
+    """
+    All the pixel work, no process().
+    """
+    def process_tile(self, data):
+        return(data * 2.)
+
+
+
+# Any Step defining process_tile() has it applied, tile by tile and in 
+# parallel, to its Image inputs.
+pipe = Pipeline(name='TileStep', log_level='WARNING')
+steps = [MakeImagesStep('Make', pipe, [], [['image'], ['cube']]), 
+         ScaleStep('Scale', pipe, [['image'], ['cube']], [], 
+                   tile_shape=[64, 64], tile_halo=2, tile_processes=2)]
+pipe.configure(steps)
+pipe.run()
+image = pipe.clipboard['image']
+assert((image.data == numpy.arange(300. * 200.).reshape((300, 200)) * 2).all())
+assert((pipe.clipboard['cube'][0].data == 2.).all())
+print('Tiled %s and %s.' % (image.shape, pipe.clipboard['cube'][0].shape))
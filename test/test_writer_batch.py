@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# Copyright (C) 2010 Association of Universities for Research in Astronomy(AURA)
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+# 
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+
+import numpy
+import pyfits
+
+from stpipe.batch import BatchRunner
+from stpipe.FitsIOSteps import FitsImageWriterStep
+from stpipe.models import Image
+from stpipe.Pipeline import Pipeline
+from stpipe.Step import Step
+
+
+
+class MakeImageStep(Step):
+    def process(self):
+        self.image = Image(data=numpy.zeros((8, 8)) + int(self.file_name))
+        return(0)
+
+
+
+# Write one FITS file per batch input from several worker processes: each 
+# output is named after its own input.
+directory = tempfile.mkdtemp()
+try:
+    pipe = Pipeline(name='WriterBatch', log_level='WARNING')
+    file_name = os.path.join(directory, 'out_{count}_{input}.fits')
+    steps = [MakeImageStep('Make', pipe, [], [['image']], file_name='0'), 
+             FitsImageWriterStep('Write', pipe, [['image']], [], 
+                                 file_name=file_name)]
+    pipe.configure(steps)
+    
+    # The writer thread started by this run does not survive the fork: worker
+    # processes must start their own instead of waiting for it forever.
+    pipe.run()
+    os.remove(os.path.join(directory, 'out_0_None.fits'))
+    pickle.dumps(steps[1])
+    
+    inputs = [str(i * 10) for i in range(6)]
+    report = BatchRunner(pipe, 'Make', workers=2, processes=True).run(inputs)
+    assert(not report.failed)
+    for (i, item) in enumerate(inputs):
+        data = pyfits.getdata(os.path.join(directory, 
+                                           'out_%d_%s.fits' % (i, item)))
+        assert((data == int(item)).all())
+    assert(len(os.listdir(directory)) == len(inputs))
+    
+    # Closing the Pipeline stops the writer thread.
+    threads = threading.active_count()
+    pipe.close()
+    assert(threading.active_count() == threads - 1)
+finally:
+    shutil.rmtree(directory, True)
+print(report.summary())